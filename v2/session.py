@@ -0,0 +1,196 @@
+# session.py - Долгоживущая сессия WhatsApp Web для функций vatsan.py
+#
+#     from session import send_message, send_file
+#     send_message("Контакт", "Текст")            # True/False, Chrome не перезапускается
+#     send_file("Контакт", "1.jpg", "подпись")
+#
+# Первый вызов сам запускает демон (python3 session.py), Chrome открывается при первой
+# отправке и дальше живёт между вызовами. Демон один на профиль: второй экземпляр не
+# стартует, поэтому параллельные вызовы из cron не делят user-data-dir, а встают в очередь.
+import os
+import sys
+import json
+import time
+import errno
+import fcntl
+import signal
+import socket
+import threading
+import subprocess
+import socketserver
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOCKET_PATH = os.path.join(BASE_DIR, "session.sock")
+LOCK_PATH = os.path.join(BASE_DIR, "session.lock")
+LOG_PATH = os.path.join(BASE_DIR, "session.log")
+
+ACTIONS = ("send_message", "send_file", "ping")
+
+
+class Session:
+    """Один залогиненный Chrome; отправки выполняются строго по очереди"""
+
+    def __init__(self):
+        self.driver = None
+        self.lock = threading.Lock()
+
+    def _alive(self):
+        try:
+            self.driver.window_handles
+            return True
+        except Exception:
+            return False
+
+    def _ensure_driver(self):
+        """Запускает Chrome, только если он ещё не запущен или упал"""
+        if self.driver is not None and self._alive():
+            return self.driver
+        self.close()
+        import vatsan
+        self.driver = vatsan.login()
+        if self.driver is None:
+            raise RuntimeError("Не удалось войти в WhatsApp Web")
+        return self.driver
+
+    def run(self, request):
+        action = request.get("action")
+        if action == "ping":
+            return True
+        import vatsan
+        with self.lock:
+            driver = self._ensure_driver()
+            if action == "send_message":
+                return bool(vatsan.send_message(driver, request["contact"], request["message"]))
+            if action == "send_file":
+                return bool(vatsan.send_file(driver, request["contact"], request["file_path"],
+                                             request.get("caption")))
+        raise ValueError(f"Неизвестное действие: {action}")
+
+    def close(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                print(f"Ошибка при закрытии драйвера: {e}")
+            self.driver = None
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("Ожидается объект JSON")
+                response = {"ok": self.server.session.run(request)}
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode('utf-8'))
+            self.wfile.flush()
+
+
+class SessionServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path=SOCKET_PATH):
+        self.socket_path = socket_path
+        self.session = Session()
+        if os.path.exists(socket_path):
+            # Сокет от упавшего демона; живой демон держит блокировку и сюда не пустит
+            os.remove(socket_path)
+        super().__init__(socket_path, _Handler)
+        os.chmod(socket_path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        self.session.close()
+        try:
+            os.remove(self.socket_path)
+        except OSError:
+            pass
+
+
+def _request(request, timeout):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(SOCKET_PATH)
+        sock.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode('utf-8'))
+        line = sock.makefile('r', encoding='utf-8').readline()
+    finally:
+        sock.close()
+    if not line:
+        raise ConnectionError("Демон сессии закрыл соединение без ответа")
+    return json.loads(line)
+
+
+def _spawn_daemon(wait=15):
+    """Запускает демон в фоне и ждёт, пока он начнёт слушать сокет"""
+    with open(LOG_PATH, 'a') as log:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__)], cwd=BASE_DIR,
+                         stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                         start_new_session=True)
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        try:
+            return _request({"action": "ping"}, timeout=5)
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Демон сессии не запустился, см. {LOG_PATH}")
+
+
+def call(request, timeout=180, spawn=True):
+    """Выполняет запрос в сессии; если демона нет - запускает его"""
+    try:
+        response = _request(request, timeout)
+    except OSError as e:
+        if not spawn or e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+            raise
+        _spawn_daemon()
+        response = _request(request, timeout)
+    if response.get("error"):
+        print(f"Ошибка в сессии: {response['error']}")
+    return response.get("ok", False)
+
+
+def send_message(contact_name, message):
+    """Отправляет текстовое сообщение через общую сессию"""
+    return call({"action": "send_message", "contact": contact_name, "message": message})
+
+
+def send_file(contact_name, file_path, caption=None):
+    """Отправляет файл через общую сессию (путь передаётся абсолютным)"""
+    return call({"action": "send_file", "contact": contact_name,
+                 "file_path": os.path.abspath(file_path), "caption": caption})
+
+
+def main():
+    lock_file = open(LOCK_PATH, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print("Демон сессии уже запущен")
+        return 0
+
+    os.chdir(BASE_DIR)
+    sys.path.insert(0, BASE_DIR)
+    server = SessionServer()
+
+    def stop(signum, frame):
+        print(f"\nПолучен сигнал {signum}. Остановка сессии...")
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    print(f"Сессия WhatsApp Web слушает {SOCKET_PATH}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        lock_file.close()
+        print("Сессия остановлена")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
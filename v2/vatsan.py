@@ -1,16 +1,26 @@
 import os
-import time
+import sys
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.keys import Keys
 #from config import CONTACT_NAME, FILE_PATH, CAPTION_TEXT
-from config import CONTACT_NAME
+try:
+    from config import CONTACT_NAME
+except ImportError:
+    # Без config.py модуль можно импортировать ради функций (например, из v4/bench)
+    CONTACT_NAME = None
+
+# Общий с v4 реестр селекторов
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "v4", "service"))
+from selector_registry import SelectorRegistry
+from dom_wait import wait_for_element
+
+SELECTORS = SelectorRegistry(os.path.join(BASE_DIR, "selector_cache.json"))
 
 def login():
     """
@@ -33,9 +43,7 @@ def login():
     driver.get("https://web.whatsapp.com/")
     
     try:
-        WebDriverWait(driver, 60).until(
-            EC.presence_of_element_located((By.XPATH, '//*[@id="side"]'))
-        )
+        wait_element(driver, By.XPATH, '//*[@id="side"]', timeout=60)
         print("Вход выполнен успешно!")
         return driver
     except TimeoutException:
@@ -43,35 +51,41 @@ def login():
         driver.quit()
         return None
 
-def find_element_with_fallback(driver, selectors, timeout=5):
+def wait_element(driver, by, value, timeout=10, clickable=False):
+    """
+    Ждёт элемент наблюдателем в странице: отвечает сразу при появлении,
+    по истечении timeout - TimeoutException, как WebDriverWait
+    """
+    element = wait_for_element(driver, by, value, timeout=timeout, clickable=clickable)
+    if element is None:
+        raise TimeoutException(f"Элемент {value} не появился за {timeout} с")
+    return element
+
+def is_chat_open(driver, contact_name):
     """
-    Ищет элемент по списку селекторов с fallback
+    Проверяет по заголовку беседы, что нужный чат уже открыт
     """
-    for selector_data in selectors:
-        try:
-            by_type, selector = selector_data
-            element = WebDriverWait(driver, timeout).until(
-                EC.presence_of_element_located((by_type, selector))
-            )
-            return element
-        except TimeoutException:
-            continue
-    return None
+    title = driver.execute_script("""
+        var header = document.querySelector('#main header');
+        if (!header) return null;
+        var span = header.querySelector('span[title]') || header.querySelector('span[dir="auto"]');
+        return span ? (span.getAttribute('title') || span.textContent) : null;
+    """)
+    return title == contact_name
 
-def find_clickable_element_with_fallback(driver, selectors, timeout=5):
+def find_element_with_fallback(driver, selectors, timeout=5, role=None):
+    """
+    Ищет элемент по списку селекторов с fallback.
+    Все селекторы проверяются одним запросом, сработавший запоминается для role
+    """
+    return SELECTORS.find(driver, role or selectors[0][1], candidates=selectors, timeout=timeout)
+
+def find_clickable_element_with_fallback(driver, selectors, timeout=5, role=None):
     """
     Ищет кликабельный элемент по списку селекторов с fallback
     """
-    for selector_data in selectors:
-        try:
-            by_type, selector = selector_data
-            element = WebDriverWait(driver, timeout).until(
-                EC.element_to_be_clickable((by_type, selector))
-            )
-            return element
-        except TimeoutException:
-            continue
-    return None
+    return SELECTORS.find(driver, role or selectors[0][1], candidates=selectors,
+                          timeout=timeout, clickable=True)
 
 def send_file(driver, contact_name, file_path, caption=None):
     """
@@ -79,11 +93,9 @@ def send_file(driver, contact_name, file_path, caption=None):
     """
     try:
         # 1. Проверяем, открыт ли уже нужный чат
-        try:
-            current_chat = driver.find_element(By.XPATH, f'//span[@title="{contact_name}"]//ancestor::div[contains(@class, "selected") or contains(@style, "background")]')
-            if current_chat:
-                print(f"Чат '{contact_name}' уже открыт.")
-        except:
+        if is_chat_open(driver, contact_name):
+            print(f"Чат '{contact_name}' уже открыт.")
+        else:
             # Чат не открыт, ищем и открываем
 #            print(f"Открываем чат с '{contact_name}'...")
             
@@ -94,19 +106,16 @@ def send_file(driver, contact_name, file_path, caption=None):
                 (By.CSS_SELECTOR, '[data-testid="chat-list-search"]'),           # Альтернативный
             ]
             
-            search_box = find_element_with_fallback(driver, search_selectors)
+            search_box = find_element_with_fallback(driver, search_selectors, role="search_box")
             if not search_box:
                 print("Не удалось найти поле поиска")
                 return False
                 
             search_box.clear()
             search_box.send_keys(contact_name)
-            time.sleep(1)
             
-            # Открываем чат с контактом
-            contact = WebDriverWait(driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, f'//span[@title="{contact_name}"]'))
-            )
+            # Открываем чат с контактом, как только он появится в результатах
+            contact = wait_element(driver, By.XPATH, f'//span[@title="{contact_name}"]', clickable=True)
             contact.click()
 #            print("Чат открыт.")
 #            time.sleep(1)
@@ -119,7 +128,7 @@ def send_file(driver, contact_name, file_path, caption=None):
             (By.CSS_SELECTOR, '[data-testid="clip"]'),            # Альтернативный
         ]
         
-        attach_btn = find_clickable_element_with_fallback(driver, attach_selectors)
+        attach_btn = find_clickable_element_with_fallback(driver, attach_selectors, role="attach_button")
         if not attach_btn:
             print("Не удалось найти кнопку прикрепления")
             return False
@@ -127,9 +136,7 @@ def send_file(driver, contact_name, file_path, caption=None):
         attach_btn.click()
         
         # 3. Находим input для файлов
-        file_input = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, 'input[type="file"][accept*="image"]'))
-        )
+        file_input = wait_element(driver, By.CSS_SELECTOR, 'input[type="file"][accept*="image"]')
         
         absolute_file_path = os.path.abspath(file_path)
         file_input.send_keys(absolute_file_path)
@@ -143,7 +150,7 @@ def send_file(driver, contact_name, file_path, caption=None):
             (By.CSS_SELECTOR, '.media-viewer'),                                      # Альтернативный
         ]
         
-        preview_element = find_element_with_fallback(driver, preview_selectors, timeout=3)
+        preview_element = find_element_with_fallback(driver, preview_selectors, timeout=3, role="preview")
         if not preview_element:
             print("Окно предпросмотра не появилось. Возможно, файл уже загружен.")
         
@@ -158,7 +165,7 @@ def send_file(driver, contact_name, file_path, caption=None):
                 (By.CSS_SELECTOR, '[data-testid="media-caption-input"]'),     # Альтернативный
             ]
             
-            caption_box = find_element_with_fallback(driver, caption_selectors)
+            caption_box = find_element_with_fallback(driver, caption_selectors, role="caption_box")
             if caption_box:
                 caption_box.send_keys(caption)
                 print("Подпись добавлена.")
@@ -176,7 +183,7 @@ def send_file(driver, contact_name, file_path, caption=None):
             (By.CSS_SELECTOR, '[data-testid="send"]'),                     # Новый интерфейс
         ]
         
-        send_btn = find_clickable_element_with_fallback(driver, send_selectors)
+        send_btn = find_clickable_element_with_fallback(driver, send_selectors, role="send_button")
         if send_btn:
             send_btn.click()
             print("✓ Файл успешно отправлен.")
@@ -195,11 +202,9 @@ def send_message(driver, contact_name, message):
     """
     try:
         # Проверяем, открыт ли уже нужный чат
-        try:
-            current_chat = driver.find_element(By.XPATH, f'//span[@title="{contact_name}"]//ancestor::div[contains(@class, "selected") or contains(@style, "background")]')
-            if current_chat:
-                print(f"Чат '{contact_name}' уже открыт.")
-        except:
+        if is_chat_open(driver, contact_name):
+            print(f"Чат '{contact_name}' уже открыт.")
+        else:
             # Чат не открыт, ищем и открываем
             search_selectors = [
                 (By.CSS_SELECTOR, '[aria-label="Поиск контактов или групп"]'),  # Русский
@@ -207,19 +212,16 @@ def send_message(driver, contact_name, message):
                 (By.XPATH, '//div[@contenteditable="true" and @data-tab="3"]'),  # Универсальный
             ]
             
-            search_box = find_element_with_fallback(driver, search_selectors)
+            search_box = find_element_with_fallback(driver, search_selectors, role="search_box")
             if not search_box:
                 print("Не удалось найти поле поиска")
                 return False
                 
             search_box.clear()
             search_box.send_keys(contact_name)
-            time.sleep(1)
             
             # Ждем, пока появится нужный контакт
-            contact = WebDriverWait(driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, f'//span[@title="{contact_name}"]'))
-            )
+            contact = wait_element(driver, By.XPATH, f'//span[@title="{contact_name}"]', clickable=True)
             contact.click()
 #            time.sleep(1)
         
@@ -230,7 +232,7 @@ def send_message(driver, contact_name, message):
             (By.XPATH, '//div[@contenteditable="true" and @data-tab="10"]'), # Универсальный
         ]
         
-        message_box = find_element_with_fallback(driver, message_selectors)
+        message_box = find_element_with_fallback(driver, message_selectors, role="message_box")
         if not message_box:
             print("Не удалось найти поле для сообщения")
             return False
@@ -248,11 +250,8 @@ def send_message(driver, contact_name, message):
         print(f"Не удалось отправить сообщение. Ошибка: {e}")
 
 if __name__ == "__main__":
-    driver = login()
-    if driver:
-        send_message(driver, CONTACT_NAME, "TopTop")
-        time.sleep(1)
-        send_file(driver, CONTACT_NAME, "1.jpg", "text")
-        time.sleep(3)
-        # Эта команда критически важна для закрытия браузера
-        driver.quit()
\ No newline at end of file
+    # Отправка через долгоживущую сессию (session.py): Chrome запускается один раз
+    # и остаётся открытым для следующих вызовов. Остановить: kill $(pgrep -f session.py)
+    import session
+    session.send_message(CONTACT_NAME, "TopTop")
+    session.send_file(CONTACT_NAME, "1.jpg", "text")
\ No newline at end of file
@@ -0,0 +1,363 @@
+# bench.py - Нагрузочный прогон воркера и функций v2 на локальной копии WhatsApp Web
+#
+# Запуск (нужны Chrome, chromedriver, selenium и psutil; сеть и аккаунт не нужны):
+#     python3 bench.py --messages 100 --latency 30 --json result.json
+# Для каждой нагрузки (text, image, mixed) печатает сообщений/с, p50/p99 по этапам
+# и RSS дерева процессов Chrome. Путь к chromedriver можно задать в CHROMEDRIVER_PATH.
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import struct
+import shutil
+import argparse
+import tempfile
+import threading
+import functools
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "service"))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "..", "v2"))
+
+import psutil
+from metrics import Metrics, _label_key
+from chromedriver_cache import resolve_chromedriver
+
+PAGE_NAME = "fake_whatsapp.html"
+WORKLOADS = ("text", "image", "mixed")
+# Кэш пути chromedriver общий для всех прогонов, чтобы не ходить в сеть каждый раз
+CHROMEDRIVER_CACHE = os.path.join(tempfile.gettempdir(), "messhub-bench-chromedriver.json")
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_page_server(host="127.0.0.1"):
+    """Отдаёт каталог bench по HTTP в фоновом потоке"""
+    handler = functools.partial(_QuietHandler, directory=BENCH_DIR)
+    server = ThreadingHTTPServer((host, 0), handler)
+    thread = threading.Thread(target=server.serve_forever, name="bench-http", daemon=True)
+    thread.start()
+    return server
+
+
+def page_url(server, args):
+    host, port = server.server_address[:2]
+    return (f"http://{host}:{port}/{PAGE_NAME}?lang={args.lang}&latency={args.latency}"
+            f"&upload={args.upload_latency}&chats={args.chats}&visible={args.visible}")
+
+
+def write_png(path, width, height, color):
+    """Картинка-градиент без Pillow: PNG собирается вручную"""
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xffffffff)
+
+    rows = []
+    for y in range(height):
+        shade = y * 255 // max(height - 1, 1)
+        pixel = bytes(((color[0] + shade) % 256, (color[1] + shade) % 256, color[2]))
+        rows.append(b"\x00" + pixel * width)
+    raw = zlib.compress(b"".join(rows), 6)
+    with open(path, 'wb') as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", raw))
+        f.write(chunk(b"IEND", b""))
+
+
+def make_images(work_dir, count=5, width=1280, height=960):
+    paths = []
+    for number in range(count):
+        path = os.path.join(work_dir, f"bench_{number}.png")
+        write_png(path, width, height, ((number * 50) % 256, (number * 90) % 256, 128))
+        paths.append(path)
+    return paths
+
+
+def make_tasks(workload, count, chats, images, seed=1):
+    """Задачи в формате очереди; чаты и длины сообщений повторяются от прогона к прогону"""
+    rng = random.Random(seed)
+    tasks = []
+    for number in range(count):
+        if workload == "mixed":
+            content_type = "image" if rng.random() < 0.3 else "text"
+        else:
+            content_type = workload
+        words = " ".join(f"слово{rng.randint(1, 999)}" for _ in range(rng.randint(3, 40)))
+        task = {
+            "id": f"bench-{workload}-{number:05d}",
+            "target": f"Chat {rng.randint(1, chats)}",
+            "content_type": content_type,
+            "message": words,
+            "enqueued_at": time.time(),
+        }
+        if content_type == "image":
+            task["file_path"] = images[number % len(images)]
+            task["message"] = words[:60]
+        tasks.append(task)
+    return tasks
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class SampleMetrics(Metrics):
+    """Metrics, который дополнительно хранит все замеры этапов для точных перцентилей"""
+
+    def __init__(self):
+        super().__init__()
+        self.samples = {}
+
+    def observe(self, name, seconds, **labels):
+        super().observe(name, seconds, **labels)
+        if name == "whatsapp_stage_seconds":
+            self.samples.setdefault(labels.get("stage"), []).append(seconds)
+
+    def total(self, name, **labels):
+        """Сумма счётчика name по всем сериям, у которых совпадают метки labels"""
+        wanted = set(_label_key(labels))
+        return sum(value for (counter, key), value in self.counters.items()
+                   if counter == name and wanted <= set(key))
+
+
+class RssSampler:
+    """Фоновый замер суммарного RSS процессов от chromedriver вниз"""
+
+    def __init__(self, root_pid, interval=0.5):
+        self.root_pid = root_pid
+        self.interval = interval
+        self.peak = 0
+        self.last = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bench-rss", daemon=True)
+        self._thread.start()
+
+    def sample(self):
+        try:
+            root = psutil.Process(self.root_pid)
+            processes = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return
+        rss = 0
+        for proc in processes:
+            try:
+                rss += proc.memory_info().rss
+            except psutil.Error:
+                continue
+        self.last = rss
+        self.peak = max(self.peak, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def launch_chrome(profile_path):
+    """Headless Chrome с отдельным профилем, как в v2 login(), но без сети"""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.chrome.options import Options
+
+    options = Options()
+    options.add_argument(f"--user-data-dir={profile_path}")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--headless=new")
+    service = Service(resolve_chromedriver(CHROMEDRIVER_CACHE))
+    driver = webdriver.Chrome(service=service, options=options)
+    return driver, service
+
+
+def run_worker(url, tasks, work_dir, args):
+    """Прогон WhatsAppWorker: задачи кладутся в pending, воркер работает до пустой очереди"""
+    from whatswork import WhatsAppWorker
+    from queue_backend import FileQueueBackend
+
+    queue_dir = os.path.join(work_dir, "queue")
+    backend = FileQueueBackend(queue_dir)
+    for path in (backend.pending_dir, backend.processing_dir, backend.failed_dir):
+        os.makedirs(path, exist_ok=True)
+    for task in tasks:
+        with open(backend.pending_path_for(f"{task['id']}.json"), 'w', encoding='utf-8') as f:
+            json.dump(task, f, ensure_ascii=False)
+
+    metrics = SampleMetrics()
+    worker = WhatsAppWorker(queue_dir=queue_dir, profile_path=os.path.join(work_dir, "profile"),
+                            queue_backend=backend, min_message_interval=0, metrics=metrics,
+                            text_input_engine=args.engine, album_mode=args.album, web_url=url,
+                            browser_engine=args.browser)
+    if args.browser == "selenium":
+        worker.chromedriver_path = resolve_chromedriver(CHROMEDRIVER_CACHE)
+    sampler = None
+    try:
+        worker.init_browser()
+        sampler = RssSampler(worker.browser.root_pid)
+        started = time.monotonic()
+        previous_ids = None
+        while True:
+            pending = worker.scan_pending_tasks()
+            # Ничего не ушло из pending за проход (например, чат не открывается) - выходим
+            pending_ids = {task['id'] for task in pending}
+            if not pending or pending_ids == previous_ids:
+                break
+            previous_ids = pending_ids
+            worker.process_grouped_tasks(worker.group_tasks_by_chat(pending))
+        elapsed = time.monotonic() - started
+    finally:
+        if sampler:
+            sampler.stop()
+        worker.cleanup()
+
+    samples = dict(metrics.samples)
+    samples.pop("scan", None)
+    # Отправленные - только успешные; dead и оставшиеся в pending тоже не доставлены
+    sent = metrics.total("whatsapp_tasks_total", result="sent")
+    return elapsed, sent, len(tasks) - sent, samples, sampler
+
+
+def run_v2(url, tasks, work_dir, args):
+    """Прогон функций v2/vatsan.py по одной задаче за вызов"""
+    import vatsan
+    from selector_registry import SelectorRegistry
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    # Выученные селекторы прогона не должны попадать в кэш v2
+    vatsan.SELECTORS = SelectorRegistry(None)
+    driver, service = launch_chrome(os.path.join(work_dir, "profile"))
+    sampler = None
+    samples = {"send_message": [], "send_file": []}
+    sent = 0
+    try:
+        driver.get(url)
+        WebDriverWait(driver, 60).until(EC.presence_of_element_located((By.XPATH, '//*[@id="side"]')))
+        sampler = RssSampler(service.process.pid)
+        started = time.monotonic()
+        for task in tasks:
+            task_started = time.monotonic()
+            if task["content_type"] == "text":
+                ok = vatsan.send_message(driver, task["target"], task["message"])
+                stage = "send_message"
+            else:
+                ok = vatsan.send_file(driver, task["target"], task["file_path"], task["message"])
+                stage = "send_file"
+            samples[stage].append(time.monotonic() - task_started)
+            if ok:
+                sent += 1
+        elapsed = time.monotonic() - started
+    finally:
+        if sampler:
+            sampler.stop()
+        driver.quit()
+        service.stop()
+
+    return elapsed, sent, len(tasks) - sent, {k: v for k, v in samples.items() if v}, sampler
+
+
+RUNNERS = {"worker": run_worker, "v2": run_v2}
+
+
+def run_case(target, workload, url, images, args):
+    tasks = make_tasks(workload, args.messages, args.chats, images, seed=args.seed)
+    work_dir = tempfile.mkdtemp(prefix=f"bench-{target}-{workload}-")
+    try:
+        elapsed, sent, failed, samples, sampler = RUNNERS[target](url, tasks, work_dir, args)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "target": target,
+        "workload": workload,
+        "messages": len(tasks),
+        "sent": sent,
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(sent / elapsed, 2) if elapsed else None,
+        "stages": {
+            stage: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 0.5) * 1000, 1),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+            }
+            for stage, values in sorted(samples.items())
+        },
+        "chrome_rss_peak_mb": sampler.peak // (1024 * 1024) if sampler else None,
+        "chrome_rss_end_mb": sampler.last // (1024 * 1024) if sampler else None,
+    }
+
+
+def print_result(result):
+    print(f"\n{result['target']} / {result['workload']}: "
+          f"{result['sent']}/{result['messages']} отправлено, {result['failed']} ошибок, "
+          f"{result['seconds']} с, {result['messages_per_second']} сообщ./с, "
+          f"RSS Chrome пик {result['chrome_rss_peak_mb']} МБ, в конце {result['chrome_rss_end_mb']} МБ")
+    for stage, stats in result["stages"].items():
+        print(f"    {stage:<14} n={stats['count']:<5} p50 {stats['p50_ms']:>8} мс   p99 {stats['p99_ms']:>8} мс")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон на локальной копии WhatsApp Web")
+    parser.add_argument("--target", choices=("worker", "v2", "both"), default="both")
+    parser.add_argument("--workload", choices=WORKLOADS + ("all",), default="all")
+    parser.add_argument("--messages", type=int, default=100, help="задач на одну нагрузку")
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--visible", type=int, default=8, help="чатов в боковой панели без поиска")
+    parser.add_argument("--latency", type=int, default=30, help="задержка интерфейса, мс")
+    parser.add_argument("--upload-latency", type=int, default=150, help="загрузка превью на файл, мс")
+    parser.add_argument("--lang", choices=("ru", "en"), default="ru")
+    parser.add_argument("--engine", choices=("cdp", "paste", "keys"), default="cdp",
+                        help="способ ввода текста воркера")
+    parser.add_argument("--browser", choices=("selenium", "cdp"), default="selenium",
+                        help="браузерный движок воркера")
+    parser.add_argument("--album", action="store_true", help="альбомы в воркере")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="сохранить результаты в файл для сравнения прогонов")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    targets = ("worker", "v2") if args.target == "both" else (args.target,)
+    workloads = WORKLOADS if args.workload == "all" else (args.workload,)
+
+    server = start_page_server()
+    url = page_url(server, args)
+    images_dir = tempfile.mkdtemp(prefix="bench-images-")
+    results = []
+    try:
+        images = make_images(images_dir)
+        for target in targets:
+            for workload in workloads:
+                print(f"Прогон {target} / {workload} ({args.messages} задач, {url})")
+                result = run_case(target, workload, url, images, args)
+                print_result(result)
+                results.append(result)
+    finally:
+        server.shutdown()
+        shutil.rmtree(images_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"options": vars(args), "results": results}, f, indent=2, ensure_ascii=False)
+        print(f"\nРезультаты сохранены в {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,193 @@
+# browser_engine.py - Операции воркера в браузере: поиск, клик, ввод, загрузка, ожидание
+#
+# Реализации: SeleniumEngine (chromedriver) и CdpEngine из cdp_engine.py (DevTools напрямую).
+# Скрипты пишутся как для Selenium execute_script: тело функции с arguments.
+import psutil
+from dom_wait import wait_until
+
+# Общие флаги Chrome; профиль и порт отладки добавляет сам движок
+CHROME_ARGUMENTS = (
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-web-security",
+    "--disable-features=VizDisplayCompositor",
+    "--user-agent=Mozilla/5.0 (iPad; CPU OS 13_6 like Mac OS X) "
+    "AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.1.2 Mobile/15E148 Safari/604.1",
+    # Убрать после первого входа в сессию и необходимости оконного режима
+    "--headless=new",
+)
+
+# Клавиши для press_key: имя -> код клавиши
+KEYS = {
+    "Enter": 13,
+    "Escape": 27,
+}
+
+
+class EngineError(Exception):
+    """Команда браузеру не выполнена или соединение с ним потеряно"""
+
+
+class BrowserEngine:
+    """
+    То, что WhatsAppWorker делает в браузере. Элементы - непрозрачные ссылки,
+    которые возвращают execute_script / wait_for и принимают остальные методы.
+    """
+
+    name = None
+
+    @property
+    def root_pid(self):
+        """Pid корневого процесса браузера (для ChromeProcessTree); None, пока он не запущен"""
+        raise NotImplementedError
+
+    def launch(self, profile_path, arguments=CHROME_ARGUMENTS):
+        raise NotImplementedError
+
+    def open(self, url):
+        raise NotImplementedError
+
+    def execute_script(self, script, *args):
+        raise NotImplementedError
+
+    def wait_for(self, script, *args, timeout=10):
+        """Значение script, как только оно станет истинным; None по истечении timeout"""
+        raise NotImplementedError
+
+    def click(self, element):
+        raise NotImplementedError
+
+    def clear(self, element):
+        raise NotImplementedError
+
+    def type_text(self, element, text):
+        """Вводит text в element, переносы строк - как Shift+Enter"""
+        raise NotImplementedError
+
+    def press_key(self, element, key):
+        """Нажимает клавишу из KEYS в element (None - в активном элементе страницы)"""
+        raise NotImplementedError
+
+    def upload(self, element, paths):
+        """Выбирает файлы в input[type=file]"""
+        raise NotImplementedError
+
+    def concurrently(self, *functions):
+        """Выполняет независимые операции; движок может делать это параллельно"""
+        return [function() for function in functions]
+
+    def instrument(self, tracer):
+        pass
+
+    def alive(self):
+        """Дешёвая проверка без обращения к странице: процессы браузера живы"""
+        return True
+
+    def release_handles(self):
+        """Отпускает ссылки на элементы, полученные до этого момента"""
+
+    def quit(self):
+        raise NotImplementedError
+
+
+class SeleniumEngine(BrowserEngine):
+    """Chrome через chromedriver: каждая операция - HTTP-запрос к драйверу"""
+
+    name = "selenium"
+
+    def __init__(self, chromedriver_path, text_input_engine="cdp", implicit_wait=0):
+        self.chromedriver_path = chromedriver_path
+        self.text_input_engine = text_input_engine
+        # Ожидания идут через wait_for; неявное ожидание сверху только удлиняет промахи
+        self.implicit_wait = implicit_wait
+        self.driver = None
+        self.service = None
+        self.text_input = None
+
+    @property
+    def root_pid(self):
+        # Service запускает chromedriver внутри webdriver.Chrome, до создания сессии
+        process = getattr(self.service, "process", None)
+        return process.pid if process is not None else None
+
+    def launch(self, profile_path, arguments=CHROME_ARGUMENTS):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+        from selenium.webdriver.chrome.options import Options
+        from text_input import TextInput
+
+        options = Options()
+        options.add_argument(f"--user-data-dir={profile_path}")
+        options.add_argument("--remote-debugging-port=0")  # Случайный порт
+        for argument in arguments:
+            options.add_argument(argument)
+        self.service = Service(self.chromedriver_path)
+        self.driver = webdriver.Chrome(service=self.service, options=options)
+        self.driver.implicitly_wait(self.implicit_wait)
+        self.text_input = TextInput(self.driver, self.text_input_engine)
+
+    def open(self, url):
+        self.driver.get(url)
+
+    def execute_script(self, script, *args):
+        return self.driver.execute_script(script, *args)
+
+    def wait_for(self, script, *args, timeout=10):
+        return wait_until(self.driver, script, *args, timeout=timeout)
+
+    def click(self, element):
+        element.click()
+
+    def clear(self, element):
+        element.clear()
+
+    def type_text(self, element, text):
+        self.text_input.type(element, text)
+
+    def press_key(self, element, key):
+        from selenium.webdriver.common.keys import Keys
+        from selenium.webdriver.common.action_chains import ActionChains
+
+        keys = {"Enter": Keys.ENTER, "Escape": Keys.ESCAPE}[key]
+        if element is None:
+            ActionChains(self.driver).send_keys(keys).perform()
+        else:
+            element.send_keys(keys)
+
+    def upload(self, element, paths):
+        element.send_keys("\n".join(paths))
+
+    def instrument(self, tracer):
+        tracer.instrument_driver(self.driver)
+
+    def alive(self):
+        if self.service is None or self.service.process is None:
+            return False
+        if self.service.process.poll() is not None:
+            return False
+        # chromedriver без потомков - Chrome под ним упал
+        try:
+            return bool(psutil.Process(self.service.process.pid).children())
+        except psutil.Error:
+            return False
+
+    def quit(self):
+        if self.driver:
+            try:
+                self.driver.quit()
+                print("Драйвер закрыт")
+            except Exception as e:
+                print(f"Ошибка при закрытии драйвера: {e}")
+            finally:
+                self.driver = None
+
+        if self.service:
+            try:
+                self.service.stop()
+                print("Сервис остановлен")
+            except Exception as e:
+                print(f"Ошибка при остановке сервиса: {e}")
+            finally:
+                self.service = None
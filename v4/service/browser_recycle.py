@@ -0,0 +1,48 @@
+# browser_recycle.py - Решение о перезапуске браузера по реальному потреблению ресурсов
+import time
+from collections import deque
+
+
+class RecyclePolicy:
+    """Перезапуск только когда сессия действительно раздулась"""
+
+    def __init__(self, max_rss_mb=1500, max_cpu_percent=150, cpu_samples=5,
+                 check_interval=30, max_operations=None):
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.max_cpu_percent = max_cpu_percent
+        self.check_interval = check_interval
+        self.max_operations = max_operations
+        self._cpu_history = deque(maxlen=cpu_samples)
+        self._last_check = 0.0
+        self.last_usage = None
+
+    def reset(self):
+        """Вызывается после перезапуска браузера"""
+        self._cpu_history.clear()
+        self._last_check = time.monotonic()
+        self.last_usage = None
+
+    def should_recycle(self, chrome_tree, operation_count):
+        """Причина перезапуска или None; chrome_tree - ChromeProcessTree воркера"""
+        if self.max_operations and operation_count > self.max_operations:
+            return f"выполнено {operation_count} операций"
+
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return None
+        self._last_check = now
+
+        usage = chrome_tree.usage()
+        self.last_usage = usage
+        if usage is None:
+            return None
+
+        if usage["rss"] > self.max_rss:
+            return f"RSS {usage['rss'] // (1024 * 1024)} МБ"
+
+        # CPU оцениваем по нескольким замерам подряд, разовые всплески не в счёт
+        self._cpu_history.append(usage["cpu_percent"])
+        if (len(self._cpu_history) == self._cpu_history.maxlen
+                and min(self._cpu_history) > self.max_cpu_percent):
+            return f"CPU {usage['cpu_percent']:.0f}% в {len(self._cpu_history)} замерах подряд"
+        return None
@@ -0,0 +1,128 @@
+# browser_watchdog.py - Сторож браузерных операций: срок на операцию и проверка живости браузера
+#
+# Операции воркера (открытие чата, отправка, запуск браузера) идут внутри guard(name, timeout).
+# Если операция не уложилась в срок или процессы браузера умерли, сторож из своего потока
+# вызывает on_hang (воркер убивает дерево Chrome): зависший вызов chromedriver/DevTools
+# сразу падает с ошибкой, а воркер по tripped возвращает задачу в pending и перезапускает браузер.
+import time
+import threading
+from contextlib import contextmanager
+from browser_engine import EngineError
+
+
+class BrowserHung(EngineError):
+    """Операция прервана сторожем: браузер завис или умер"""
+
+
+class BrowserWatchdog:
+    """Фоновый поток, следящий за сроком текущей операции и за процессами браузера"""
+
+    def __init__(self, on_hang, check_interval=0.5, probe_interval=5):
+        self.on_hang = on_hang
+        self.check_interval = check_interval
+        # Как часто проверять процессы браузера (без обращения к странице)
+        self.probe_interval = probe_interval
+        # Причина срабатывания; сбрасывается перед новым запуском браузера (rearm)
+        self.tripped = None
+        self._alive = None
+        self._probed_at = 0.0
+        self._operation = None
+        self._deadline = None
+        # Срок, после которого операции прерываются при остановке воркера
+        self._stop_deadline = None
+        self._idle_since = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="browser-watchdog", daemon=True)
+        self._thread.start()
+
+    def attach(self, alive):
+        """Следит за новым браузером: alive() - дешёвая проверка его процессов"""
+        with self._lock:
+            self._alive = alive
+            self._probed_at = time.monotonic()
+            self.tripped = None
+
+    def detach(self):
+        """Браузер закрывается или перезапускается - его смерть больше не ошибка"""
+        with self._lock:
+            self._alive = None
+
+    def rearm(self):
+        """Перед новым запуском браузера: прошлое срабатывание учтено"""
+        with self._lock:
+            self.tripped = None
+
+    @contextmanager
+    def guard(self, name, timeout):
+        """Операция name должна завершиться за timeout секунд"""
+        if self.tripped:
+            raise BrowserHung(self.tripped)
+        with self._lock:
+            self._operation = name
+            self._deadline = time.monotonic() + timeout
+        try:
+            yield
+        except Exception as e:
+            if self.tripped:
+                raise BrowserHung(self.tripped) from e
+            raise
+        finally:
+            with self._lock:
+                self._operation = None
+                self._deadline = None
+                self._idle_since = time.monotonic()
+
+    def idle_for(self):
+        """Сколько секунд браузер не выполнял операций"""
+        if self._operation is not None:
+            return 0.0
+        return time.monotonic() - self._idle_since
+
+    def stop_within(self, grace):
+        """При остановке воркера текущая операция получает не больше grace секунд"""
+        self._stop_deadline = time.monotonic() + grace
+
+    def trip(self, reason):
+        """Помечает браузер неработающим и прерывает зависший вызов"""
+        with self._lock:
+            if self.tripped:
+                return
+            self.tripped = reason
+        print(f"Сторож браузера: {reason}")
+        try:
+            self.on_hang(reason)
+        except Exception as e:
+            print(f"Ошибка остановки зависшего браузера: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            reason = self._check()
+            if reason:
+                self.trip(reason)
+
+    def _check(self):
+        with self._lock:
+            if self.tripped:
+                return None
+            operation, deadline, alive = self._operation, self._deadline, self._alive
+        now = time.monotonic()
+
+        if operation is not None:
+            if self._stop_deadline is not None and now >= self._stop_deadline:
+                return f"операция '{operation}' прервана остановкой воркера"
+            if now >= deadline:
+                return f"операция '{operation}' не завершилась за отведённое время"
+
+        if alive is not None and now - self._probed_at >= self.probe_interval:
+            self._probed_at = now
+            try:
+                if not alive():
+                    return "процессы браузера завершились"
+            except Exception as e:
+                return f"не удалось проверить браузер: {e}"
+        return None
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
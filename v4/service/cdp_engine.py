@@ -0,0 +1,458 @@
+# cdp_engine.py - Браузерный движок поверх DevTools-протокола без chromedriver
+#
+# Chrome запускается напрямую, команды идут по одному WebSocket из фонового цикла asyncio.
+# Ожидания не опрашивают страницу: промис в странице ждёт изменений DOM (dom_wait)
+# и возвращается, как только условие выполнилось. Нужен пакет websockets.
+import os
+import json
+import time
+import shutil
+import asyncio
+import itertools
+import threading
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from browser_engine import BrowserEngine, EngineError, CHROME_ARGUMENTS, KEYS
+from dom_wait import observe_function
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+CHROME_BINARIES = ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser", "chrome")
+
+# Ссылки на элементы живут в этой группе до release_handles
+OBJECT_GROUP = "whatsapp-worker"
+SHIFT_MODIFIER = 8
+
+# Кодирует результат скрипта: элементы DOM заменяются на {"__node": i}, а сами
+# элементы откладываются в window.__engineNodes[key] и забираются отдельной командой
+_ENCODE = """
+    function (value, key) {
+        var nodes = [];
+        function encode(v) {
+            if (v instanceof Node) {
+                nodes.push(v);
+                return {__node: nodes.length - 1};
+            }
+            if (Array.isArray(v) || v instanceof NodeList || v instanceof HTMLCollection) {
+                return Array.prototype.map.call(v, encode);
+            }
+            if (v && typeof v === 'object') {
+                var result = {};
+                for (var name in v) result[name] = encode(v[name]);
+                return result;
+            }
+            return v === undefined ? null : v;
+        }
+        var encoded = encode(value);
+        if (nodes.length) {
+            window.__engineNodes = window.__engineNodes || {};
+            window.__engineNodes[key] = nodes;
+        }
+        return {value: encoded, nodes: nodes.length};
+    }
+"""
+
+# Тело скрипта в стиле execute_script; последний аргумент - ключ для элементов
+_CALL_TEMPLATE = """
+    function () {
+        var encode = %(encode)s;
+        var args = Array.prototype.slice.call(arguments, 0, -1);
+        return encode((function () { %(body)s }).apply(null, args), arguments[arguments.length - 1]);
+    }
+"""
+
+# Ждёт истинного значения скрипта наблюдателем DOM из dom_wait; результат кодируется как у _CALL
+_WAIT_TEMPLATE = """
+    function () {
+        var encode = %(encode)s;
+        var args = Array.prototype.slice.call(arguments, 0, -2);
+        var timeout = arguments[arguments.length - 2], key = arguments[arguments.length - 1];
+        return new Promise(function (resolve) {
+            (%(observe)s)(args, timeout, function (value) { resolve(encode(value, key)); });
+        });
+    }
+"""
+
+_TAKE_NODES = """
+    (function () {
+        var nodes = window.__engineNodes[%d];
+        delete window.__engineNodes[%d];
+        return nodes;
+    })()
+"""
+
+# Точка для клика: центр элемента после прокрутки к нему
+CLICK_POINT_SCRIPT = """
+    var el = arguments[0];
+    el.scrollIntoView({block: 'center', inline: 'center'});
+    var rect = el.getBoundingClientRect();
+    if (!rect.width || !rect.height) return null;
+    return [rect.left + rect.width / 2, rect.top + rect.height / 2];
+"""
+
+# Фокус с курсором в конце поля, как после клика по нему
+FOCUS_END_SCRIPT = """
+    var el = arguments[0];
+    el.focus();
+    if (el.isContentEditable) {
+        var range = document.createRange();
+        range.selectNodeContents(el);
+        range.collapse(false);
+        var selection = window.getSelection();
+        selection.removeAllRanges();
+        selection.addRange(range);
+    }
+"""
+
+CLEAR_SCRIPT = """
+    var el = arguments[0];
+    el.focus();
+    if (!el.isContentEditable && 'value' in el) {
+        el.value = '';
+        el.dispatchEvent(new Event('input', {bubbles: true}));
+        return;
+    }
+    document.execCommand('selectAll', false, null);
+    document.execCommand('delete', false, null);
+"""
+
+
+def find_chrome():
+    """Путь к Chrome: переменная CHROME_PATH или первый найденный в PATH"""
+    path = os.environ.get("CHROME_PATH")
+    if path:
+        return path
+    for name in CHROME_BINARIES:
+        found = shutil.which(name)
+        if found:
+            return found
+    raise EngineError("Chrome не найден; укажите путь в CHROME_PATH")
+
+
+class CdpElement:
+    """Ссылка на элемент страницы (RemoteObjectId)"""
+
+    __slots__ = ("object_id",)
+
+    def __init__(self, object_id):
+        self.object_id = object_id
+
+    def __repr__(self):
+        return f"CdpElement({self.object_id})"
+
+
+class CdpEngine(BrowserEngine):
+    """
+    Chrome через DevTools-протокол. Команды из разных потоков идут по одному
+    соединению и не ждут друг друга, поэтому concurrently действительно параллелен.
+    Ввод текста всегда через Input.insertText (TEXT_INPUT_ENGINE не используется).
+    """
+
+    name = "cdp"
+
+    def __init__(self, chrome_path=None, launch_timeout=30, command_timeout=30, max_concurrency=4):
+        self.chrome_path = chrome_path
+        self.launch_timeout = launch_timeout
+        self.command_timeout = command_timeout
+        self.max_concurrency = max_concurrency
+        self.process = None
+        self._loop = None
+        self._thread = None
+        self._ws = None
+        self._pending = {}
+        # Читатель соединения работает, пока Chrome не закрыл WebSocket
+        self._receiving = False
+        self._ids = itertools.count(1)
+        self._node_keys = itertools.count(1)
+        self._executor = None
+
+    @property
+    def root_pid(self):
+        return self.process.pid if self.process is not None else None
+
+    # --- запуск и соединение ---
+
+    def launch(self, profile_path, arguments=CHROME_ARGUMENTS):
+        if websockets is None:
+            raise EngineError("Для движка cdp нужен пакет websockets (pip install websockets)")
+        port_file = os.path.join(profile_path, "DevToolsActivePort")
+        try:
+            os.remove(port_file)
+        except FileNotFoundError:
+            pass
+
+        command = [
+            self.chrome_path or find_chrome(),
+            f"--user-data-dir={profile_path}",
+            "--remote-debugging-port=0",
+            "--no-first-run",
+            "--no-default-browser-check",
+            *arguments,
+            "about:blank",
+        ]
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        port = self._wait_port(port_file)
+        ws_url = self._page_target(port)
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="cdp-loop", daemon=True)
+        self._thread.start()
+        self._ws = self._run(websockets.connect(ws_url, max_size=None, ping_interval=None),
+                             self.launch_timeout)
+        self._receiving = True
+        asyncio.run_coroutine_threadsafe(self._receive(), self._loop)
+
+    def _wait_port(self, port_file):
+        """Chrome пишет выбранный порт отладки в DevToolsActivePort профиля"""
+        deadline = time.monotonic() + self.launch_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise EngineError(f"Chrome завершился при запуске (код {self.process.returncode})")
+            try:
+                with open(port_file) as f:
+                    return int(f.readline())
+            except (FileNotFoundError, ValueError):
+                time.sleep(0.05)
+        raise EngineError("Chrome не открыл порт отладки")
+
+    def _page_target(self, port):
+        """WebSocket вкладки: первая страница или новая, если страниц ещё нет"""
+        base = f"http://127.0.0.1:{port}/json"
+        deadline = time.monotonic() + self.launch_timeout
+        while True:
+            with urllib.request.urlopen(f"{base}/list", timeout=5) as response:
+                targets = json.load(response)
+            for target in targets:
+                if target.get("type") == "page" and target.get("webSocketDebuggerUrl"):
+                    return target["webSocketDebuggerUrl"]
+            if time.monotonic() >= deadline:
+                request = urllib.request.Request(f"{base}/new?about:blank", method="PUT")
+                with urllib.request.urlopen(request, timeout=5) as response:
+                    return json.load(response)["webSocketDebuggerUrl"]
+            time.sleep(0.05)
+
+    def _run(self, coroutine, timeout):
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # Отменённая корутина сама убирает свой запрос из _pending
+            future.cancel()
+            raise EngineError(f"Chrome не ответил за {timeout} с") from None
+
+    async def _receive(self):
+        try:
+            async for raw in self._ws:
+                message = json.loads(raw)
+                future = self._pending.pop(message.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+                # События не подписаны, остальное игнорируем
+        except Exception as e:
+            print(f"Соединение DevTools прервано: {e}")
+        finally:
+            self._receiving = False
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(EngineError("соединение с Chrome закрыто"))
+            self._pending.clear()
+
+    async def _send(self, method, params):
+        message_id = next(self._ids)
+        future = self._loop.create_future()
+        self._pending[message_id] = future
+        try:
+            await self._ws.send(json.dumps({"id": message_id, "method": method, "params": params or {}}))
+            message = await future
+        finally:
+            self._pending.pop(message_id, None)
+        if "error" in message:
+            raise EngineError(f"{method}: {message['error'].get('message')}")
+        return message.get("result", {})
+
+    def execute(self, method, params=None, timeout=None):
+        """Одна команда DevTools; можно вызывать из любого потока"""
+        if self._loop is None:
+            raise EngineError("Chrome не запущен")
+        return self._run(self._send(method, params), timeout or self.command_timeout)
+
+    # --- скрипты ---
+
+    def _call(self, template, script, args, extra=(), await_promise=False, timeout=None):
+        declaration = template % {"encode": _ENCODE, "body": script, "observe": observe_function(script)}
+        key = next(self._node_keys)
+        values = list(args) + list(extra) + [key]
+        element = next((arg for arg in values if isinstance(arg, CdpElement)), None)
+        if element is None:
+            # Все аргументы - JSON: один Runtime.evaluate без привязки к объекту
+            result = self.execute("Runtime.evaluate", {
+                "expression": f"({declaration}).apply(null, {json.dumps(values)})",
+                "returnByValue": True,
+                "awaitPromise": await_promise,
+            }, timeout)
+        else:
+            result = self.execute("Runtime.callFunctionOn", {
+                "functionDeclaration": declaration,
+                "objectId": element.object_id,
+                "arguments": [self._argument(value) for value in values],
+                "returnByValue": True,
+                "awaitPromise": await_promise,
+            }, timeout)
+        if "exceptionDetails" in result:
+            details = result["exceptionDetails"]
+            text = details.get("exception", {}).get("description") or details.get("text")
+            raise EngineError(f"Ошибка скрипта: {text}")
+
+        encoded = result["result"].get("value") or {}
+        nodes = self._take_nodes(key, encoded["nodes"]) if encoded.get("nodes") else []
+        return self._decode(encoded.get("value"), nodes)
+
+    @staticmethod
+    def _argument(value):
+        if isinstance(value, CdpElement):
+            return {"objectId": value.object_id}
+        return {"value": value}
+
+    def _take_nodes(self, key, count):
+        array = self.execute("Runtime.evaluate", {
+            "expression": _TAKE_NODES % (key, key),
+            "objectGroup": OBJECT_GROUP,
+        })["result"]
+        properties = self.execute("Runtime.getProperties", {
+            "objectId": array["objectId"],
+            "ownProperties": True,
+        })["result"]
+        nodes = {}
+        for prop in properties:
+            if prop["name"].isdigit() and "objectId" in prop.get("value", {}):
+                nodes[int(prop["name"])] = CdpElement(prop["value"]["objectId"])
+        return [nodes.get(index) for index in range(count)]
+
+    def _decode(self, value, nodes):
+        if isinstance(value, list):
+            return [self._decode(item, nodes) for item in value]
+        if isinstance(value, dict):
+            if set(value) == {"__node"}:
+                return nodes[value["__node"]]
+            return {name: self._decode(item, nodes) for name, item in value.items()}
+        return value
+
+    def execute_script(self, script, *args):
+        return self._call(_CALL_TEMPLATE, script, args)
+
+    def wait_for(self, script, *args, timeout=10):
+        deadline = time.monotonic() + timeout
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return None
+            try:
+                return self._call(_WAIT_TEMPLATE, script, args, extra=(int(left * 1000),),
+                                  await_promise=True, timeout=left + self.command_timeout)
+            except EngineError as e:
+                # Страница перезагружается - контекст выполнения уничтожен, ждём новый
+                if "context" not in str(e).lower() and "navigated" not in str(e).lower():
+                    raise
+                time.sleep(0.1)
+
+    # --- действия ---
+
+    def open(self, url):
+        result = self.execute("Page.navigate", {"url": url})
+        if result.get("errorText"):
+            raise EngineError(f"Не удалось открыть {url}: {result['errorText']}")
+
+    def click(self, element):
+        point = self.execute_script(CLICK_POINT_SCRIPT, element)
+        if not point:
+            raise EngineError("Элемент не виден, клик невозможен")
+        x, y = point
+        self.execute("Input.dispatchMouseEvent", {"type": "mouseMoved", "x": x, "y": y})
+        for event_type in ("mousePressed", "mouseReleased"):
+            self.execute("Input.dispatchMouseEvent", {
+                "type": event_type, "x": x, "y": y, "button": "left", "clickCount": 1,
+            })
+
+    def clear(self, element):
+        self.execute_script(CLEAR_SCRIPT, element)
+
+    def type_text(self, element, text):
+        if not text:
+            return
+        self.execute_script(FOCUS_END_SCRIPT, element)
+        for number, line in enumerate(text.split("\n")):
+            if number:
+                self._key("Enter", SHIFT_MODIFIER)
+            if line:
+                self.execute("Input.insertText", {"text": line})
+
+    def press_key(self, element, key):
+        if element is not None:
+            self.execute_script(FOCUS_END_SCRIPT, element)
+        self._key(key)
+
+    def _key(self, key, modifiers=0):
+        event = {
+            "key": key,
+            "code": key,
+            "windowsVirtualKeyCode": KEYS[key],
+            "nativeVirtualKeyCode": KEYS[key],
+            "modifiers": modifiers,
+        }
+        if key == "Enter" and not modifiers:
+            # Как настоящая клавиатура: keydown с символом даёт и keypress
+            self.execute("Input.dispatchKeyEvent", dict(event, type="keyDown", text="\r"))
+        else:
+            self.execute("Input.dispatchKeyEvent", dict(event, type="rawKeyDown"))
+        self.execute("Input.dispatchKeyEvent", dict(event, type="keyUp"))
+
+    def upload(self, element, paths):
+        self.execute("DOM.setFileInputFiles", {"files": list(paths), "objectId": element.object_id})
+
+    def concurrently(self, *functions):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix="cdp")
+        futures = [self._executor.submit(function) for function in functions]
+        return [future.result() for future in futures]
+
+    def instrument(self, tracer):
+        tracer.instrument_driver(self, prefix="cdp")
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None and self._receiving
+
+    def release_handles(self):
+        if self._loop is not None:
+            self.execute("Runtime.releaseObjectGroup", {"objectGroup": OBJECT_GROUP})
+
+    def quit(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+        if self._loop is not None:
+            try:
+                if self._ws is not None:
+                    self._run(self._ws.close(), 5)
+            except Exception as e:
+                print(f"Ошибка закрытия соединения DevTools: {e}")
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            # Закрыть можно только остановившийся цикл; зависший поток - демон и умрёт с процессом
+            if not self._thread.is_alive():
+                self._loop.close()
+            self._loop = None
+            self._ws = None
+
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            print("Chrome остановлен")
+            self.process = None
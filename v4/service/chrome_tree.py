@@ -0,0 +1,179 @@
+# chrome_tree.py - Учёт и остановка только своих процессов chromedriver/Chrome
+import os
+import sys
+import json
+import psutil
+
+PIDFILE_NAME = "worker_tree.json"
+
+
+def _children(pid):
+    """Прямые потомки процесса через /proc, без обхода всей таблицы процессов"""
+    children = []
+    task_dir = f"/proc/{pid}/task"
+    try:
+        for tid in os.listdir(task_dir):
+            with open(os.path.join(task_dir, tid, "children")) as f:
+                children.extend(int(child) for child in f.read().split())
+    except FileNotFoundError:
+        return []
+    except OSError:
+        # Ядро без /proc/.../children - медленный путь через psutil
+        try:
+            return [proc.pid for proc in psutil.Process(pid).children()]
+        except psutil.Error:
+            return []
+    return children
+
+
+class ChromeProcessTree:
+    """Дерево процессов, запущенных Service этого воркера"""
+
+    def __init__(self, profile_path):
+        self.pidfile = os.path.join(profile_path, PIDFILE_NAME)
+        self.root_pid = None
+        # pid -> psutil.Process; create_time защищает от переиспользования pid
+        self._processes = {}
+
+    def attach(self, root_pid):
+        """Запоминает pid chromedriver, запущенного нашим Service"""
+        self.root_pid = root_pid
+        self._processes = {}
+        self.refresh()
+
+    def refresh(self):
+        """Обходит потомков корня и сохраняет их в pid-файл"""
+        if self.root_pid is None:
+            return []
+        pids = []
+        stack = [self.root_pid]
+        while stack:
+            pid = stack.pop()
+            pids.append(pid)
+            stack.extend(_children(pid))
+
+        alive = {}
+        for pid in pids:
+            proc = self._processes.get(pid)
+            try:
+                if proc is None:
+                    proc = psutil.Process(pid)
+                    # Первый вызов cpu_percent только запускает отсчёт
+                    proc.cpu_percent(None)
+                elif not proc.is_running():
+                    continue
+                alive[pid] = proc
+            except psutil.Error:
+                continue
+        # Ушедшие из дерева процессы (например, переподчинённые init) не забываем до kill
+        for pid, proc in self._processes.items():
+            if pid not in alive and proc.is_running():
+                alive[pid] = proc
+        self._processes = alive
+        self._save()
+        return list(alive.values())
+
+    def usage(self):
+        """Суммарные RSS и CPU дерева или None, если браузер не запущен"""
+        if self.root_pid is None:
+            return None
+        rss = 0
+        cpu = 0.0
+        processes = self.refresh()
+        for proc in processes:
+            try:
+                rss += proc.memory_info().rss
+                cpu += proc.cpu_percent(None)
+            except psutil.Error:
+                continue
+        return {"rss": rss, "cpu_percent": cpu, "processes": len(processes)}
+
+    def kill(self, timeout=5):
+        """Завершает только своё дерево, включая оставшееся от прошлого запуска"""
+        if self.root_pid is not None:
+            processes = self.refresh()
+        else:
+            processes = self._load()
+        self.root_pid = None
+        self._processes = {}
+
+        for proc in processes:
+            try:
+                proc.terminate()
+            except psutil.Error:
+                pass
+        _, still_alive = psutil.wait_procs(processes, timeout=timeout)
+        for proc in still_alive:
+            try:
+                print(f"Убиваем процесс Chrome: {proc.pid}")
+                proc.kill()
+            except psutil.Error:
+                pass
+        if still_alive:
+            psutil.wait_procs(still_alive, timeout=timeout)
+
+        try:
+            os.remove(self.pidfile)
+        except OSError:
+            pass
+        return len(processes)
+
+    def _save(self):
+        records = []
+        for pid, proc in self._processes.items():
+            try:
+                records.append([pid, proc.create_time()])
+            except psutil.Error:
+                continue
+        tmp_path = f"{self.pidfile}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({"root": self.root_pid, "processes": records}, f)
+            os.replace(tmp_path, self.pidfile)
+        except OSError as e:
+            print(f"Ошибка записи {self.pidfile}: {e}")
+
+    def _load(self):
+        """Процессы из pid-файла, которые всё ещё живы и не переиспользованы"""
+        try:
+            with open(self.pidfile) as f:
+                records = [(int(pid), float(create_time))
+                           for pid, create_time in json.load(f).get("processes", [])]
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            # Битый pid-файл не должен мешать остановке воркера
+            print(f"Ошибка чтения {self.pidfile}: {e}")
+            return []
+        processes = []
+        for pid, create_time in records:
+            try:
+                proc = psutil.Process(pid)
+                if abs(proc.create_time() - create_time) < 0.01:
+                    processes.append(proc)
+            except psutil.Error:
+                continue
+        return processes
+
+
+def main(argv):
+    if len(argv) != 3 or argv[1] not in ("kill", "usage"):
+        print(f"Использование: {argv[0]} kill|usage ПУТЬ_К_ПРОФИЛЮ")
+        return 2
+    tree = ChromeProcessTree(argv[2])
+    if argv[1] == "kill":
+        print(f"Остановлено процессов: {tree.kill()}")
+        return 0
+    processes = tree._load()
+    rss = 0
+    for proc in processes:
+        try:
+            rss += proc.memory_info().rss
+        except psutil.Error:
+            continue
+    print(f"Процессов: {len(processes)}, RSS: {rss // (1024 * 1024)} МБ")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,58 @@
+# chromedriver_cache.py - Путь к chromedriver, найденный один раз и сохранённый на диске
+import os
+import json
+import time
+import shutil
+
+
+def _usable(path):
+    return bool(path) and os.path.isfile(path) and os.access(path, os.X_OK)
+
+
+def is_version_mismatch(error):
+    """Сессия не создалась из-за chromedriver другой версии (Chrome обновился)"""
+    message = str(error).lower()
+    return (type(error).__name__ == "SessionNotCreatedException"
+            or "session not created" in message
+            or "only supports chrome version" in message)
+
+
+def resolve_chromedriver(cache_file="queue/chromedriver.json", refresh=False):
+    """
+    Возвращает путь к chromedriver.
+    Порядок: переменная CHROMEDRIVER_PATH, кэш на диске, webdriver_manager, PATH.
+    Сеть нужна только если в кэше ничего нет.
+    """
+    override = os.environ.get("CHROMEDRIVER_PATH")
+    if _usable(override):
+        return override
+
+    if not refresh and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cached = json.load(f).get("path")
+            if _usable(cached):
+                return cached
+        except Exception as e:
+            print(f"Ошибка чтения кэша chromedriver {cache_file}: {e}")
+
+    path = None
+    try:
+        from webdriver_manager.chrome import ChromeDriverManager
+        path = ChromeDriverManager().install()
+    except Exception as e:
+        print(f"webdriver_manager недоступен ({e}), ищем chromedriver в PATH")
+
+    if not _usable(path):
+        path = shutil.which("chromedriver")
+    if not _usable(path):
+        raise RuntimeError("chromedriver не найден: нет кэша, сети и бинарника в PATH")
+
+    try:
+        tmp_path = f"{cache_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"path": path, "resolved_at": time.time()}, f)
+        os.replace(tmp_path, cache_file)
+    except Exception as e:
+        print(f"Ошибка записи кэша chromedriver {cache_file}: {e}")
+    return path
@@ -1,28 +1,12 @@
 #!/bin/bash
-# cleanup.sh - Принудительная очистка процессов Chrome (для обычного пользователя)
+# cleanup.sh - Принудительная очистка процессов Chrome воркера (для обычного пользователя)
+# Останавливает только дерево chromedriver/Chrome, записанное воркером в профиль
 
-PROFILE_PATH="/home/alexova/chrome_profile"
+PROFILE_PATH="${1:-/home/alexova/chrome_profile}"
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
 
-echo "Остановка процессов Chrome для текущего пользователя..."
+echo "Остановка процессов Chrome профиля $PROFILE_PATH..."
 
-# Находим и убиваем процессы Chrome с нашим профилем
-pkill -f "chrome.*user-data-dir.*chrome_profile" 2>/dev/null
-pkill -f "chromedriver" 2>/dev/null
-pkill -f "Chrome.*user-data-dir.*chrome_profile" 2>/dev/null
-
-sleep 2
-
-# Принудительно убиваем если остались
-pkill -9 -f "chrome.*user-data-dir.*chrome_profile" 2>/dev/null
-pkill -9 -f "chromedriver" 2>/dev/null
-pkill -9 -f "Chrome.*user-data-dir.*chrome_profile" 2>/dev/null
+python3 "$SCRIPT_DIR/chrome_tree.py" kill "$PROFILE_PATH"
 
 echo "Очистка завершена"
-
-# Показываем оставшиеся процессы
-echo "Оставшиеся Chrome процессы текущего пользователя:"
-ps -u $(whoami) | grep -i chrome | grep -v grep | grep -v cleanup.sh || echo "Нет активных Chrome процессов"
-
-# Проверяем заблокированные порты (если есть права)
-echo "Проверяем порты Chrome..."
-ss -tulpn 2>/dev/null | grep chrome || echo "Chrome не использует порты"
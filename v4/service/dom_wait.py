@@ -0,0 +1,96 @@
+# dom_wait.py - Ожидание условий на странице наблюдателем DOM вместо опроса chromedriver
+#
+# Условие - скрипт в стиле execute_script. Страница проверяет его сразу и при каждом
+# изменении DOM и отвечает в момент совпадения; таймаут отсчитывается там же, поэтому
+# ожидание длится ровно timeout, без шага опроса и без implicit wait сверху.
+
+# function (args, timeout, resolve): resolve(значение) при совпадении или resolve(null) по таймауту.
+# Кроме мутаций - события load (картинки), конец анимаций и редкий таймер для смены стилей.
+OBSERVE_FUNCTION = """
+    function (args, timeout, resolve) {
+        function check() {
+            try {
+                return (function () { %(body)s }).apply(null, args);
+            } catch (e) {
+                return null;
+            }
+        }
+        var value = check();
+        if (value) {
+            resolve(value);
+            return;
+        }
+        var events = ['load', 'transitionend', 'animationend'];
+        var observer, timer, interval;
+        function finish(value) {
+            observer.disconnect();
+            clearTimeout(timer);
+            clearInterval(interval);
+            events.forEach(function (type) { document.removeEventListener(type, changed, true); });
+            resolve(value);
+        }
+        function changed() {
+            var value = check();
+            if (value) finish(value);
+        }
+        observer = new MutationObserver(changed);
+        observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+        events.forEach(function (type) { document.addEventListener(type, changed, true); });
+        interval = setInterval(changed, 250);
+        timer = setTimeout(function () { finish(check() || null); }, timeout);
+    }
+"""
+
+# Обёртка для Selenium execute_async_script: последний аргумент - колбэк драйвера
+_ASYNC_TEMPLATE = """
+    var done = arguments[arguments.length - 1];
+    var timeout = arguments[arguments.length - 2];
+    (%(observe)s)(Array.prototype.slice.call(arguments, 0, -2), timeout, done);
+"""
+
+# Элемент по локатору (как By в Selenium), если он есть, кликабелен и текст совпадает
+ELEMENT_SCRIPT = """
+    var by = arguments[0], value = arguments[1], clickable = arguments[2], text = arguments[3];
+    var el = by === 'xpath'
+        ? document.evaluate(value, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue
+        : document.querySelector(value);
+    if (!el) return null;
+    if (clickable) {
+        var rect = el.getBoundingClientRect();
+        if (!(rect.width > 0 && rect.height > 0) || el.disabled ||
+                getComputedStyle(el).visibility === 'hidden') return null;
+    }
+    if (text !== null && (el.getAttribute('title') || el.textContent || '').trim() !== text) return null;
+    return el;
+"""
+
+# Selenium не прерывает асинхронный скрипт раньше своего script timeout (по умолчанию 30 с)
+_SCRIPT_TIMEOUT_MARGIN = 5
+
+
+def observe_function(script):
+    """Исходник OBSERVE_FUNCTION для условия script"""
+    return OBSERVE_FUNCTION % {"body": script}
+
+
+def wait_until(driver, script, *args, timeout=10):
+    """
+    Значение script, как только оно станет истинным; None, если за timeout не стало.
+    driver - Selenium WebDriver или движок из browser_engine (у него свой wait_for).
+    """
+    if hasattr(driver, "wait_for"):
+        return driver.wait_for(script, *args, timeout=timeout)
+
+    script_timeout = getattr(driver, "_observe_script_timeout", 30)
+    if timeout + _SCRIPT_TIMEOUT_MARGIN > script_timeout:
+        script_timeout = timeout + _SCRIPT_TIMEOUT_MARGIN
+        driver.set_script_timeout(script_timeout)
+        driver._observe_script_timeout = script_timeout
+
+    async_script = _ASYNC_TEMPLATE % {"observe": observe_function(script)}
+    return driver.execute_async_script(async_script, *args, int(max(timeout, 0) * 1000))
+
+
+def wait_for_element(driver, by, value, timeout=10, clickable=False, text=None):
+    """Элемент по локатору (By.CSS_SELECTOR / By.XPATH) или None по таймауту"""
+    return wait_until(driver, ELEMENT_SCRIPT, by, value, clickable, text, timeout=timeout)
@@ -0,0 +1,124 @@
+# image_cache.py - Подготовка картинок перед загрузкой и кэш результатов по содержимому
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    # Pillow необязателен: без него картинки отправляются как есть
+    Image = None
+
+
+class ImagePreprocessor:
+    """Уменьшает и пережимает картинки в пуле потоков, результат кэширует по sha256"""
+
+    def __init__(self, cache_dir="queue/image_cache", max_dimension=1600, quality=80,
+                 max_cache_bytes=512 * 1024 * 1024, workers=2):
+        self.cache_dir = cache_dir
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.max_cache_bytes = max_cache_bytes
+        self.enabled = Image is not None
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._cache_bytes = 0
+
+        if not self.enabled:
+            print("Pillow не установлен, картинки отправляются без обработки")
+            return
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._cache_bytes = sum(size for _, _, size in self._cache_entries())
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-prep")
+
+    def prefetch(self, file_path):
+        """Ставит картинку в очередь на подготовку, если она ещё не готовится"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if file_path not in self._futures:
+                self._futures[file_path] = self._executor.submit(self._prepare, file_path)
+            # Заготовки задач, которые забрал другой воркер, не копятся бесконечно
+            if len(self._futures) > 1000:
+                for path in [p for p, f in self._futures.items() if f.done()]:
+                    del self._futures[path]
+
+    def get(self, file_path):
+        """Путь к подготовленной картинке; при любой ошибке - исходный файл"""
+        if not self.enabled:
+            return file_path
+        with self._lock:
+            future = self._futures.pop(file_path, None)
+        if future is None:
+            future = self._executor.submit(self._prepare, file_path)
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"Ошибка подготовки картинки {file_path}: {e}")
+            return file_path
+
+    def _cache_key(self, file_path):
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        # Параметры обработки входят в ключ, чтобы смена настроек не брала старый кэш
+        digest.update(f"|{self.max_dimension}|{self.quality}".encode())
+        return digest.hexdigest()
+
+    def _prepare(self, file_path):
+        cached_path = os.path.join(self.cache_dir, f"{self._cache_key(file_path)}.jpg")
+        if os.path.exists(cached_path):
+            # Отмечаем использование для LRU
+            os.utime(cached_path)
+            return cached_path
+
+        tmp_path = f"{cached_path}.{threading.get_ident()}.tmp"
+        with Image.open(file_path) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+                # В JPEG нет прозрачности: накладываем на белый фон, как показал бы просмотрщик
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+            image.thumbnail((self.max_dimension, self.max_dimension))
+            # EXIF и прочие метаданные не передаются в save, поэтому не попадают в файл
+            image.save(tmp_path, "JPEG", quality=self.quality, optimize=True)
+        os.replace(tmp_path, cached_path)
+
+        with self._lock:
+            self._cache_bytes += os.path.getsize(cached_path)
+            if self._cache_bytes > self.max_cache_bytes:
+                self._evict(keep=cached_path)
+        return cached_path
+
+    def _cache_entries(self):
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".jpg"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, entry.path, st.st_size))
+        return entries
+
+    def _evict(self, keep):
+        """Удаляет давно не использованные файлы, пока кэш не влезет в лимит"""
+        for _, path, size in sorted(self._cache_entries()):
+            if self._cache_bytes <= self.max_cache_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                self._cache_bytes -= size
+            except OSError:
+                pass
+
+    def close(self):
+        if self.enabled:
+            self._executor.shutdown(wait=False, cancel_futures=True)
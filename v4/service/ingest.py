@@ -0,0 +1,177 @@
+# ingest.py - Приём задач от продюсеров через Unix-сокет с групповой записью на диск
+#
+# Протокол: по строке JSON на запрос {"tasks": [...]}, ответ {"ok": true, "ids": [...]}
+# или {"ok": false, "error": "..."}; при переполнении очереди в ответе ещё "full": true.
+# Клиент - producer.QueueClient.
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import socket
+import threading
+import socketserver
+from producer import DEFAULT_SOCKET_PATH, QueueFullError, TaskWriter, validate_task, writer_settings
+
+
+class _Request:
+    __slots__ = ("tasks", "done", "error")
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.done = threading.Event()
+        self.error = None
+
+
+class GroupCommitter:
+    """Собирает запросы за окно linger и записывает их одной пачкой (одна синхронизация диска)"""
+
+    def __init__(self, writer, linger=0.005, max_batch=2000):
+        self.writer = writer
+        self.linger = linger
+        self.max_batch = max_batch
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="ingest-commit", daemon=True)
+        self._thread.start()
+
+    def submit(self, tasks):
+        """Блокирует до записи задач на диск"""
+        request = _Request(tasks)
+        self._requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+
+    def _run(self):
+        try:
+            self._commit_loop()
+        finally:
+            # Писатель закрывается в том же потоке, где работал (соединение SQLite)
+            self.writer.close()
+
+    def _commit_loop(self):
+        while True:
+            first = self._requests.get()
+            if first is None:
+                return
+            batch = [first]
+            count = len(first.tasks)
+            deadline = time.monotonic() + self.linger
+            stop = False
+            while count < self.max_batch:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=left)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+                count += len(request.tasks)
+
+            try:
+                # Лимиты очереди проверяются по запросам: переполнение отклоняет только свой запрос
+                errors = self.writer.write_requests([request.tasks for request in batch])
+                for request, error in zip(batch, errors):
+                    request.error = error
+            except Exception as e:
+                print(f"Ошибка записи пачки из {count} задач: {e}")
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
+            if stop:
+                return
+
+    def close(self):
+        self._requests.put(None)
+        self._thread.join(timeout=30)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        committer = self.server.committer
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                tasks = request.get("tasks") if isinstance(request, dict) else None
+                if not isinstance(tasks, list):
+                    raise ValueError("Ожидается {\"tasks\": [...]}")
+                tasks = [validate_task(task) for task in tasks]
+                committer.submit(tasks)
+                response = {"ok": True, "ids": [task['id'] for task in tasks]}
+            except QueueFullError as e:
+                response = {"ok": False, "error": str(e), "full": True}
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode('utf-8'))
+            self.wfile.flush()
+
+
+class IngestServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, writer, linger=0.005, max_batch=2000):
+        self.socket_path = socket_path
+        self.committer = GroupCommitter(writer, linger=linger, max_batch=max_batch)
+        _remove_stale_socket(socket_path)
+        super().__init__(socket_path, _Handler)
+        os.chmod(socket_path, 0o660)
+
+    def server_close(self):
+        super().server_close()
+        self.committer.close()
+        try:
+            os.remove(self.socket_path)
+        except OSError:
+            pass
+
+
+def _remove_stale_socket(socket_path):
+    """Удаляет сокет, оставшийся от упавшего демона; живой демон не трогаем"""
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"ingest.py уже запущен: {socket_path}")
+
+
+def main():
+    from runwork import get_setting
+
+    settings = writer_settings()
+    backend = settings["backend"]
+    writer = TaskWriter("queue", **settings)
+    socket_path = get_setting("INGEST_SOCKET", DEFAULT_SOCKET_PATH)
+    os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+    server = IngestServer(socket_path, writer,
+                          linger=get_setting("INGEST_LINGER_MS", 5) / 1000,
+                          max_batch=get_setting("INGEST_MAX_BATCH", 2000))
+
+    def stop(signum, frame):
+        print(f"\nПолучен сигнал {signum}. Остановка приёма задач...")
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    print(f"Приём задач на {socket_path} (очередь: {backend})")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        print("Приём задач остановлен")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
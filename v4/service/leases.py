@@ -0,0 +1,32 @@
+# leases.py - Аренда захваченных задач: продление в фоне, чтобы упавший воркер не терял задачи
+import os
+import socket
+import threading
+
+
+def default_worker_id():
+    """Уникальный в пределах машины идентификатор процесса воркера"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaseHeartbeat:
+    """Фоновый поток, продлевающий аренду задач, которые воркер держит в processing"""
+
+    def __init__(self, queue, interval=None):
+        self.queue = queue
+        # Продлеваем втрое чаще, чем истекает аренда
+        self.interval = interval or max(getattr(queue, "lease_ttl", 120) / 3, 1)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-heartbeat", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.queue.renew_leases()
+            except Exception as e:
+                print(f"Ошибка продления аренды задач: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
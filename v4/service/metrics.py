@@ -0,0 +1,190 @@
+# metrics.py - Счётчики, гистограммы задержек и HTTP-выдача в формате Prometheus
+import time
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HELP = {
+    "whatsapp_stage_seconds": "Длительность этапов обработки",
+    "whatsapp_tasks_total": "Обработанные задачи по результату",
+    "whatsapp_browser_restarts_total": "Перезапуски браузера",
+    "whatsapp_browser_hangs_total": "Срабатывания сторожа: зависший или упавший браузер",
+    "whatsapp_browser_restart_phase_seconds": "Длительность этапов перезапуска браузера",
+    "whatsapp_queue_tasks": "Задачи в очереди по состояниям",
+    "whatsapp_retries_total": "Повторы упавших задач: возвращено в очередь или перенесено в dead",
+    "whatsapp_merged_tasks_total": "Задачи, отправленные в составе объединённых сообщений",
+}
+
+
+def _label_key(labels):
+    # Значения - строки: None рядом со строкой сломал бы сортировку в render()
+    return tuple(sorted((name, "unknown" if value is None else str(value))
+                        for name, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    body = ",".join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in items)
+    return "{" + body + "}"
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "labels", "started")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Metrics:
+    """Хранилище метрик воркера"""
+
+    enabled = True
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        self.gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = _Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def time(self, name, **labels):
+        """Контекстный менеджер, записывающий длительность блока"""
+        return _Timer(self, name, labels)
+
+    def render(self):
+        """Текстовый формат Prometheus"""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((key, (list(h.counts), h.total, h.count))
+                                for key, h in self.histograms.items())
+
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, key), value in counters:
+            describe(name, "counter")
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), value in gauges:
+            describe(name, "gauge")
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), (counts, total, count) in histograms:
+            describe(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullMetrics:
+    """Заглушка, когда метрики выключены: вызовы ничего не делают"""
+
+    enabled = False
+
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def set_gauge(self, name, value, **labels):
+        pass
+
+    def observe(self, name, seconds, **labels):
+        pass
+
+    def time(self, name, **labels):
+        return _NULL_TIMER
+
+
+def start_http_server(metrics, port, host="127.0.0.1"):
+    """Отдаёт метрики на http://host:port/metrics в фоновом потоке"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    print(f"Метрики доступны на http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,467 @@
+# producer.py - Постановка задач в очередь для продюсеров: проверка, id, атомарная запись
+#
+#     from producer import QueueClient
+#     client = QueueClient()
+#     client.enqueue("Дежурные", "Сервер недоступен", priority=1)
+#     client.enqueue_many([{"target": "Отчёты", "file_path": "/tmp/graph.png", "message": "за сутки"}])
+#
+# Если запущен ingest.py, задачи уходят через его сокет, иначе пишутся в очередь напрямую.
+# Задача с ttl (секунды) или expires_at (unix time) не отправляется после этого срока.
+# Переполненная очередь отвечает QueueFullError (или вытесняет старые задачи - см. TaskWriter).
+import os
+import re
+import json
+import time
+import uuid
+import errno
+import socket
+import ctypes
+import ctypes.util
+from collections import Counter
+from task_index import TaskIndex, subdir_for
+
+CONTENT_TYPES = ("text", "image")
+DEFAULT_SOCKET_PATH = "queue/ingest.sock"
+OVERFLOW_POLICIES = ("reject", "drop_oldest")
+_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+
+class QueueFullError(ValueError):
+    """Очередь достигла лимита, задачи не приняты"""
+
+
+def new_task_id():
+    """Id задачи: время постановки + случайная часть, имена файлов сортируются по времени"""
+    return f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:12]}"
+
+
+def validate_task(task):
+    """Проверяет задачу и дополняет её id и временем постановки; ошибки - ValueError"""
+    if not isinstance(task, dict):
+        raise ValueError("Задача должна быть объектом JSON")
+    task = dict(task)
+
+    target = task.get('target')
+    if not isinstance(target, str) or not target.strip():
+        raise ValueError("Не указан чат (target)")
+
+    if not task.get('content_type'):
+        task['content_type'] = 'image' if task.get('file_path') else 'text'
+    content_type = task['content_type']
+    if content_type not in CONTENT_TYPES:
+        raise ValueError(f"Неизвестный тип контента: {content_type}")
+    if content_type == 'text' and not (isinstance(task.get('message'), str) and task['message'].strip()):
+        raise ValueError("Пустое текстовое сообщение")
+    if content_type == 'image':
+        file_path = task.get('file_path')
+        if not isinstance(file_path, str) or not os.path.isfile(file_path):
+            raise ValueError(f"Файл не найден: {file_path}")
+        task['file_path'] = os.path.abspath(file_path)
+
+    if task.get('priority') is not None and not isinstance(task['priority'], int):
+        raise ValueError("priority должен быть целым числом")
+    if task.get('deadline') is not None and not isinstance(task['deadline'], (int, float)):
+        raise ValueError("deadline должен быть временем в секундах (unix time)")
+    if task.get('expires_at') is not None and not isinstance(task['expires_at'], (int, float)):
+        raise ValueError("expires_at должен быть временем в секундах (unix time)")
+    ttl = task.pop('ttl', None)
+    if ttl is not None and (not isinstance(ttl, (int, float)) or ttl <= 0):
+        raise ValueError("ttl должен быть положительным числом секунд")
+
+    if task.get('id') is None:
+        task['id'] = new_task_id()
+    elif not isinstance(task['id'], str) or not _ID_PATTERN.match(task['id']):
+        raise ValueError(f"Недопустимый id задачи: {task['id']!r}")
+    task.setdefault('enqueued_at', time.time())
+    if ttl is not None and task.get('expires_at') is None:
+        task['expires_at'] = task['enqueued_at'] + ttl
+    return task
+
+
+def _load_syncfs():
+    libc_name = ctypes.util.find_library("c") or "libc.so.6"
+    try:
+        return ctypes.CDLL(libc_name, use_errno=True).syncfs
+    except (OSError, AttributeError):
+        return None
+
+
+_syncfs = _load_syncfs()
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class TaskWriter:
+    """
+    Пишет пачку задач в очередь за один проход.
+    Файлы: все тела пишутся во incoming, сбрасываются на диск одним syncfs
+    (или fsync по файлам, если syncfs нет), затем переименовываются в pending,
+    и каждый затронутый каталог pending синхронизируется один раз.
+    Лимиты: max_pending задач в pending всего и max_per_target на чат. При превышении
+    overflow="reject" отклоняет запрос, "drop_oldest" переносит в dead самые старые
+    несрочные задачи (сначала того же чата), чтобы новые поместились.
+    """
+
+    def __init__(self, queue_dir="queue", backend="file", db_path=None, hashed_subdirs=False,
+                 durable=True, max_pending=None, max_per_target=None, overflow="reject"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Неизвестная политика переполнения: {overflow}")
+        self.backend = backend
+        self.durable = durable
+        self.hashed_subdirs = hashed_subdirs
+        self.pending_dir = os.path.join(queue_dir, "whatsapp", "pending")
+        # Недописанные файлы лежат вне pending, чтобы воркер их не видел
+        self.incoming_dir = os.path.join(queue_dir, "whatsapp", "incoming")
+        self.dead_dir = os.path.join(queue_dir, "whatsapp", "dead")
+        self.db_path = db_path or os.path.join(queue_dir, "whatsapp", "queue.db")
+        # Соединение SQLite открывается в том потоке, который пишет
+        self._sqlite = None
+        self.max_pending = max_pending
+        self.max_per_target = max_per_target
+        self.overflow = overflow
+        # Индекс pending для подсчёта задач по чатам (только с лимитами и файловой очередью)
+        self._index = None
+
+        if backend == "file":
+            os.makedirs(self.incoming_dir, exist_ok=True)
+            os.makedirs(self.pending_dir, exist_ok=True)
+        elif backend != "sqlite":
+            raise ValueError(f"Неизвестный тип очереди: {backend}")
+
+    def _pending_path(self, file_name):
+        if self.hashed_subdirs:
+            return os.path.join(self.pending_dir, subdir_for(file_name), file_name)
+        return os.path.join(self.pending_dir, file_name)
+
+    def write(self, tasks):
+        """Записывает уже проверенные задачи; после возврата они переживут сбой питания"""
+        error = self.write_requests([tasks])[0]
+        if error is not None:
+            raise error
+
+    def write_requests(self, requests):
+        """
+        Пишет задачи нескольких запросов за один проход. Лимиты проверяются
+        для каждого запроса отдельно: возвращает QueueFullError или None по запросам.
+        """
+        errors = [None] * len(requests)
+        seen = set()
+        for number, tasks in enumerate(requests):
+            try:
+                self._check_ids(tasks, seen)
+            except ValueError as e:
+                errors[number] = e
+        victims = []
+        if self.max_pending or self.max_per_target:
+            counts = self._pending_counts()
+            for number, tasks in enumerate(requests):
+                if errors[number] is not None:
+                    continue
+                try:
+                    victims += self._admit(tasks, counts, victims)
+                except QueueFullError as e:
+                    errors[number] = e
+        self._write([task for number, tasks in enumerate(requests) if errors[number] is None
+                     for task in tasks])
+        # Вытесняем только после того, как новые задачи надёжно записаны
+        if victims:
+            self._drop(victims)
+        return errors
+
+    def _check_ids(self, tasks, seen):
+        """Задача с уже занятым id не должна заменить собой другую"""
+        ids = [task['id'] for task in tasks]
+        for task_id in ids:
+            if task_id in seen or (self.backend == "file" and
+                                   os.path.exists(self._pending_path(f"{task_id}.json"))):
+                raise ValueError(f"Задача с id '{task_id}' уже в очереди")
+            seen.add(task_id)
+
+    def _sqlite_backend(self):
+        if self._sqlite is None:
+            from queue_backend import SQLiteQueueBackend
+            self._sqlite = SQLiteQueueBackend(self.db_path)
+            if self.durable:
+                # В WAL с NORMAL последние коммиты могут пропасть при отключении питания
+                self._sqlite.conn.execute("PRAGMA synchronous=FULL")
+        return self._sqlite
+
+    def _pending_counts(self):
+        """Counter задач в pending по чатам"""
+        if self.backend == "sqlite":
+            return Counter(dict(self._sqlite_backend().conn.execute(
+                "SELECT target, COUNT(*) FROM tasks WHERE state = 'pending' GROUP BY target")))
+        if self._index is None:
+            self._index = TaskIndex(self.pending_dir, hashed_subdirs=self.hashed_subdirs)
+        self._index.refresh()
+        return Counter(header.target for header in self._index.by_age())
+
+    def _admit(self, tasks, counts, chosen):
+        """Проверяет лимиты для запроса, учитывая его в counts; возвращает задачи на вытеснение"""
+        added = Counter(task['target'] for task in tasks)
+        over_target = {}
+        if self.max_per_target:
+            for target, count in added.items():
+                excess = counts[target] + count - self.max_per_target
+                if excess > 0:
+                    over_target[target] = excess
+        over_total = 0
+        if self.max_pending:
+            over_total = sum(counts.values()) + len(tasks) - self.max_pending
+
+        if not over_target and over_total <= 0:
+            counts.update(added)
+            return []
+        if self.overflow == "reject":
+            if over_target:
+                target = next(iter(over_target))
+                raise QueueFullError(f"В очереди чата '{target}' уже {counts[target]} задач "
+                                     f"(лимит {self.max_per_target})")
+            raise QueueFullError(f"Очередь переполнена: {sum(counts.values())} задач "
+                                 f"(лимит {self.max_pending})")
+
+        # drop_oldest: сначала самые старые задачи переполненных чатов, затем любые
+        excluded = {ref for ref, _ in chosen}
+        victims = []
+        for target, excess in over_target.items():
+            target_victims = self._oldest_pending(target, excess, excluded)
+            victims += target_victims
+            if len(target_victims) < excess:
+                raise QueueFullError(f"В очереди чата '{target}' не хватает несрочных задач "
+                                     f"для вытеснения (лимит {self.max_per_target})")
+        over_total -= len(victims)
+        if over_total > 0:
+            extra = self._oldest_pending(None, over_total, excluded)
+            if len(extra) < over_total:
+                raise QueueFullError(f"В очереди не хватает несрочных задач для вытеснения "
+                                     f"(лимит {self.max_pending})")
+            victims += extra
+        for _, target in victims:
+            counts[target] -= 1
+        counts.update(added)
+        return victims
+
+    def _oldest_pending(self, target, limit, excluded):
+        """До limit самых старых несрочных задач pending: [(ссылка, чат)], ссылки в excluded пропускаются"""
+        victims = []
+        if self.backend == "sqlite":
+            query = "SELECT rowid, target FROM tasks WHERE state = 'pending'"
+            params = []
+            if target is not None:
+                query += " AND target = ?"
+                params.append(target)
+            query += " AND priority <= 0 AND deadline IS NULL ORDER BY enqueued_at"
+            rows = self._sqlite_backend().conn.execute(query, params)
+        else:
+            rows = ((header.path, header.target) for header in self._index.by_age()
+                    if not header.urgent and (target is None or header.target == target))
+        for ref, row_target in rows:
+            if len(victims) >= limit:
+                break
+            if ref not in excluded:
+                excluded.add(ref)
+                victims.append((ref, row_target))
+        return victims
+
+    def _drop(self, victims):
+        """Переносит вытесненные задачи в dead"""
+        if self.backend == "sqlite":
+            with self._sqlite_backend()._transaction() as conn:
+                conn.executemany("UPDATE tasks SET state = 'dead' WHERE rowid = ? AND state = 'pending'",
+                                 [(rowid,) for rowid, _ in victims])
+        else:
+            os.makedirs(self.dead_dir, exist_ok=True)
+            for path, _ in victims:
+                self._index.discard(path)
+                try:
+                    os.rename(path, os.path.join(self.dead_dir, os.path.basename(path)))
+                except FileNotFoundError:
+                    # Воркер уже забрал задачу
+                    pass
+        print(f"Очередь переполнена: {len(victims)} старых задач перенесено в dead")
+
+    def _write(self, tasks):
+        if not tasks:
+            return
+        if self.backend == "sqlite":
+            self._sqlite_backend().enqueue_many(tasks)
+            return
+
+        written = []
+        try:
+            for task in tasks:
+                file_name = f"{task['id']}.json"
+                # Своё имя во incoming: параллельный писатель с тем же id его не затрёт
+                tmp_path = os.path.join(self.incoming_dir, f"{task['id']}.{uuid.uuid4().hex}.tmp")
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(task, f, ensure_ascii=False)
+                written.append((tmp_path, self._pending_path(file_name)))
+            if self.durable:
+                self._sync_files([tmp_path for tmp_path, _ in written])
+        except Exception:
+            for tmp_path, _ in written:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            raise
+
+        touched = set()
+        for tmp_path, pending_path in written:
+            # link, а не rename: существующая задача с тем же id не заменяется
+            try:
+                try:
+                    os.link(tmp_path, pending_path)
+                except FileNotFoundError:
+                    # Хешированный подкаталог ещё не создан
+                    os.makedirs(os.path.dirname(pending_path), exist_ok=True)
+                    os.link(tmp_path, pending_path)
+                touched.add(os.path.dirname(pending_path))
+            except FileExistsError:
+                print(f"Задача {os.path.basename(pending_path)} уже в очереди, повтор не записан")
+            finally:
+                os.remove(tmp_path)
+        if self.durable:
+            for dir_path in touched:
+                _fsync_dir(dir_path)
+
+    def _sync_files(self, paths):
+        if _syncfs is not None:
+            fd = os.open(self.incoming_dir, os.O_RDONLY)
+            try:
+                if _syncfs(fd) == 0:
+                    return
+            finally:
+                os.close(fd)
+        for path in paths:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def close(self):
+        if self._sqlite is not None:
+            self._sqlite.close()
+            self._sqlite = None
+
+
+def writer_settings():
+    """Параметры TaskWriter из config.py - те же, с которыми работает ingest.py"""
+    from runwork import get_setting
+
+    return {
+        "backend": get_setting("QUEUE_BACKEND", "file"),
+        "db_path": get_setting("QUEUE_DB_PATH", None),
+        "hashed_subdirs": get_setting("QUEUE_HASHED_SUBDIRS", False),
+        "durable": get_setting("INGEST_DURABLE", True),
+        "max_pending": get_setting("QUEUE_MAX_PENDING", None),
+        "max_per_target": get_setting("QUEUE_MAX_PER_TARGET", None),
+        "overflow": get_setting("QUEUE_OVERFLOW", "reject"),
+    }
+
+
+class QueueClient:
+    """Клиент очереди: через сокет ingest.py, а если он не запущен - прямой записью"""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, queue_dir="queue", fallback=True,
+                 timeout=30, **writer_options):
+        self.socket_path = socket_path
+        self.queue_dir = queue_dir
+        self.fallback = fallback
+        self.timeout = timeout
+        self.writer_options = writer_options
+        self._sock = None
+        self._reader = None
+        self._writer = None
+
+    def enqueue(self, target, message=None, file_path=None, **fields):
+        """Ставит одну задачу, возвращает её id"""
+        task = dict(fields, target=target)
+        if message is not None:
+            task['message'] = message
+        if file_path is not None:
+            task['file_path'] = file_path
+        return self.enqueue_many([task])[0]
+
+    def enqueue_many(self, tasks):
+        """Ставит пачку задач одним запросом, возвращает их id"""
+        tasks = [validate_task(task) for task in tasks]
+        if not tasks:
+            return []
+        try:
+            return self._send(tasks)
+        except OSError as e:
+            if not self.fallback or e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                raise
+        # Демон не запущен - пишем сами, с теми же лимитами и бэкендом, что у ingest.py
+        if self._writer is None:
+            options = dict(writer_settings(), **self.writer_options)
+            self._writer = TaskWriter(self.queue_dir, **options)
+        self._writer.write(tasks)
+        return [task['id'] for task in tasks]
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self._reader = sock.makefile('r', encoding='utf-8')
+
+    def _send(self, tasks):
+        request = (json.dumps({"tasks": tasks}, ensure_ascii=False) + "\n").encode('utf-8')
+        for attempt in range(2):
+            if self._sock is None:
+                self._connect()
+            try:
+                self._sock.sendall(request)
+                line = self._reader.readline()
+                if line:
+                    break
+            except (BrokenPipeError, ConnectionResetError):
+                if attempt:
+                    raise
+            # Демон перезапустился и закрыл старое соединение - переподключаемся
+            self._disconnect()
+        else:
+            raise ConnectionError("ingest.py закрыл соединение без ответа")
+
+        response = json.loads(line)
+        if not response.get("ok"):
+            if response.get("full"):
+                raise QueueFullError(response.get("error"))
+            raise ValueError(response.get("error", "ошибка постановки в очередь"))
+        return response["ids"]
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._reader = None
+
+    def close(self):
+        self._disconnect()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
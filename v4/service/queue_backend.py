@@ -0,0 +1,658 @@
+# queue_backend.py - Хранилища очереди задач: папки (по умолчанию) или SQLite
+import os
+import glob
+import json
+import time
+import sqlite3
+import threading
+from leases import default_worker_id
+from queue_watcher import PendingWatcher
+from task_index import TaskIndex, subdir_for
+
+
+def task_expires_at(task, default_ttl=None):
+    """Когда задача устаревает (unix time); None - бессрочная"""
+    if task.get('expires_at') is not None:
+        return task['expires_at']
+    if default_ttl:
+        return (task.get('enqueued_at') or task.get('_enqueued_at') or time.time()) + default_ttl
+    return None
+
+
+class QueueBackend:
+    """Базовый интерфейс очереди задач"""
+
+    def scan(self, owns=None):
+        """Возвращает список задач, ожидающих отправки; owns(target) - только свои чаты"""
+        raise NotImplementedError
+
+    def claim(self, task):
+        """Забирает задачу в обработку. False - задачу уже забрали"""
+        raise NotImplementedError
+
+    def complete(self, task):
+        """Удаляет успешно выполненную задачу"""
+        raise NotImplementedError
+
+    def fail(self, task, error_message):
+        """Переносит задачу в failed с описанием ошибки"""
+        raise NotImplementedError
+
+    def counts(self):
+        """Количество задач по состояниям"""
+        raise NotImplementedError
+
+    def failed_tasks(self):
+        """Задачи в failed (для планирования повторов после запуска)"""
+        raise NotImplementedError
+
+    def retry(self, task):
+        """Возвращает задачу из failed в pending. False - её там уже нет"""
+        raise NotImplementedError
+
+    def dead_letter(self, task):
+        """Переносит задачу из failed в dead: повторов больше не будет"""
+        raise NotImplementedError
+
+    def create_watcher(self, mode="auto"):
+        """Объект с методом wait(timeout) для ожидания новых задач"""
+        raise NotImplementedError
+
+    def renew_leases(self):
+        """Продлевает аренду задач, захваченных этим воркером (вызывается из потока heartbeat)"""
+
+    def reap_expired(self):
+        """Возвращает в pending задачи с истёкшей арендой, возвращает их количество"""
+        return 0
+
+    def requeue(self, task):
+        """Возвращает захваченную задачу в pending, не считая это попыткой отправки"""
+        raise NotImplementedError
+
+    def expire(self, task):
+        """Переносит устаревшую задачу из pending в dead без отправки. False - её там уже нет"""
+        raise NotImplementedError
+
+    def expire_pending(self, default_ttl=None):
+        """Переносит в dead все устаревшие задачи pending, возвращает их количество"""
+        return 0
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _mark_failed(task, error_message):
+        if 'attempts' not in task:
+            task['attempts'] = 0
+        task['attempts'] += 1
+        task['last_error'] = error_message
+        task['failed_time'] = time.time()
+
+
+class FileQueueBackend(QueueBackend):
+    """Очередь на файлах: pending -> processing -> удаление или failed"""
+
+    def __init__(self, queue_dir="queue", hashed_subdirs=False, scan_limit=500, lease_ttl=120,
+                 worker_id=None, scan_per_target=50):
+        self.queue_dir = queue_dir
+        self.pending_dir = os.path.join(queue_dir, "whatsapp", "pending")
+        self.processing_dir = os.path.join(queue_dir, "whatsapp", "processing")
+        self.failed_dir = os.path.join(queue_dir, "whatsapp", "failed")
+        self.dead_dir = os.path.join(queue_dir, "whatsapp", "dead")
+        self.hashed_subdirs = hashed_subdirs
+        self.scan_limit = scan_limit
+        # Обычных задач одного чата в скане не больше scan_per_target (None - без ограничения)
+        self.scan_per_target = scan_per_target
+        self.index = TaskIndex(self.pending_dir, hashed_subdirs=hashed_subdirs)
+        if hashed_subdirs:
+            self.index.ensure_directories()
+        # Аренда: рядом с файлом в processing лежит <имя>.lease с владельцем и сроком
+        self.lease_ttl = lease_ttl
+        self.worker_id = worker_id or default_worker_id()
+        self._held = set()
+        self._held_lock = threading.Lock()
+
+    def pending_path_for(self, file_name):
+        """Путь, по которому продюсер должен положить файл задачи"""
+        if self.hashed_subdirs:
+            return os.path.join(self.pending_dir, subdir_for(file_name), file_name)
+        return os.path.join(self.pending_dir, file_name)
+
+    def scan(self, owns=None):
+        # Разбираются только новые файлы, тела сообщений не держим в памяти
+        self.index.refresh()
+        headers = self.index.headers(self.scan_limit, per_target=self.scan_per_target, owns=owns)
+        return [header.to_task() for header in headers]
+
+    def claim(self, task):
+        processing_path = os.path.join(self.processing_dir, os.path.basename(task['_filepath']))
+        self.index.discard(task['_filepath'])
+        try:
+            os.rename(task['_filepath'], processing_path)
+        except FileNotFoundError:
+            return False
+        task['_processing_path'] = processing_path
+        with self._held_lock:
+            self._held.add(processing_path)
+        self._write_lease(processing_path)
+
+        # Тело задачи читаем только перед отправкой
+        try:
+            with open(processing_path, 'r', encoding='utf-8') as f:
+                body = json.load(f)
+        except Exception as e:
+            print(f"Ошибка чтения файла {processing_path}: {e}")
+            self.fail(task, f"Ошибка чтения задачи: {e}")
+            return False
+        # Тело важнее заголовка из индекса: файл могли перезаписать после разбора
+        task.update(body)
+        return True
+
+    def complete(self, task):
+        try:
+            os.remove(task['_processing_path'])
+        except FileNotFoundError:
+            # Аренда истекла, и задачу уже вернули в pending
+            print(f"Задача {task.get('id')} уже не в processing")
+        self._release(task['_processing_path'])
+
+    def fail(self, task, error_message):
+        processing_path = task['_processing_path']
+        self._mark_failed(task, error_message)
+
+        failed_path = os.path.join(self.failed_dir, os.path.basename(processing_path))
+        record = {k: v for k, v in task.items() if not k.startswith('_')}
+        task['_failed_path'] = failed_path
+
+        try:
+            with open(failed_path, 'w', encoding='utf-8') as f:
+                json.dump(record, f, indent=2, ensure_ascii=False)
+        except Exception as e:
+            print(f"Ошибка записи в failed: {e}")
+
+        try:
+            os.remove(processing_path)
+        except Exception as e:
+            print(f"Ошибка удаления файла из processing: {e}")
+        # Аренду снимаем последней, иначе задачу могут вернуть в pending раньше
+        self._release(processing_path)
+
+    def counts(self):
+        result = {"pending": len(self.index)}
+        for state, path in (("processing", self.processing_dir),
+                            ("failed", self.failed_dir),
+                            ("dead", self.dead_dir)):
+            try:
+                result[state] = sum(1 for name in os.listdir(path) if name.endswith(".json"))
+            except OSError:
+                result[state] = 0
+        return result
+
+    @staticmethod
+    def _lease_path(processing_path):
+        return f"{processing_path}.lease"
+
+    def _write_lease(self, processing_path):
+        lease_path = self._lease_path(processing_path)
+        tmp_path = f"{lease_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"worker": self.worker_id, "expires": time.time() + self.lease_ttl}, f)
+            os.replace(tmp_path, lease_path)
+        except OSError as e:
+            print(f"Ошибка записи аренды {lease_path}: {e}")
+
+    def _release(self, processing_path):
+        with self._held_lock:
+            self._held.discard(processing_path)
+        try:
+            os.remove(self._lease_path(processing_path))
+        except OSError:
+            pass
+
+    def renew_leases(self):
+        with self._held_lock:
+            held = list(self._held)
+        for processing_path in held:
+            # Задачу могли завершить после снимка: без проверки под блокировкой
+            # файл аренды создался бы заново и остался навсегда
+            with self._held_lock:
+                if processing_path in self._held:
+                    self._write_lease(processing_path)
+
+    def reap_expired(self):
+        now = time.time()
+        try:
+            names = [name for name in os.listdir(self.processing_dir) if name.endswith(".json")]
+        except OSError:
+            return 0
+        with self._held_lock:
+            held = set(self._held)
+
+        reaped = 0
+        for name in names:
+            processing_path = os.path.join(self.processing_dir, name)
+            if processing_path in held:
+                continue
+            try:
+                with open(self._lease_path(processing_path), 'r', encoding='utf-8') as f:
+                    lease = json.load(f)
+                expires = lease.get("expires", 0)
+                owner = lease.get("worker")
+            except FileNotFoundError:
+                # Воркер упал между захватом и записью аренды (или задача старой версии)
+                try:
+                    expires = os.stat(processing_path).st_ctime + self.lease_ttl
+                except FileNotFoundError:
+                    continue
+                owner = None
+            except (OSError, ValueError):
+                continue
+            if expires > now:
+                continue
+
+            try:
+                os.rename(processing_path, self.pending_path_for(name))
+            except FileNotFoundError:
+                continue
+            try:
+                os.remove(self._lease_path(processing_path))
+            except OSError:
+                pass
+            reaped += 1
+            print(f"Аренда задачи {name} истекла (воркер {owner or '?'}), задача возвращена в pending")
+        return reaped
+
+    def failed_tasks(self):
+        tasks = []
+        try:
+            names = sorted(name for name in os.listdir(self.failed_dir) if name.endswith(".json"))
+        except OSError:
+            return tasks
+        for name in names:
+            failed_path = os.path.join(self.failed_dir, name)
+            try:
+                with open(failed_path, 'r', encoding='utf-8') as f:
+                    task = json.load(f)
+            except Exception as e:
+                print(f"Ошибка чтения файла {failed_path}: {e}")
+                continue
+            task['_failed_path'] = failed_path
+            tasks.append(task)
+        return tasks
+
+    def retry(self, task):
+        name = os.path.basename(task['_failed_path'])
+        try:
+            os.rename(task['_failed_path'], self.pending_path_for(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def dead_letter(self, task):
+        os.makedirs(self.dead_dir, exist_ok=True)
+        try:
+            os.rename(task['_failed_path'], os.path.join(self.dead_dir, os.path.basename(task['_failed_path'])))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def requeue(self, task):
+        processing_path = task['_processing_path']
+        try:
+            os.rename(processing_path, self.pending_path_for(os.path.basename(processing_path)))
+            return True
+        except FileNotFoundError:
+            # Аренда истекла, и задачу уже вернули в pending
+            return False
+        finally:
+            self._release(processing_path)
+
+    def expire(self, task):
+        os.makedirs(self.dead_dir, exist_ok=True)
+        self.index.discard(task['_filepath'])
+        try:
+            os.rename(task['_filepath'], os.path.join(self.dead_dir, os.path.basename(task['_filepath'])))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def expire_pending(self, default_ttl=None):
+        # Проверяются заголовки в памяти, без чтения файлов и без обхода всей очереди
+        self.index.refresh()
+        expired = 0
+        for header in self.index.expired(time.time(), default_ttl):
+            if self.expire(header.to_task()):
+                expired += 1
+        if expired:
+            print(f"Устаревших задач перенесено в dead: {expired}")
+        return expired
+
+    def create_watcher(self, mode="auto"):
+        extra_paths = self.index.directories() if self.hashed_subdirs else ()
+        return PendingWatcher(self.pending_dir, mode=mode, extra_paths=extra_paths)
+
+
+class SQLiteWatcher:
+    """Ожидание новых задач в SQLite по PRAGMA data_version"""
+
+    def __init__(self, db_path, poll_interval=0.25):
+        self.poll_interval = poll_interval
+        self.conn = sqlite3.connect(db_path, isolation_level=None)
+        self._version = self._data_version()
+
+    @property
+    def mode(self):
+        return "sqlite"
+
+    def _data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            version = self._data_version()
+            if version != self._version:
+                self._version = version
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.poll_interval, remaining))
+
+    def close(self):
+        self.conn.close()
+
+
+class SQLiteQueueBackend(QueueBackend):
+    """Очередь в одной базе SQLite (WAL) вместо тысяч файлов"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            rowid INTEGER PRIMARY KEY,
+            task_id TEXT,
+            target TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            enqueued_at REAL NOT NULL,
+            payload TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            deadline REAL,
+            lease_owner TEXT,
+            lease_expires REAL,
+            expires_at REAL
+        );
+    """
+
+    INDEXES = """
+        CREATE INDEX IF NOT EXISTS idx_tasks_state_enqueued ON tasks(state, enqueued_at);
+        CREATE INDEX IF NOT EXISTS idx_tasks_state_target ON tasks(state, target);
+        CREATE INDEX IF NOT EXISTS idx_tasks_state_target_enqueued ON tasks(state, target, enqueued_at);
+        CREATE INDEX IF NOT EXISTS idx_tasks_urgent ON tasks(state, priority DESC, deadline, enqueued_at)
+            WHERE priority > 0 OR deadline IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS idx_tasks_expires ON tasks(state, expires_at)
+            WHERE expires_at IS NOT NULL;
+    """
+
+    def __init__(self, db_path="queue/whatsapp/queue.db", scan_limit=1000, lease_ttl=120,
+                 worker_id=None, scan_per_target=50):
+        self.db_path = db_path
+        self.scan_limit = scan_limit
+        # Обычных задач одного чата в скане не больше scan_per_target (None - без ограничения)
+        self.scan_per_target = scan_per_target
+        self.lease_ttl = lease_ttl
+        self.worker_id = worker_id or default_worker_id()
+        # Отдельное соединение для потока heartbeat: sqlite3 не делит соединения между потоками
+        self._heartbeat_conn = None
+        self.conn = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._migrate()
+        self.conn.executescript(self.INDEXES)
+
+    def _migrate(self):
+        """Добавляет столбцы, которых нет в базе, созданной старой версией"""
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(tasks)")}
+        if "priority" not in columns:
+            self.conn.execute("ALTER TABLE tasks ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+        if "deadline" not in columns:
+            self.conn.execute("ALTER TABLE tasks ADD COLUMN deadline REAL")
+        if "lease_owner" not in columns:
+            self.conn.execute("ALTER TABLE tasks ADD COLUMN lease_owner TEXT")
+            self.conn.execute("ALTER TABLE tasks ADD COLUMN lease_expires REAL")
+        if "expires_at" not in columns:
+            self.conn.execute("ALTER TABLE tasks ADD COLUMN expires_at REAL")
+
+    def enqueue(self, task):
+        """Добавляет задачу в очередь"""
+        self.enqueue_many([task])
+
+    def enqueue_many(self, tasks):
+        """Добавляет несколько задач одной транзакцией"""
+        rows = [self._row_for(task) for task in tasks]
+        with self._transaction():
+            self.conn.executemany(
+                "INSERT INTO tasks (task_id, target, state, enqueued_at, payload, priority, deadline, expires_at) "
+                "VALUES (?, ?, 'pending', ?, ?, ?, ?, ?)", rows)
+
+    @staticmethod
+    def _row_for(task, enqueued_at=None):
+        enqueued_at = task.get('enqueued_at') or enqueued_at or time.time()
+        payload = json.dumps(task, ensure_ascii=False)
+        return (task.get('id'), task['target'], enqueued_at, payload,
+                task.get('priority') or 0, task.get('deadline'), task.get('expires_at'))
+
+    def import_pending_dir(self, pending_dir):
+        """Переносит задачи из папки pending в базу, возвращает их количество"""
+        imported = 0
+        # Учитываем и хешированные подкаталоги pending/xx/*.json
+        file_paths = glob.glob(os.path.join(pending_dir, "*.json"))
+        file_paths += glob.glob(os.path.join(pending_dir, "*", "*.json"))
+        for file_path in sorted(file_paths):
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    task = json.load(f)
+                row = self._row_for(task, os.path.getmtime(file_path))
+            except Exception as e:
+                print(f"Ошибка чтения файла {file_path}: {e}")
+                continue
+
+            # Файл удаляется только после фиксации транзакции
+            with self._transaction():
+                self.conn.execute(
+                    "INSERT INTO tasks (task_id, target, state, enqueued_at, payload, priority, deadline, expires_at) "
+                    "VALUES (?, ?, 'pending', ?, ?, ?, ?, ?)", row)
+            os.remove(file_path)
+            imported += 1
+
+        if imported:
+            print(f"Импортировано задач из {pending_dir}: {imported}")
+        return imported
+
+    def scan(self, owns=None):
+        # Чужие чаты отсекаются в самом запросе, до LIMIT; owns считается раз на чат
+        owned = {}
+
+        def owns_target(target):
+            if owns is None:
+                return True
+            if target not in owned:
+                owned[target] = owns(target)
+            return owned[target]
+
+        self.conn.create_function("owns_target", 1, owns_target)
+        # Срочные задачи (приоритет или срок) - отдельным запросом по частичному индексу
+        rows = self.conn.execute(
+            "SELECT rowid, enqueued_at, payload FROM tasks WHERE state = 'pending' "
+            "AND (priority > 0 OR deadline IS NOT NULL) AND owns_target(target) "
+            "ORDER BY priority DESC, deadline IS NULL, deadline, enqueued_at LIMIT ?", (self.scan_limit,)).fetchall()
+        if len(rows) < self.scan_limit and self.scan_per_target is None:
+            rows += self.conn.execute(
+                "SELECT rowid, enqueued_at, payload FROM tasks WHERE state = 'pending' "
+                "AND priority <= 0 AND deadline IS NULL AND owns_target(target) "
+                "ORDER BY enqueued_at LIMIT ?", (self.scan_limit - len(rows),)).fetchall()
+        elif len(rows) < self.scan_limit:
+            # Первые scan_per_target задач каждого чата: большой чат не заслоняет остальные
+            rows += self.conn.execute(
+                "SELECT t.rowid, t.enqueued_at, t.payload FROM tasks t JOIN ("
+                "  SELECT rowid AS id, enqueued_at FROM ("
+                "    SELECT rowid, enqueued_at, ROW_NUMBER() OVER ("
+                "      PARTITION BY target ORDER BY enqueued_at) AS position"
+                "    FROM tasks WHERE state = 'pending' AND priority <= 0 AND deadline IS NULL"
+                "      AND owns_target(target))"
+                "  WHERE position <= ? ORDER BY enqueued_at LIMIT ?) w ON t.rowid = w.id "
+                "ORDER BY w.enqueued_at",
+                (self.scan_per_target, self.scan_limit - len(rows))).fetchall()
+        tasks = []
+        for rowid, enqueued_at, payload in rows:
+            try:
+                task = json.loads(payload)
+            except ValueError as e:
+                print(f"Ошибка чтения задачи {rowid}: {e}")
+                continue
+            task['_rowid'] = rowid
+            task['_enqueued_at'] = enqueued_at
+            tasks.append(task)
+        return tasks
+
+    def claim(self, task):
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE tasks SET state = 'processing', lease_owner = ?, lease_expires = ? "
+                "WHERE rowid = ? AND state = 'pending'",
+                (self.worker_id, time.time() + self.lease_ttl, task['_rowid']))
+        return cursor.rowcount == 1
+
+    def complete(self, task):
+        with self._transaction():
+            self.conn.execute("DELETE FROM tasks WHERE rowid = ?", (task['_rowid'],))
+
+    def fail(self, task, error_message):
+        self._mark_failed(task, error_message)
+        record = {k: v for k, v in task.items() if not k.startswith('_')}
+        with self._transaction():
+            self.conn.execute(
+                "UPDATE tasks SET state = 'failed', payload = ?, lease_owner = NULL, lease_expires = NULL "
+                "WHERE rowid = ?",
+                (json.dumps(record, ensure_ascii=False), task['_rowid']))
+
+    def counts(self):
+        result = {"pending": 0, "processing": 0, "failed": 0, "dead": 0}
+        for state, count in self.conn.execute(
+                "SELECT state, COUNT(*) FROM tasks GROUP BY state"):
+            result[state] = count
+        return result
+
+    def renew_leases(self):
+        if self._heartbeat_conn is None:
+            self._heartbeat_conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30,
+                                                   check_same_thread=False)
+        self._heartbeat_conn.execute(
+            "UPDATE tasks SET lease_expires = ? WHERE state = 'processing' AND lease_owner = ?",
+            (time.time() + self.lease_ttl, self.worker_id))
+
+    def reap_expired(self):
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE tasks SET state = 'pending', lease_owner = NULL, lease_expires = NULL "
+                "WHERE state = 'processing' AND (lease_expires IS NULL OR lease_expires < ?)",
+                (time.time(),))
+        if cursor.rowcount:
+            print(f"Аренда истекла у {cursor.rowcount} задач, задачи возвращены в pending")
+        return cursor.rowcount
+
+    def failed_tasks(self):
+        tasks = []
+        for rowid, payload in self.conn.execute(
+                "SELECT rowid, payload FROM tasks WHERE state = 'failed' ORDER BY rowid"):
+            try:
+                task = json.loads(payload)
+            except ValueError as e:
+                print(f"Ошибка чтения задачи {rowid}: {e}")
+                continue
+            task['_rowid'] = rowid
+            tasks.append(task)
+        return tasks
+
+    def requeue(self, task):
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE tasks SET state = 'pending', lease_owner = NULL, lease_expires = NULL "
+                "WHERE rowid = ? AND state = 'processing'", (task['_rowid'],))
+        return cursor.rowcount == 1
+
+    def expire(self, task):
+        return self._move(task, "pending", "dead")
+
+    def expire_pending(self, default_ttl=None):
+        now = time.time()
+        query = "UPDATE tasks SET state = 'dead' WHERE state = 'pending' AND (expires_at <= ?"
+        params = [now]
+        if default_ttl:
+            query += " OR (expires_at IS NULL AND enqueued_at <= ?)"
+            params.append(now - default_ttl)
+        with self._transaction():
+            cursor = self.conn.execute(query + ")", params)
+        if cursor.rowcount:
+            print(f"Устаревших задач перенесено в dead: {cursor.rowcount}")
+        return cursor.rowcount
+
+    def retry(self, task):
+        return self._move(task, "failed", "pending")
+
+    def dead_letter(self, task):
+        return self._move(task, "failed", "dead")
+
+    def _move(self, task, from_state, to_state):
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE tasks SET state = ? WHERE rowid = ? AND state = ?",
+                (to_state, task['_rowid'], from_state))
+        return cursor.rowcount == 1
+
+    def create_watcher(self, mode="auto"):
+        return SQLiteWatcher(self.db_path)
+
+    def close(self):
+        if self._heartbeat_conn is not None:
+            self._heartbeat_conn.close()
+            self._heartbeat_conn = None
+        self.conn.close()
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK для соединения в autocommit-режиме"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+def create_backend(kind="file", queue_dir="queue", db_path=None, hashed_subdirs=False,
+                   import_pending=True, lease_ttl=120, scan_per_target=50):
+    """Создаёт хранилище очереди по имени из конфига"""
+    if kind == "file":
+        return FileQueueBackend(queue_dir, hashed_subdirs=hashed_subdirs, lease_ttl=lease_ttl,
+                                scan_per_target=scan_per_target)
+    if kind == "sqlite":
+        if db_path is None:
+            db_path = os.path.join(queue_dir, "whatsapp", "queue.db")
+        backend = SQLiteQueueBackend(db_path, lease_ttl=lease_ttl, scan_per_target=scan_per_target)
+        # Забираем задачи, которые продюсеры успели положить файлами
+        if import_pending:
+            backend.import_pending_dir(os.path.join(queue_dir, "whatsapp", "pending"))
+        return backend
+    raise ValueError(f"Неизвестный тип очереди: {kind}")
@@ -0,0 +1,135 @@
+# queue_watcher.py - Ожидание новых задач в папке pending
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# Флаги inotify из <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class PendingWatcher:
+    """Будит воркер, как только в pending появляется полностью записанный *.json"""
+
+    def __init__(self, path, mode="auto", poll_interval=0.25, suffix=".json", extra_paths=()):
+        self.path = path
+        # Хешированные подкаталоги pending наблюдаются вместе с корнем
+        self.paths = [path] + [p for p in extra_paths if p != path]
+        self.poll_interval = poll_interval
+        self.suffix = os.fsencode(suffix)
+        self._fd = None
+        self._last_mtime = None
+
+        if mode not in ("auto", "inotify", "poll"):
+            raise ValueError(f"Неизвестный режим наблюдения: {mode}")
+
+        if mode != "poll":
+            try:
+                self._fd = self._init_inotify()
+            except OSError as e:
+                if mode == "inotify":
+                    raise
+                print(f"inotify недоступен ({e}), используется опрос каталога")
+
+        if self._fd is None:
+            # Запоминаем состояние каталога до первого сканирования воркером
+            self._last_mtime = self._dir_mtime()
+
+    @property
+    def mode(self):
+        return "inotify" if self._fd is not None else "poll"
+
+    def _init_inotify(self):
+        """Открывает inotify-дескриптор на папку pending"""
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        try:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            inotify_init1 = libc.inotify_init1
+            inotify_add_watch = libc.inotify_add_watch
+        except (OSError, AttributeError) as e:
+            raise OSError(errno.ENOSYS, f"inotify не поддерживается: {e}")
+
+        fd = inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        for path in self.paths:
+            wd = inotify_add_watch(fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                err = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(err, os.strerror(err))
+        return fd
+
+    def wait(self, timeout):
+        """Ждёт новые задачи не дольше timeout секунд. True - появились новые файлы"""
+        if self._fd is not None:
+            return self._wait_inotify(timeout)
+        return self._wait_poll(timeout)
+
+    def _wait_inotify(self, timeout):
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        return self._drain_events()
+
+    def _drain_events(self):
+        """Вычитывает накопившиеся события, True если среди них есть задача"""
+        found = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+
+            offset = 0
+            while offset < len(data):
+                _wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                # При переполнении очереди событий считаем, что задачи есть
+                if mask & IN_Q_OVERFLOW or name.endswith(self.suffix):
+                    found = True
+        return found
+
+    def _wait_poll(self, timeout):
+        """Запасной режим: следим только за mtime каталога, без его листинга"""
+        deadline = time.monotonic() + timeout
+        while True:
+            mtime = self._dir_mtime()
+            if mtime != self._last_mtime:
+                self._last_mtime = mtime
+                return True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.poll_interval, remaining))
+
+    def _dir_mtime(self):
+        mtimes = []
+        for path in self.paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def close(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
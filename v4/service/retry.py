@@ -0,0 +1,111 @@
+# retry.py - Повторная отправка упавших задач с экспоненциальной задержкой
+import time
+import heapq
+import random
+import itertools
+
+# Ошибки, которые повтор не исправит: задача уходит сразу в dead
+PERMANENT_ERRORS = (
+    "Файл не найден",
+    "Неизвестный тип контента",
+    "Ошибка чтения задачи",
+)
+
+# Поля, которые нужны хранилищу, чтобы найти задачу в failed
+_REF_KEYS = ('id', 'target', 'attempts', '_failed_path', '_rowid')
+
+
+class RetryEngine:
+    """
+    Планирует возврат задач из failed в pending по таймерам в памяти.
+    Задержка: base_delay * 2^(попытка-1), не больше max_delay, со случайным разбросом.
+    Пока браузер перезапускается (pause), наступившие повторы копятся и уходят одной пачкой.
+    """
+
+    def __init__(self, queue, max_attempts=5, base_delay=30, max_delay=3600, jitter=0.5,
+                 permanent_errors=PERMANENT_ERRORS, metrics=None):
+        self.queue = queue
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Доля задержки, которая выбирается случайно, чтобы повторы не шли толпой
+        self.jitter = jitter
+        self.permanent_errors = tuple(permanent_errors)
+        self.metrics = metrics
+        self.paused = False
+        # (время повтора, номер, ссылка на задачу)
+        self._heap = []
+        self._counter = itertools.count()
+
+    def is_permanent(self, error_message):
+        return any(pattern in (error_message or "") for pattern in self.permanent_errors)
+
+    def backoff(self, attempts):
+        """Задержка перед повтором после attempts неудачных попыток"""
+        delay = min(self.base_delay * 2 ** max(attempts - 1, 0), self.max_delay)
+        return delay * (1 - self.jitter * random.random())
+
+    def schedule(self, task, error_message, failed_at=None):
+        """Вызывается сразу после queue.fail(task)"""
+        attempts = task.get('attempts', 1)
+        if self.is_permanent(error_message) or attempts >= self.max_attempts:
+            reason = "постоянная ошибка" if self.is_permanent(error_message) else f"{attempts} попыток"
+            if self.queue.dead_letter(task):
+                print(f"Задача {task.get('id')} перенесена в dead ({reason}): {error_message}")
+                self._count("dead")
+            return None
+
+        due = (failed_at or time.time()) + self.backoff(attempts)
+        ref = {key: task[key] for key in _REF_KEYS if key in task}
+        heapq.heappush(self._heap, (due, next(self._counter), ref))
+        return due
+
+    def load(self, owns=None):
+        """Планирует повторы для задач, оставшихся в failed с прошлого запуска"""
+        scheduled = 0
+        for task in self.queue.failed_tasks():
+            if owns is not None and not owns(task.get('target', '')):
+                continue
+            if self.schedule(task, task.get('last_error'), task.get('failed_time')) is not None:
+                scheduled += 1
+        if scheduled:
+            print(f"Запланировано повторов из failed: {scheduled}")
+        return scheduled
+
+    def pause(self):
+        """Браузер перезапускается - повторы придержать"""
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def next_due_in(self):
+        """Секунд до ближайшего повтора (None - повторов нет или они на паузе)"""
+        if not self._heap or self.paused:
+            return None
+        return max(self._heap[0][0] - time.time(), 0)
+
+    def requeue_due(self):
+        """Возвращает в pending все задачи, чьё время пришло"""
+        if self.paused:
+            return 0
+        now = time.time()
+        requeued = 0
+        while self._heap and self._heap[0][0] <= now:
+            _, _, ref = heapq.heappop(self._heap)
+            try:
+                if self.queue.retry(ref):
+                    requeued += 1
+            except Exception as e:
+                print(f"Ошибка возврата задачи {ref.get('id')} в очередь: {e}")
+        if requeued:
+            print(f"Возвращено в очередь для повтора: {requeued}")
+            self._count("requeued", requeued)
+        return requeued
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _count(self, result, value=1):
+        if self.metrics is not None:
+            self.metrics.inc("whatsapp_retries_total", value, result=result)
@@ -2,19 +2,141 @@
 import sys
 import os
 
+try:
+    import config
+except ImportError:
+    # config.py необязателен, без него используются значения по умолчанию
+    config = None
+
+
+def get_setting(name, default):
+    """Читает параметр из config.py, если он задан"""
+    return getattr(config, name, default)
+
+
 def main():
     try:
         # Создаём необходимые директории
         dirs = [
             "queue/whatsapp/pending",
             "queue/whatsapp/processing", 
-            "queue/whatsapp/failed"
+            "queue/whatsapp/failed",
+            "queue/whatsapp/dead"
         ]
         for dir_path in dirs:
             os.makedirs(dir_path, exist_ok=True)
             
         from whatswork import WhatsAppWorker
-        worker = WhatsAppWorker()
+        from queue_backend import create_backend
+        from image_cache import ImagePreprocessor
+        from browser_recycle import RecyclePolicy
+        from metrics import Metrics, start_http_server
+        from tracing import Tracer
+        from scheduler import ChatScheduler
+        
+        # QUEUE_BACKEND = "file" (по умолчанию) или "sqlite"
+        backend_kind = get_setting("QUEUE_BACKEND", "file")
+        backend_options = {
+            "db_path": get_setting("QUEUE_DB_PATH", None),
+            "hashed_subdirs": get_setting("QUEUE_HASHED_SUBDIRS", False),
+            # Через сколько секунд без продления задача упавшего воркера вернётся в pending
+            "lease_ttl": get_setting("LEASE_TTL", 120),
+            # Сколько задач одного чата попадает в скан: большой чат не заслоняет остальные
+            "scan_per_target": get_setting("SCAN_PER_TARGET", 50),
+        }
+        queue_backend = create_backend(backend_kind, queue_dir="queue", **backend_options)
+        
+        # Параметры воркера
+        worker_options = {
+            "min_message_interval": get_setting("MIN_MESSAGE_INTERVAL", 0.5),
+            "text_input_engine": get_setting("TEXT_INPUT_ENGINE", "cdp"),
+            # selenium (chromedriver) или cdp (DevTools напрямую, нужен пакет websockets)
+            "browser_engine": get_setting("BROWSER_ENGINE", "selenium"),
+            "album_mode": get_setting("ALBUM_MODE", False),
+            # Склеивать подряд идущие короткие тексты в одно сообщение до N символов (0 - нет)
+            "merge_text_max_chars": get_setting("MERGE_TEXT_MAX_CHARS", 0),
+            # DEFAULT_TASK_TTL = 3600 - не отправлять задачи старше часа (у задачи может быть свой ttl)
+            "task_ttl": get_setting("DEFAULT_TASK_TTL", None),
+            # Сторож браузера: срок на операцию (открытие чата, отправка) и на запуск, в секундах;
+            # зависший браузер убивается и перезапускается, задача возвращается в pending
+            "operation_timeout": get_setting("BROWSER_OPERATION_TIMEOUT", 60),
+            "launch_timeout": get_setting("BROWSER_LAUNCH_TIMEOUT", 180),
+            "shutdown_grace": get_setting("SHUTDOWN_GRACE", 10),
+        }
+        
+        # Повторы упавших задач: число попыток и задержка (удваивается с каждой попыткой)
+        worker_options["retry_options"] = {
+            "max_attempts": get_setting("RETRY_MAX_ATTEMPTS", 5),
+            "base_delay": get_setting("RETRY_BASE_DELAY", 30),
+            "max_delay": get_setting("RETRY_MAX_DELAY", 3600),
+        }
+        
+        # Очерёдность чатов: квант на чат за проход, вес и лимит сообщений в минуту по чатам.
+        # BATCH_LINGER - сколько секунд копить задачи чата перед заходом в него
+        # (или до BATCH_MAX_TASKS задач), чтобы всплеск уходил за одно открытие чата
+        worker_options["scheduler"] = ChatScheduler(
+            quantum=get_setting("SCHEDULER_QUANTUM", 10),
+            round_tasks=get_setting("SCHEDULER_ROUND_TASKS", 50),
+            weights=get_setting("CHAT_WEIGHTS", None),
+            rate_limits=get_setting("CHAT_RATE_LIMITS", None),
+            default_rate_limit=get_setting("DEFAULT_CHAT_RATE_LIMIT", None),
+            linger=get_setting("BATCH_LINGER", 0),
+            linger_batch=get_setting("BATCH_MAX_TASKS", 20),
+        )
+        
+        # Перезапуск браузера по потреблению ресурсов
+        recycle_options = {
+            "max_rss_mb": get_setting("RECYCLE_MAX_RSS_MB", 1500),
+            "max_cpu_percent": get_setting("RECYCLE_MAX_CPU_PERCENT", 150),
+            "max_operations": get_setting("MAX_OPERATIONS", None),
+        }
+        
+        # IMAGE_PREPROCESS = True - уменьшать картинки перед загрузкой (нужен Pillow)
+        image_options = None
+        if get_setting("IMAGE_PREPROCESS", False):
+            image_options = {
+                "cache_dir": get_setting("IMAGE_CACHE_DIR", "queue/image_cache"),
+                "max_dimension": get_setting("IMAGE_MAX_DIMENSION", 1600),
+                "quality": get_setting("IMAGE_QUALITY", 80),
+                "max_cache_bytes": get_setting("IMAGE_CACHE_MAX_MB", 512) * 1024 * 1024,
+            }
+        
+        # METRICS_PORT = 9108 - отдавать метрики Prometheus на localhost
+        metrics_port = get_setting("METRICS_PORT", None)
+        
+        # TRACE_SAMPLE_RATE = 0.01 - записывать 1% циклов в queue/traces (chrome://tracing)
+        trace_options = None
+        if get_setting("TRACE_SAMPLE_RATE", None):
+            trace_options = {
+                "path": get_setting("TRACE_PATH", "queue/traces/trace.json"),
+                "sample_rate": get_setting("TRACE_SAMPLE_RATE", None),
+            }
+        
+        # WORKER_PROFILES = [...] - несколько аккаунтов, по процессу на профиль
+        profile_paths = get_setting("WORKER_PROFILES", None)
+        if profile_paths:
+            from supervisor import WorkerSupervisor
+            queue_backend.close()
+            supervisor = WorkerSupervisor(profile_paths, queue_dir="queue",
+                                          backend_kind=backend_kind,
+                                          backend_options=backend_options,
+                                          worker_options=worker_options,
+                                          image_options=image_options,
+                                          recycle_options=recycle_options,
+                                          metrics_port=metrics_port,
+                                          trace_options=trace_options)
+            supervisor.start()
+            return
+        
+        if image_options:
+            worker_options["image_preprocessor"] = ImagePreprocessor(**image_options)
+        worker_options["recycle_policy"] = RecyclePolicy(**recycle_options)
+        if trace_options:
+            worker_options["tracer"] = Tracer(**trace_options)
+        if metrics_port:
+            worker_options["metrics"] = Metrics()
+            start_http_server(worker_options["metrics"], metrics_port)
+        worker = WhatsAppWorker(queue_backend=queue_backend, **worker_options)
         worker.start()
         
     except KeyboardInterrupt:
@@ -0,0 +1,159 @@
+# scheduler.py - Порядок отправки: срочные задачи, справедливая очередь чатов, лимиты скорости
+import time
+from collections import deque
+
+
+def task_enqueued_at(task):
+    return task.get('_enqueued_at') or task.get('enqueued_at') or 0
+
+
+class ChatScheduler:
+    """
+    Раскладывает найденные задачи на план одного цикла.
+    Сначала срочные (priority > 0 или близкий deadline), затем взвешенный round robin:
+    за проход чат получает не больше quantum * вес задач, цикл - не больше round_tasks,
+    следующий цикл продолжает с того чата, на котором остановился предыдущий.
+    Внутри чата задачи идут по времени постановки в очередь.
+    С linger > 0 несрочные задачи чата копятся, пока старейшей не исполнится linger
+    секунд или их не станет linger_batch, и затем уходят за один заход в чат.
+    """
+
+    def __init__(self, quantum=10, round_tasks=50, weights=None, rate_limits=None,
+                 default_rate_limit=None, deadline_window=60, rate_period=60,
+                 linger=0, linger_batch=20):
+        self.quantum = quantum
+        self.round_tasks = round_tasks
+        # чат -> вес в справедливой очереди (по умолчанию 1)
+        self.weights = weights or {}
+        # чат -> сообщений за rate_period секунд
+        self.rate_limits = rate_limits or {}
+        self.default_rate_limit = default_rate_limit
+        self.rate_period = rate_period
+        # Задача со сроком раньше чем через deadline_window секунд считается срочной
+        self.deadline_window = deadline_window
+        # Окно накопления задач чата (секунды) и размер пачки, при котором ждать не нужно
+        self.linger = linger
+        self.linger_batch = linger_batch
+
+        self._order = deque()
+        self._sent = {}
+        # Чаты, у которых в последнем плане были задачи
+        self._queued = ()
+        # Когда истечёт окно накопления ближайшего из отложенных чатов (time.time())
+        self._linger_until = None
+
+    def is_urgent(self, task, now):
+        if (task.get('priority') or 0) > 0:
+            return True
+        deadline = task.get('deadline')
+        return deadline is not None and deadline - now <= self.deadline_window
+
+    def _rate_limit(self, chat):
+        return self.rate_limits.get(chat, self.default_rate_limit)
+
+    def allowance(self, chat, now=None):
+        """Сколько сообщений можно отправить в чат прямо сейчас; None - без лимита"""
+        limit = self._rate_limit(chat)
+        if not limit:
+            return None
+        now = time.monotonic() if now is None else now
+        sent = self._sent.get(chat)
+        while sent and now - sent[0] >= self.rate_period:
+            sent.popleft()
+        return max(limit - len(sent or ()), 0)
+
+    def record_send(self, chat):
+        """Вызывается после каждой успешной отправки"""
+        if self._rate_limit(chat):
+            self._sent.setdefault(chat, deque()).append(time.monotonic())
+
+    def lingering(self, tasks, now):
+        """Задачи чата ещё копятся: пачка мала и старейшая моложе окна"""
+        if not self.linger or len(tasks) >= self.linger_batch:
+            return False
+        return now - min(task_enqueued_at(task) for task in tasks) < self.linger
+
+    def next_ready_in(self):
+        """Через сколько секунд освободится лимит или окно хотя бы одного чата (None - ждать нечего)"""
+        now = time.monotonic()
+        waits = []
+        # Ждём только чаты с задачами в очереди, упёршиеся в лимит; allowance заодно
+        # выбрасывает отметки старше rate_period
+        for chat in self._queued:
+            if self.allowance(chat, now) == 0:
+                waits.append(self._sent[chat][0] + self.rate_period - now)
+        if self._linger_until is not None:
+            waits.append(self._linger_until - time.time())
+        return max(min(waits), 0) if waits else None
+
+    def plan(self, grouped_tasks):
+        """Список (чат, задачи) на этот цикл; остальное остаётся в очереди до следующего скана"""
+        now = time.time()
+        monotonic_now = time.monotonic()
+        budget = self.round_tasks
+        remaining = {}
+        allowance = {}
+        urgent = []
+        self._linger_until = None
+        self._queued = list(grouped_tasks)
+
+        for chat, tasks in grouped_tasks.items():
+            ordered = sorted(tasks, key=task_enqueued_at)
+            allowance[chat] = self.allowance(chat, monotonic_now)
+            urgent_tasks = [task for task in ordered if self.is_urgent(task, now)]
+            if urgent_tasks:
+                urgent_tasks.sort(key=lambda t: -(t.get('priority') or 0))
+                urgent.append((chat, urgent_tasks))
+                ordered = [task for task in ordered if not self.is_urgent(task, now)]
+            if ordered and self.lingering(ordered, now):
+                # Ждём остальные задачи всплеска, чтобы не заходить в чат дважды
+                ready_at = task_enqueued_at(ordered[0]) + self.linger
+                if self._linger_until is None or ready_at < self._linger_until:
+                    self._linger_until = ready_at
+                ordered = []
+            remaining[chat] = ordered
+
+        plan = []
+        # Срочные: выше приоритет, раньше срок, дольше ждут
+        urgent.sort(key=lambda item: (
+            -max(t.get('priority') or 0 for t in item[1]),
+            min((t['deadline'] for t in item[1] if t.get('deadline') is not None), default=float('inf')),
+            min(task_enqueued_at(t) for t in item[1]),
+        ))
+        for chat, tasks in urgent:
+            tasks = self._take(chat, tasks, len(tasks), allowance)
+            if tasks:
+                plan.append((chat, tasks))
+                budget -= len(tasks)
+
+        # Чаты, пропавшие из очереди, выбывают; новые встают в конец
+        known = set(self._order)
+        self._order = deque(chat for chat in self._order if remaining.get(chat))
+        for chat, tasks in remaining.items():
+            if tasks and chat not in known:
+                self._order.append(chat)
+
+        for _ in range(len(self._order)):
+            if budget <= 0:
+                break
+            chat = self._order[0]
+            self._order.rotate(-1)
+            quantum = self.quantum * self.weights.get(chat, 1)
+            if self.linger:
+                # Накопленная пачка разбирается за один заход
+                quantum = max(quantum, self.linger_batch)
+            tasks = self._take(chat, remaining[chat], min(quantum, budget), allowance)
+            if not tasks:
+                continue
+            budget -= len(tasks)
+            plan.append((chat, tasks))
+        return plan
+
+    @staticmethod
+    def _take(chat, tasks, count, allowance):
+        """Не больше count задач и не больше, чем разрешает лимит чата"""
+        limit = allowance.get(chat)
+        if limit is not None:
+            count = min(count, limit)
+            allowance[chat] = limit - max(min(count, len(tasks)), 0)
+        return tasks[:max(count, 0)]
@@ -0,0 +1,200 @@
+# selector_registry.py - Поиск элементов WhatsApp Web по спискам селекторов за один запрос
+import os
+import json
+import time
+import tempfile
+from dom_wait import wait_until
+
+CSS = "css selector"
+XPATH = "xpath"
+
+# Кандидаты для каждой роли: русский, английский, универсальный, альтернативный
+DEFAULT_CANDIDATES = {
+    "search_box": [
+        (CSS, '[aria-label="Поиск контактов или групп"]'),
+        (CSS, '[aria-label="Search contacts or groups"]'),
+        (XPATH, '//div[@contenteditable="true" and @data-tab="3"]'),
+        (CSS, '[data-testid="chat-list-search"]'),
+    ],
+    "message_box": [
+        (CSS, 'div[aria-label="Введите сообщение"]'),
+        (CSS, 'div[aria-label="Type a message"]'),
+        (XPATH, '//div[@contenteditable="true" and @data-tab="10"]'),
+    ],
+    "attach_button": [
+        (CSS, 'button[title="Прикрепить"]'),
+        (CSS, 'button[title="Attach"]'),
+        (CSS, 'span[data-icon="clip"]'),
+        (CSS, '[data-testid="clip"]'),
+    ],
+    "file_input": [
+        (CSS, 'input[type="file"][accept*="image"]'),
+    ],
+    "preview": [
+        (CSS, 'div[aria-label="Окно предварительного просмотра"]'),
+        (CSS, 'div[aria-label="Preview window"]'),
+        (CSS, '[data-testid="media-viewer"]'),
+        (CSS, '.media-viewer'),
+    ],
+    "caption_box": [
+        (CSS, 'div[aria-label="Введите сообщение"]'),
+        (CSS, 'div[aria-label="Type a message"]'),
+        (CSS, '[data-testid="media-caption-input"]'),
+        (XPATH, '//div[@contenteditable="true" and @data-tab="10"]'),
+    ],
+    "send_button": [
+        (CSS, 'div[aria-label="Отправить"]'),
+        (CSS, 'div[aria-label="Send"]'),
+        (CSS, 'div[data-icon="wds-ic-send-filled"]'),
+        (CSS, '[data-icon="wds-ic-send-filled"]'),
+        (CSS, 'span[data-icon="send"]'),
+        (CSS, '[data-testid="send"]'),
+    ],
+}
+
+# Проверяет всех кандидатов по порядку и возвращает [индекс, элемент, язык страницы]
+PROBE_SCRIPT = """
+    var candidates = arguments[0], clickable = arguments[1];
+    var lang = document.documentElement.lang || '';
+    function usable(el) {
+        if (!clickable) return true;
+        var rect = el.getBoundingClientRect();
+        return rect.width > 0 && rect.height > 0 && !el.disabled &&
+            getComputedStyle(el).visibility !== 'hidden';
+    }
+    for (var i = 0; i < candidates.length; i++) {
+        var el = null;
+        try {
+            if (candidates[i][0] === 'xpath') {
+                el = document.evaluate(candidates[i][1], document, null,
+                    XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+            } else {
+                el = document.querySelector(candidates[i][1]);
+            }
+        } catch (e) {
+            el = null;
+        }
+        if (el && usable(el)) return [i, el, lang];
+    }
+    return [-1, null, lang];
+"""
+
+# Для ожидания: результат пробы, когда элемент найден или язык страницы не тот,
+# под который упорядочены кандидаты (arguments[2])
+WAIT_PROBE_SCRIPT = (
+    "var probe = (function () {" + PROBE_SCRIPT + "}).apply(null, arguments);"
+    "return (probe[0] >= 0 || probe[2] !== arguments[2]) ? probe : null;"
+)
+
+
+class SelectorRegistry:
+    """Запоминает, какой селектор сработал для роли и языка, и пробует его первым"""
+
+    def __init__(self, cache_path=None, candidates=None, max_misses=3, tracer=None):
+        self.cache_path = cache_path
+        # Необязательный tracing.Tracer: каждая проба попадает в трассировку
+        self.tracer = tracer
+        self.candidates = dict(DEFAULT_CANDIDATES)
+        if candidates:
+            self.candidates.update(candidates)
+        self.max_misses = max_misses
+        # "роль|язык" -> {"selector": [by, value], "misses": n}
+        self.learned = {}
+        self.locale = ""
+        self._load()
+
+    def _load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                self.learned = json.load(f)
+        except Exception as e:
+            print(f"Ошибка чтения кэша селекторов {self.cache_path}: {e}")
+            self.learned = {}
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        # Кэш общий для воркеров супервизора: у каждой записи свой временный файл
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=".selector_cache.", suffix=".tmp",
+                                            dir=os.path.dirname(self.cache_path) or ".")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.learned, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            print(f"Ошибка записи кэша селекторов {self.cache_path}: {e}")
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def _ordered(self, role, candidates):
+        """Кандидаты роли, выученный селектор - первым"""
+        entry = self.learned.get(f"{role}|{self.locale}")
+        if not entry:
+            return list(candidates), None
+        learned = tuple(entry["selector"])
+        if learned not in [tuple(c) for c in candidates]:
+            return list(candidates), None
+        ordered = [learned] + [c for c in candidates if tuple(c) != learned]
+        return ordered, learned
+
+    def _record(self, role, learned, winner):
+        key = f"{role}|{self.locale}"
+        if learned is not None and winner == learned:
+            if self.learned[key]["misses"]:
+                self.learned[key]["misses"] = 0
+                self._save()
+            return
+
+        if learned is not None:
+            self.learned[key]["misses"] += 1
+            if self.learned[key]["misses"] < self.max_misses:
+                self._save()
+                return
+            print(f"Селектор для '{role}' ({self.locale or '?'}) устарел: {learned[1]}")
+            del self.learned[key]
+
+        if winner is not None:
+            self.learned[key] = {"selector": list(winner), "misses": 0}
+        self._save()
+
+    def find(self, driver, role, candidates=None, timeout=5, clickable=False):
+        """Ждёт элемент роли не дольше timeout, проверяя всех кандидатов при каждом изменении DOM"""
+        if self.tracer is None:
+            return self._find(driver, role, candidates, timeout, clickable)
+        with self.tracer.span(f"selector.{role}"):
+            return self._find(driver, role, candidates, timeout, clickable)
+
+    def _find(self, driver, role, candidates, timeout, clickable):
+        candidates = candidates or self.candidates[role]
+        deadline = time.monotonic() + timeout
+        while True:
+            ordered, learned = self._ordered(role, candidates)
+            probe = wait_until(driver, WAIT_PROBE_SCRIPT, [list(c) for c in ordered], clickable,
+                               self.locale, timeout=max(deadline - time.monotonic(), 0))
+            if probe is None:
+                if learned is not None:
+                    self._record(role, learned, None)
+                return None
+            index, element, lang = probe
+
+            if lang != self.locale:
+                # Язык страницы узнаём из того же запроса; выученное для него
+                # не учитывалось в этой пробе, поэтому промах не засчитываем
+                self.locale = lang
+                _, learned = self._ordered(role, candidates)
+                if index >= 0:
+                    if learned is None:
+                        self._record(role, None, tuple(ordered[index]))
+                    return element
+                if time.monotonic() < deadline:
+                    continue
+                return None
+
+            self._record(role, learned, tuple(ordered[index]))
+            return element
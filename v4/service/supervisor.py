@@ -0,0 +1,183 @@
+# supervisor.py - Пул воркеров с разными профилями Chrome и шардированием чатов
+import os
+import time
+import signal
+import bisect
+import hashlib
+import multiprocessing
+
+# Состояния воркера в общей памяти
+STATE_DOWN = 0
+STATE_STARTING = 1
+STATE_READY = 2
+
+STATE_NAMES = {
+    "down": STATE_DOWN,
+    "starting": STATE_STARTING,
+    "ready": STATE_READY,
+}
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Консистентное хеширование: при выпадении узла переезжают только его чаты"""
+
+    def __init__(self, members, replicas=64):
+        self.members = tuple(members)
+        self._keys = []
+        self._owners = []
+        points = sorted(
+            (_hash(f"{member}#{replica}"), member)
+            for member in self.members
+            for replica in range(replicas)
+        )
+        for key, member in points:
+            self._keys.append(key)
+            self._owners.append(member)
+
+    def owner(self, target):
+        if not self._keys:
+            return None
+        pos = bisect.bisect(self._keys, _hash(target)) % len(self._keys)
+        return self._owners[pos]
+
+
+class ShardMember:
+    """Взгляд одного воркера на общее кольцо шардов"""
+
+    def __init__(self, index, states):
+        self.index = index
+        self.states = states
+        self._ring = None
+
+    def set_state(self, name):
+        self.states[self.index] = STATE_NAMES[name]
+
+    def _live_members(self):
+        members = [i for i, state in enumerate(self.states) if state == STATE_READY]
+        # Пока никто не готов, свои чаты не отдаём
+        return members or [self.index]
+
+    def owns(self, target):
+        members = tuple(self._live_members())
+        if self._ring is None or self._ring.members != members:
+            self._ring = HashRing(members)
+        return self._ring.owner(target) == self.index
+
+
+def _run_worker(index, states, profile_path, queue_dir, backend_kind, backend_options, worker_options,
+                image_options, recycle_options, metrics_port, trace_options):
+    """Точка входа дочернего процесса"""
+    from whatswork import WhatsAppWorker
+    from queue_backend import create_backend
+    from image_cache import ImagePreprocessor
+    from browser_recycle import RecyclePolicy
+    from metrics import Metrics, start_http_server
+    from tracing import Tracer
+
+    shard = ShardMember(index, states)
+    shard.set_state("starting")
+    queue_backend = create_backend(backend_kind, queue_dir=queue_dir, import_pending=False,
+                                   **backend_options)
+    # Пул потоков и замеры процессов не переживают fork, поэтому создаются здесь
+    worker_options = dict(worker_options, recycle_policy=RecyclePolicy(**recycle_options))
+    if image_options:
+        worker_options["image_preprocessor"] = ImagePreprocessor(**image_options)
+    if metrics_port:
+        # Каждый воркер отдаёт метрики на своём порту: базовый + номер
+        worker_options["metrics"] = Metrics()
+        start_http_server(worker_options["metrics"], metrics_port + index)
+    if trace_options:
+        # Отдельный файл трассировки на воркер: trace.json -> trace-0.json
+        root, ext = os.path.splitext(trace_options["path"])
+        worker_options["tracer"] = Tracer(**dict(trace_options, path=f"{root}-{index}{ext}"))
+    worker = WhatsAppWorker(queue_dir=queue_dir, profile_path=profile_path,
+                            queue_backend=queue_backend, shard=shard, **worker_options)
+    try:
+        worker.start()
+    finally:
+        shard.set_state("down")
+
+
+class WorkerSupervisor:
+    """Запускает по процессу WhatsAppWorker на каждый профиль и перезапускает упавшие"""
+
+    def __init__(self, profile_paths, queue_dir="queue", backend_kind="file",
+                 backend_options=None, worker_options=None, image_options=None,
+                 recycle_options=None, metrics_port=None, trace_options=None, restart_delay=10):
+        self.profile_paths = list(profile_paths)
+        self.queue_dir = queue_dir
+        self.backend_kind = backend_kind
+        self.backend_options = backend_options or {}
+        self.worker_options = worker_options or {}
+        self.image_options = image_options
+        self.recycle_options = recycle_options or {}
+        self.metrics_port = metrics_port
+        self.trace_options = trace_options
+        self.restart_delay = restart_delay
+        self.states = multiprocessing.Array("i", len(self.profile_paths))
+        self.processes = [None] * len(self.profile_paths)
+        self.restart_at = [0.0] * len(self.profile_paths)
+        self.running = True
+
+    def _signal_handler(self, signum, frame):
+        print(f"\nСупервизор получил сигнал {signum}. Остановка воркеров...")
+        self.running = False
+
+    def _spawn(self, index):
+        process = multiprocessing.Process(
+            target=_run_worker,
+            name=f"whatsapp-worker-{index}",
+            args=(index, self.states, self.profile_paths[index], self.queue_dir,
+                  self.backend_kind, self.backend_options, self.worker_options,
+                  self.image_options, self.recycle_options, self.metrics_port,
+                  self.trace_options),
+        )
+        process.start()
+        self.processes[index] = process
+        print(f"Воркер {index} запущен (pid {process.pid}, профиль {self.profile_paths[index]})")
+
+    def start(self):
+        signal.signal(signal.SIGINT, self._signal_handler)
+        signal.signal(signal.SIGTERM, self._signal_handler)
+
+        for index in range(len(self.profile_paths)):
+            self._spawn(index)
+
+        try:
+            while self.running:
+                self._check_workers()
+                time.sleep(1)
+        finally:
+            self.stop()
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if process is not None and process.is_alive():
+                continue
+
+            if process is not None:
+                # Чаты упавшего воркера сразу переезжают на живых
+                self.states[index] = STATE_DOWN
+                print(f"Воркер {index} завершился с кодом {process.exitcode}")
+                self.processes[index] = None
+                self.restart_at[index] = now + self.restart_delay
+
+            if now >= self.restart_at[index]:
+                self._spawn(index)
+
+    def stop(self):
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for index, process in enumerate(self.processes):
+            if process is not None:
+                process.join(timeout=30)
+                if process.is_alive():
+                    process.kill()
+            self.states[index] = STATE_DOWN
+        print("Все воркеры остановлены")
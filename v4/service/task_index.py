@@ -0,0 +1,247 @@
+# task_index.py - Инкрементальный индекс задач в папке pending
+import os
+import json
+import time
+import itertools
+import zlib
+
+# Количество хешированных подкаталогов pending/00 ... pending/ff
+SUBDIR_FANOUT = 256
+
+# Каталог, изменённый недавно, перечитываем повторно: mtime в ФС грубый
+RACY_MTIME_WINDOW = 1.0
+
+
+def subdir_for(name):
+    """Имя хешированного подкаталога для файла задачи"""
+    return "%02x" % (zlib.crc32(os.fsencode(name)) % SUBDIR_FANOUT)
+
+
+class TaskHeader:
+    """Компактный заголовок задачи без текста сообщения"""
+    __slots__ = ("task_id", "target", "content_type", "file_path", "enqueued_at", "path", "inode",
+                 "mtime_ns", "priority", "deadline", "expires_at", "message_length")
+
+    def __init__(self, task_id, target, content_type, file_path, enqueued_at, path, inode, mtime_ns,
+                 priority=0, deadline=None, expires_at=None, message_length=None):
+        self.task_id = task_id
+        self.target = target
+        self.content_type = content_type
+        self.file_path = file_path
+        self.enqueued_at = enqueued_at
+        self.path = path
+        self.inode = inode
+        self.mtime_ns = mtime_ns
+        self.priority = priority
+        self.deadline = deadline
+        self.expires_at = expires_at
+        # Длина текста нужна до захвата, чтобы решить, склеивать ли сообщения
+        self.message_length = message_length
+
+    @property
+    def urgent(self):
+        return self.priority > 0 or self.deadline is not None
+
+    def to_task(self):
+        """Лёгкий словарь задачи, тело подгружается при захвате"""
+        return {
+            'id': self.task_id,
+            'target': self.target,
+            'content_type': self.content_type,
+            'file_path': self.file_path,
+            'priority': self.priority,
+            'deadline': self.deadline,
+            'expires_at': self.expires_at,
+            '_filepath': self.path,
+            '_enqueued_at': self.enqueued_at,
+            '_message_length': self.message_length,
+        }
+
+
+class TaskIndex:
+    """Помнит уже разобранные файлы по inode и разбирает только новые"""
+
+    def __init__(self, pending_dir, hashed_subdirs=False):
+        self.pending_dir = pending_dir
+        self.hashed_subdirs = hashed_subdirs
+        # Заголовки всех известных задач в порядке обнаружения
+        self._headers = {}
+        # Задачи с приоритетом или сроком отдаются первыми, даже если очередь длиннее limit
+        self._urgent = {}
+        # Задачи с собственным сроком жизни expires_at
+        self._expiring = {}
+        # Чат -> его обычные (несрочные) задачи в порядке очереди
+        self._by_target = {}
+        # Каталог -> (mtime_ns на момент листинга или None, множество путей)
+        self._dirs = {}
+        # Битые файлы: путь -> (inode, mtime_ns, size), чтобы не разбирать их повторно
+        self._broken = {}
+
+    def directories(self):
+        if not self.hashed_subdirs:
+            return [self.pending_dir]
+        return [os.path.join(self.pending_dir, "%02x" % i) for i in range(SUBDIR_FANOUT)]
+
+    def ensure_directories(self):
+        for dir_path in self.directories():
+            os.makedirs(dir_path, exist_ok=True)
+
+    def refresh(self):
+        """Перечитывает только каталоги, изменившиеся с прошлого раза"""
+        dir_paths = self.directories()
+        if self.hashed_subdirs:
+            # Продюсеры старых версий пишут прямо в корень pending
+            dir_paths = [self.pending_dir] + dir_paths
+        for dir_path in dir_paths:
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                continue
+            state = self._dirs.get(dir_path)
+            if state is not None and state[0] == mtime_ns:
+                continue
+            self._rescan_dir(dir_path, mtime_ns)
+
+    def _rescan_dir(self, dir_path, mtime_ns):
+        old_paths = self._dirs.get(dir_path, (None, set()))[1]
+        paths = set()
+        new_headers = []
+        stable = time.time() - mtime_ns / 1e9 > RACY_MTIME_WINDOW
+
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json"):
+                    continue
+                path = entry.path
+                header = self._headers.get(path)
+                if header is not None and header.inode == entry.inode():
+                    # Файл, перезаписанный на месте, разбираем заново
+                    try:
+                        unchanged = entry.stat().st_mtime_ns == header.mtime_ns
+                    except OSError:
+                        continue
+                    if unchanged:
+                        paths.add(path)
+                        continue
+
+                header = self._parse(entry)
+                if header is None:
+                    stable = False
+                    continue
+                paths.add(path)
+                new_headers.append(header)
+
+        for path in old_paths - paths:
+            self.discard(path)
+            self._broken.pop(path, None)
+
+        # Новые задачи добавляются в конец в порядке постановки в очередь
+        new_headers.sort(key=lambda h: h.enqueued_at)
+        for header in new_headers:
+            self.discard(header.path)
+            self._headers[header.path] = header
+            if header.urgent:
+                self._urgent[header.path] = header
+            else:
+                self._by_target.setdefault(header.target, {})[header.path] = header
+            if header.expires_at is not None:
+                self._expiring[header.path] = header
+
+        self._dirs[dir_path] = (mtime_ns if stable else None, paths)
+
+    def _parse(self, entry):
+        try:
+            st = entry.stat()
+        except OSError:
+            return None
+
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if self._broken.get(entry.path) == signature:
+            return None
+
+        try:
+            with open(entry.path, 'r', encoding='utf-8') as f:
+                task = json.load(f)
+            header = TaskHeader(
+                task.get('id'),
+                task['target'],
+                task.get('content_type'),
+                task.get('file_path'),
+                task.get('enqueued_at') or st.st_mtime,
+                entry.path,
+                st.st_ino,
+                st.st_mtime_ns,
+                task.get('priority') or 0,
+                task.get('deadline'),
+                task.get('expires_at'),
+                len(task['message']) if isinstance(task.get('message'), str) else None,
+            )
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Ошибка чтения файла {entry.path}: {e}")
+            self._broken[entry.path] = signature
+            return None
+
+        self._broken.pop(entry.path, None)
+        return header
+
+    def headers(self, limit=None, per_target=None, owns=None):
+        """
+        Заголовки задач: сначала срочные, затем в порядке очереди, не больше limit.
+        С per_target от каждого чата берутся только его первые per_target обычных задач,
+        чтобы большой чат не заслонял остальные. owns(target) - только чаты этого воркера.
+        """
+        if limit is None:
+            limit = len(self._headers)
+        result = [header for header in self._urgent.values()
+                  if owns is None or owns(header.target)][:limit]
+        if per_target is None:
+            for header in self._headers.values():
+                if len(result) >= limit:
+                    break
+                if header.path not in self._urgent and (owns is None or owns(header.target)):
+                    result.append(header)
+            return result
+
+        window = []
+        for target, headers in self._by_target.items():
+            if owns is None or owns(target):
+                window.extend(itertools.islice(headers.values(), per_target))
+        window.sort(key=lambda header: header.enqueued_at)
+        return result + window[:max(limit - len(result), 0)]
+
+    def by_age(self):
+        """Все заголовки от старых к новым, срочные - в самом конце (для вытеснения)"""
+        ordinary = [header for header in self._headers.values() if header.path not in self._urgent]
+        return ordinary + list(self._urgent.values())
+
+    def expired(self, now, default_ttl=None):
+        """
+        Заголовки устаревших задач. Без default_ttl просматриваются только задачи
+        с expires_at; с ним - ещё очередь от старых к новым до первой свежей задачи.
+        """
+        result = [header for header in self._expiring.values() if header.expires_at <= now]
+        if default_ttl:
+            for header in self._headers.values():
+                if header.expires_at is not None:
+                    continue
+                if header.enqueued_at + default_ttl > now:
+                    break
+                result.append(header)
+        return result
+
+    def discard(self, path):
+        """Убирает задачу из индекса после захвата"""
+        header = self._headers.pop(path, None)
+        self._urgent.pop(path, None)
+        self._expiring.pop(path, None)
+        if header is not None:
+            headers = self._by_target.get(header.target)
+            if headers is not None:
+                headers.pop(path, None)
+                if not headers:
+                    del self._by_target[header.target]
+
+    def __len__(self):
+        return len(self._headers)
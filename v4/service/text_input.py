@@ -0,0 +1,111 @@
+# text_input.py - Ввод текста в поле WhatsApp Web одной операцией
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.common.keys import Keys
+
+# Вставка через событие paste: редактор сам превращает \n в переносы строк
+PASTE_SCRIPT = """
+    var el = arguments[0], text = arguments[1];
+    el.focus();
+    var data = new DataTransfer();
+    data.setData('text/plain', text);
+    var event = new ClipboardEvent('paste', {clipboardData: data, bubbles: true, cancelable: true});
+    el.dispatchEvent(event);
+    return event.defaultPrevented;
+"""
+
+# Вставка фрагмента в позицию курсора (для символов вне BMP в режиме keys)
+INSERT_TEXT_SCRIPT = """
+    arguments[0].focus();
+    return document.execCommand('insertText', false, arguments[1]);
+"""
+
+# Очистка поля (contenteditable) перед повторным вводом, чтобы не задвоить текст
+CLEAR_SCRIPT = """
+    arguments[0].focus();
+    document.execCommand('selectAll', false, null);
+    document.execCommand('delete', false, null);
+"""
+
+# Shift+Enter для DevTools Input.dispatchKeyEvent
+SHIFT_MODIFIER = 8
+SHIFT_ENTER_EVENT = {
+    "key": "Enter",
+    "code": "Enter",
+    "windowsVirtualKeyCode": 13,
+    "nativeVirtualKeyCode": 13,
+    "modifiers": SHIFT_MODIFIER,
+}
+
+
+class TextInput:
+    """Вводит текст выбранным способом: cdp, paste или keys (посимвольно)"""
+
+    ENGINES = ("cdp", "paste", "keys")
+
+    def __init__(self, driver, engine="cdp"):
+        if engine not in self.ENGINES:
+            raise ValueError(f"Неизвестный способ ввода текста: {engine}")
+        self.driver = driver
+        self.engine = engine
+
+    def type(self, element, text):
+        """Вводит text в element, переносы строк - как Shift+Enter"""
+        if not text:
+            return
+        if self.engine != "keys":
+            try:
+                if self.engine == "cdp":
+                    self._type_cdp(element, text)
+                else:
+                    self._type_paste(element, text)
+                return
+            except WebDriverException as e:
+                # Дальше в этой сессии вводим по-старому
+                print(f"Ввод текста через {self.engine} не удался ({e}), переключаемся на send_keys")
+                self.engine = "keys"
+                # Часть строк могла уже попасть в поле - вводим сообщение заново
+                self.driver.execute_script(CLEAR_SCRIPT, element)
+        self._type_keys(element, text)
+
+    def _type_cdp(self, element, text):
+        """DevTools Input.insertText: одна команда на строку независимо от длины"""
+        element.click()
+        for number, line in enumerate(text.split("\n")):
+            if number:
+                self._cdp_shift_enter()
+            if line:
+                self.driver.execute_cdp_cmd("Input.insertText", {"text": line})
+
+    def _cdp_shift_enter(self):
+        self.driver.execute_cdp_cmd("Input.dispatchKeyEvent", dict(SHIFT_ENTER_EVENT, type="rawKeyDown"))
+        self.driver.execute_cdp_cmd("Input.dispatchKeyEvent", dict(SHIFT_ENTER_EVENT, type="keyUp"))
+
+    def _type_paste(self, element, text):
+        """Синтетическая вставка из буфера обмена: один запрос на всё сообщение"""
+        if not self.driver.execute_script(PASTE_SCRIPT, element, text):
+            raise WebDriverException("редактор не обработал вставку")
+
+    def _type_keys(self, element, text):
+        """Посимвольный ввод send_keys; символы вне BMP вставляются отдельно"""
+        for number, line in enumerate(text.split("\n")):
+            if number:
+                ActionChains(self.driver).key_down(Keys.SHIFT).send_keys(Keys.ENTER).key_up(Keys.SHIFT).perform()
+            for chunk, is_bmp in _split_bmp(line):
+                if is_bmp:
+                    element.send_keys(chunk)
+                else:
+                    # ChromeDriver не умеет отправлять такие символы нажатиями
+                    self.driver.execute_script(INSERT_TEXT_SCRIPT, element, chunk)
+
+
+def _split_bmp(text):
+    """Делит строку на куски из символов BMP и символов вне его"""
+    chunks = []
+    for char in text:
+        is_bmp = ord(char) <= 0xFFFF
+        if chunks and chunks[-1][1] == is_bmp:
+            chunks[-1][0] += char
+        else:
+            chunks.append([char, is_bmp])
+    return [(chunk, is_bmp) for chunk, is_bmp in chunks]
@@ -0,0 +1,164 @@
+# tracing.py - Выборочная трассировка циклов воркера в формате Chrome trace-event
+import os
+import json
+import time
+import random
+
+# Дорожки в просмотрщике трассировок
+WORKER_TID = 1
+QUEUE_TID = 2
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "started")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.record(self.name, self.started, time.time(), **self.args)
+        return False
+
+
+class _Round:
+    __slots__ = ("tracer",)
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    def __enter__(self):
+        self.tracer._active = random.random() < self.tracer.sample_rate
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer._active = False
+        self.tracer.flush()
+        return False
+
+
+class Tracer:
+    """Пишет отобранные циклы обработки в ротируемый JSON-файл для chrome://tracing / Perfetto"""
+
+    enabled = True
+
+    def __init__(self, path="queue/traces/trace.json", sample_rate=0.01,
+                 max_bytes=50 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.pid = os.getpid()
+        self._active = False
+        self._events = []
+        self._file = None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def round(self):
+        """Один цикл воркера; решение о записи принимается на весь цикл"""
+        return _Round(self)
+
+    def span(self, name, **args):
+        if not self._active:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def record(self, name, start, end, tid=WORKER_TID, **args):
+        """Готовый отрезок времени (секунды time.time())"""
+        if not self._active:
+            return
+        self._events.append({
+            "name": name,
+            "ph": "X",
+            "ts": int(start * 1e6),
+            "dur": max(int((end - start) * 1e6), 0),
+            "pid": self.pid,
+            "tid": tid,
+            "args": args,
+        })
+
+    def instrument_driver(self, driver, prefix="webdriver"):
+        """Оборачивает каждый запрос к chromedriver (или команду DevTools) в отрезок трассировки"""
+        execute = driver.execute
+
+        def traced_execute(driver_command, params=None, *args):
+            if not self._active:
+                return execute(driver_command, params, *args)
+            with _Span(self, f"{prefix}.{driver_command}", {}):
+                return execute(driver_command, params, *args)
+
+        driver.execute = traced_execute
+
+    def flush(self):
+        if not self._events:
+            return
+        if self._file is None or self._file.tell() >= self.max_bytes:
+            self._rotate()
+        # Формат JSON Array: закрывающая скобка необязательна, дописывать можно по строке
+        self._file.write("".join(json.dumps(event, ensure_ascii=False) + ",\n" for event in self._events))
+        self._file.flush()
+        self._events = []
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        # Файл прошлого запуска тоже уходит в архив, а не затирается
+        if os.path.exists(self.path):
+            for number in range(self.backup_count - 1, 0, -1):
+                source = f"{self.path}.{number}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{number + 1}")
+            os.replace(self.path, f"{self.path}.1")
+
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._file.write("[\n")
+        for tid, name in ((WORKER_TID, "worker"), (QUEUE_TID, "queue wait")):
+            meta = {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+            self._file.write(json.dumps(meta) + ",\n")
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class NullTracer:
+    """Трассировка выключена"""
+
+    enabled = False
+
+    def round(self):
+        return _NULL_SPAN
+
+    def span(self, name, **args):
+        return _NULL_SPAN
+
+    def record(self, name, start, end, tid=WORKER_TID, **args):
+        pass
+
+    def instrument_driver(self, driver, prefix="webdriver"):
+        pass
+
+    def close(self):
+        pass
@@ -1,47 +1,208 @@
 # whatsapp_worker.py
 import os
-import json
 import time
-import glob
 import signal
 import sys
 import atexit
-import psutil
 from collections import defaultdict
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import TimeoutException, WebDriverException
-from selenium.webdriver.common.keys import Keys
+from queue_backend import FileQueueBackend, task_expires_at
+from selector_registry import SelectorRegistry
+from chromedriver_cache import resolve_chromedriver, is_version_mismatch
+from browser_recycle import RecyclePolicy
+from chrome_tree import ChromeProcessTree
+from metrics import NullMetrics
+from tracing import NullTracer, QUEUE_TID
+from scheduler import ChatScheduler
+from retry import RetryEngine
+from leases import LeaseHeartbeat
+from browser_engine import SeleniumEngine, EngineError
+from browser_watchdog import BrowserWatchdog
+
+# Заголовок открытого чата
+CHAT_HEADER_SCRIPT = """
+    var header = document.querySelector('#main header');
+    if (!header) return null;
+    var span = header.querySelector('span[title]') || header.querySelector('span[dir="auto"]');
+    return span ? (span.getAttribute('title') || span.textContent) : null;
+"""
+
+# Видимые чаты в боковой панели и строка нужного чата, если она видна
+SIDE_PANEL_SCRIPT = """
+    var name = arguments[0];
+    var side = document.querySelector('#side');
+    if (!side) return [[], null];
+    var titles = [], found = null;
+    side.querySelectorAll('span[title]').forEach(function (span) {
+        var title = span.getAttribute('title');
+        titles.push(title);
+        if (!found && title === name) found = span;
+    });
+    return [titles, found];
+"""
+
+# Миниатюры файлов в карусели предпросмотра
+ALBUM_THUMBNAILS_SCRIPT = """
+    var preview = document.querySelector(
+        'div[aria-label="Окно предварительного просмотра"], div[aria-label="Preview window"], ' +
+        '[data-testid="media-viewer"], [data-testid="media-editor"]') || document;
+    var thumbs = preview.querySelectorAll('[data-testid="media-thumb"], div[role="button"] img[src^="blob:"]');
+    return Array.prototype.map.call(thumbs, function (el) {
+        return el.closest('[role="button"]') || el;
+    });
+"""
+
+# data-id последнего исходящего сообщения и его статус (часы / галочки)
+LAST_OUTGOING_SCRIPT = """
+    var bubbles = document.querySelectorAll('#main div.message-out');
+    if (!bubbles.length) return null;
+    var last = bubbles[bubbles.length - 1];
+    var holder = last.closest('[data-id]');
+    var icon = last.querySelector(
+        'span[data-icon="msg-time"], span[data-icon="msg-check"], span[data-icon="msg-dblcheck"]');
+    return [holder ? holder.getAttribute('data-id') : null, icon ? icon.getAttribute('data-icon') : null];
+"""
+
+# Окно предпросмотра вложения с загруженной картинкой
+PREVIEW_READY_SCRIPT = """
+    var preview = document.querySelector(
+        'div[aria-label="Окно предварительного просмотра"], div[aria-label="Preview window"], ' +
+        '[data-testid="media-viewer"], [data-testid="media-editor"]') || document;
+    var img = preview.querySelector('img[src^="blob:"]');
+    return !!(img && img.complete && img.naturalWidth > 0);
+"""
+
+# Открыт нужный чат
+HEADER_MATCHES_SCRIPT = "return (function () {" + CHAT_HEADER_SCRIPT + "})() === arguments[0];"
+
+# Появился новый исходящий пузырь с часами или галочками
+OUTGOING_APPEARED_SCRIPT = (
+    "var last = (function () {" + LAST_OUTGOING_SCRIPT + "})();"
+    "return !!(last && last[0] !== arguments[0] && last[1]);"
+)
+
+# Видимый результат поиска с нужным названием чата
+SEARCH_RESULT_SCRIPT = """
+    var spans = document.querySelectorAll('span[title]');
+    for (var i = 0; i < spans.length; i++) {
+        if (spans[i].getAttribute('title') !== arguments[0]) continue;
+        var rect = spans[i].getBoundingClientRect();
+        if (rect.width > 0 && rect.height > 0) return spans[i];
+    }
+    return null;
+"""
+
+SIDE_READY_SCRIPT = "return !!document.getElementById('side');"
 
 class WhatsAppWorker:
-    def __init__(self, queue_dir="queue", profile_path="/home/alexova/chrome_profile"):
+    def __init__(self, queue_dir="queue", profile_path="/home/alexova/chrome_profile",
+                 watch_mode="auto", rescan_interval=60, queue_backend=None, shard=None,
+                 min_message_interval=0.5, completion_timeout=15, selector_cache_path=None,
+                 text_input_engine="cdp", album_mode=False, album_max_size=30,
+                 image_preprocessor=None, prefetch_chats=2, recycle_policy=None, metrics=None,
+                 tracer=None, web_url="https://web.whatsapp.com/", scheduler=None, retry_options=None,
+                 browser_engine="selenium", merge_text_max_chars=0, task_ttl=None,
+                 operation_timeout=60, launch_timeout=180, probe_idle=30, shutdown_grace=10):
         self.queue_dir = queue_dir
-        self.pending_dir = os.path.join(queue_dir, "whatsapp", "pending")
-        self.processing_dir = os.path.join(queue_dir, "whatsapp", "processing")
-        self.failed_dir = os.path.join(queue_dir, "whatsapp", "failed")
+        # Адрес WhatsApp Web (для нагрузочных прогонов - локальная копия страницы)
+        self.web_url = web_url
+        # Хранилище очереди: по умолчанию папки pending/processing/failed
+        self.queue = queue_backend or FileQueueBackend(queue_dir)
+        # При работе под супервизором воркер обрабатывает только свои чаты
+        self.shard = shard
         self.profile_path = profile_path
-        self.driver = None
-        self.service = None
+        # Как воркер управляет Chrome: selenium (chromedriver) или cdp (DevTools напрямую)
+        self.browser_engine = browser_engine
+        self.browser = None
+        # Способ ввода текста в движке selenium: cdp, paste или keys (send_keys)
+        self.text_input_engine = text_input_engine
+        # Подряд идущие картинки в один чат отправляются одной загрузкой
+        self.album_mode = album_mode
+        self.album_max_size = album_max_size
+        # Подряд идущие короткие тексты в один чат склеиваются в одно сообщение
+        # не длиннее merge_text_max_chars символов (0 - не склеивать)
+        self.merge_text_max_chars = merge_text_max_chars
+        # Задачи старше task_ttl секунд (или с истёкшим expires_at) уходят в dead без отправки
+        self.task_ttl = task_ttl
+        # Уменьшение картинок заранее, пока отправляются предыдущие чаты
+        self.images = image_preprocessor
+        self.prefetch_chats = prefetch_chats
         self.operation_count = 0
-        self.max_operations = 100
         self.running = True
         
+        # Порядок чатов: срочные задачи, справедливая очередь, лимиты скорости по чатам
+        self.scheduler = scheduler or ChatScheduler()
+        
+        # Метрики; без них вызовы - пустые заглушки
+        self.metrics = metrics or NullMetrics()
+        self.queue_gauges_interval = 5
+        self._queue_gauges_at = 0.0
+        # Выборочная трассировка циклов (Chrome trace-event)
+        self.tracer = tracer or NullTracer()
+        
+        # Повторы упавших задач с экспоненциальной задержкой, исчерпанные - в dead
+        self.retries = RetryEngine(self.queue, metrics=self.metrics, **(retry_options or {}))
+        
+        # Аренда захваченных задач продлевается в фоне; задачи упавших воркеров
+        # возвращаются в pending при запуске и затем раз в reap_interval секунд
+        self.heartbeat = None
+        self.reap_interval = 60
+        self._reaped_at = None
+        
+        # Перезапуск браузера по RSS/CPU его процессов, а не по числу операций
+        self.recycle_policy = recycle_policy or RecyclePolicy()
+        # Путь к chromedriver определяется один раз и кэшируется на диске
+        self.chromedriver_cache = os.path.join(queue_dir, "chromedriver.json")
+        self.chromedriver_path = None
+        self.restart_timings = {}
+        # Процессы, запущенные нашим движком; чужие Chrome не трогаем
+        self.chrome_tree = ChromeProcessTree(profile_path)
+        
+        # Сторож: операция с браузером дольше operation_timeout (запуск - launch_timeout)
+        # или смерть его процессов - браузер убивается, задача возвращается в pending
+        self.operation_timeout = operation_timeout
+        self.launch_timeout = launch_timeout
+        # Простоявший дольше probe_idle секунд браузер проверяется коротким скриптом перед чатом
+        self.probe_idle = probe_idle
+        # Сколько ждать текущую операцию после SIGTERM
+        self.shutdown_grace = shutdown_grace
+        self.watchdog = BrowserWatchdog(self._on_browser_hang)
+        
+        # Минимальная пауза между отправками (ограничение скорости)
+        self.min_message_interval = min_message_interval
+        # Сколько ждать подтверждения от интерфейса (заголовок, превью, пузырь)
+        self.completion_timeout = completion_timeout
+        self._last_send_at = 0.0
+        
+        # Открытый сейчас чат и индекс чатов, видимых в боковой панели
+        self.current_chat = None
+        self.side_chats = set()
+        self.side_chats_updated = 0.0
+        self.side_index_ttl = 30
+        
+        # Селекторы, сработавшие в прошлый раз, пробуются первыми
+        if selector_cache_path is None:
+            selector_cache_path = os.path.join(queue_dir, "selector_cache.json")
+        self.selectors = SelectorRegistry(selector_cache_path, tracer=self.tracer)
+        
+        # Ожидание новых задач: inotify или опрос mtime каталога
+        self.watch_mode = watch_mode
+        self.rescan_interval = rescan_interval
+        self.watcher = None
+        
         # Регистрируем обработчики сигналов
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
         
         # Регистрируем cleanup при выходе
+        self._cleaned_up = False
         atexit.register(self.cleanup)
 
     def _signal_handler(self, signum, frame):
         """Обработчик сигналов для корректного завершения"""
         print(f"\nПолучен сигнал {signum}. Завершение работы...")
         self.running = False
+        # Зависшая отправка не должна держать остановку: задача вернётся в pending
+        self.watchdog.stop_within(self.shutdown_grace)
 
     def start(self):
         """Запускает воркер"""
@@ -49,125 +210,234 @@ class WhatsAppWorker:
         
         try:
             self.init_browser()
+            self.watcher = self.queue.create_watcher(self.watch_mode)
+            print(f"Наблюдение за очередью: {self.watcher.mode}")
+            self.retries.load(self.shard.owns if self.shard else None)
+            self.heartbeat = LeaseHeartbeat(self.queue)
             
             while self.running:
                 try:
-                    tasks = self.scan_pending_tasks()
-                    if not tasks:
-                        time.sleep(5)
-                        continue
-                    
-                    grouped_tasks = self.group_tasks_by_chat(tasks)
-                    self.process_grouped_tasks(grouped_tasks)
+                    if self.watchdog.tripped or self.browser is None:
+                        self._recover_browser()
+                    with self.tracer.round():
+                        self._reap_expired_leases()
+                        self.retries.requeue_due()
+                        self._expire_stale_tasks()
+                        with self.metrics.time("whatsapp_stage_seconds", stage="scan"), \
+                                self.tracer.span("scan"):
+                            tasks = self.scan_pending_tasks()
+                        self._update_queue_gauges()
+                        
+                        planned = 0
+                        if tasks:
+                            with self.tracer.span("group_tasks_by_chat", tasks=len(tasks)):
+                                grouped_tasks = self.group_tasks_by_chat(tasks)
+                            planned = self.process_grouped_tasks(grouped_tasks)
+                            
+                    if not planned:
+                        # Очередь пуста или все чаты упёрлись в лимит скорости
+                        waits = [self.retries.next_due_in()]
+                        if tasks:
+                            waits.append(self.scheduler.next_ready_in())
+                        waits = [wait for wait in waits if wait is not None]
+                        self.wait_for_tasks(min(waits) if waits else None)
                     
                 except KeyboardInterrupt:
                     print("Получен SIGINT, остановка...")
                     break
                 except Exception as e:
                     print(f"Ошибка в основном цикле: {e}")
-                    time.sleep(10)
+                    # Зависший браузер перезапускается сразу, остальные ошибки - с паузой
+                    if not self.watchdog.tripped:
+                        time.sleep(10)
                     
         except Exception as e:
             print(f"Критическая ошибка: {e}")
         finally:
             self.cleanup()
 
+    def _reap_expired_leases(self):
+        now = time.monotonic()
+        if self._reaped_at is not None and now - self._reaped_at < self.reap_interval:
+            return
+        self._reaped_at = now
+        try:
+            self.queue.reap_expired()
+        except Exception as e:
+            print(f"Ошибка возврата задач с истёкшей арендой: {e}")
+
+    def _expire_stale_tasks(self):
+        """Убирает из pending устаревшие задачи, пока они не заняли место в плане"""
+        try:
+            expired = self.queue.expire_pending(self.task_ttl)
+        except Exception as e:
+            print(f"Ошибка удаления устаревших задач: {e}")
+            return
+        if expired:
+            self.metrics.inc("whatsapp_tasks_total", expired, result="expired", content_type="unknown")
+
+    def _drop_expired(self, tasks):
+        """Задачи чата, которые ещё не устарели; остальные - в dead"""
+        now = time.time()
+        fresh = []
+        for task in tasks:
+            expires_at = task_expires_at(task, self.task_ttl)
+            if expires_at is None or expires_at > now:
+                fresh.append(task)
+            elif self.queue.expire(task):
+                print(f"Задача {task['id']} устарела и не будет отправлена")
+                self.metrics.inc("whatsapp_tasks_total", result="expired",
+                                 content_type=task.get('content_type'))
+        return fresh
+
+    def wait_for_tasks(self, max_wait=None):
+        """Ждёт появления новых задач вместо фиксированной паузы"""
+        idle_since = time.monotonic()
+        limit = self.rescan_interval if max_wait is None else min(max_wait, self.rescan_interval)
+        while self.running:
+            # Короткие интервалы, чтобы сигнал остановки обрабатывался быстро
+            left = limit - (time.monotonic() - idle_since)
+            if self.watcher.wait(min(1.0, max(left, 0))):
+                return True
+            # Страховочное пересканирование на случай потерянных событий
+            if time.monotonic() - idle_since >= limit:
+                return False
+        return False
+
+    def _set_shard_state(self, state):
+        if self.shard:
+            self.shard.set_state(state)
+
     def init_browser(self):
         """Инициализирует браузер"""
-        # Закрываем предыдущий браузер если есть
-        if self.driver:
-            try:
-                self.driver.quit()
-            except:
-                pass
-            self.driver = None
-            
-        if self.service:
-            try:
-                self.service.stop()
-            except:
-                pass
-            self.service = None
-            
-        # Убиваем зависшие процессы Chrome
-        self._kill_chrome_processes()
+        # Пока браузер перезапускается, наши чаты обслуживают другие воркеры,
+        # а повторы ждут и уходят одной пачкой после запуска
+        self._set_shard_state("starting")
+        self.retries.pause()
+        timings = {}
+        phase_start = time.monotonic()
+        
+        # Закрываем предыдущий браузер и убиваем зависшие процессы своего Chrome
+        # (в том числе от прошлого запуска)
+        self._close_browser()
+        phase_start = self._finish_phase(timings, "kill", phase_start)
+        self.watchdog.rearm()
         
         try:
-            chrome_options = Options()
-            chrome_options.add_argument(f"--user-data-dir={self.profile_path}")
-            chrome_options.add_argument("--no-sandbox")
-            chrome_options.add_argument("--disable-dev-shm-usage")
-            chrome_options.add_argument("--disable-gpu")
-            chrome_options.add_argument("--disable-extensions")
-            chrome_options.add_argument("--disable-web-security")
-            chrome_options.add_argument("--disable-features=VizDisplayCompositor")
-            chrome_options.add_argument("--remote-debugging-port=0")  # Случайный порт
-            chrome_options.add_argument(
-                "--user-agent=Mozilla/5.0 (iPad; CPU OS 13_6 like Mac OS X) "
-                "AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.1.2 Mobile/15E148 Safari/604.1"
-            )
-            
-            # Убрать после первого входа в сессию и необходимости оконного режима
-            chrome_options.add_argument("--headless=new")
-            
-            self.service = Service(ChromeDriverManager().install())
-            self.driver = webdriver.Chrome(service=self.service, options=chrome_options)
-            self.driver.implicitly_wait(10)
-            
-            self.driver.get("https://web.whatsapp.com/")
-            
-            try:
-                WebDriverWait(self.driver, 60).until(
-                    EC.presence_of_element_located((By.XPATH, '//*[@id="side"]'))
-                )
-                print("WhatsApp Web загружен успешно!")
-                self.operation_count = 0
-                return True
+            with self.watchdog.guard("init_browser", self.launch_timeout):
+                self._launch_browser()
+                self.chrome_tree.attach(self.browser.root_pid)
+                self.browser.instrument(self.tracer)
+                phase_start = self._finish_phase(timings, "launch", phase_start)
                 
-            except TimeoutException:
-                print("Ошибка загрузки WhatsApp Web")
-                raise
+                self.browser.open(self.web_url)
+                phase_start = self._finish_phase(timings, "page_load", phase_start)
+                
+                if not self.browser.wait_for(SIDE_READY_SCRIPT, timeout=60):
+                    print("Ошибка загрузки WhatsApp Web")
+                    raise EngineError("WhatsApp Web не загрузился за 60 секунд")
+                    
+            self._finish_phase(timings, "side_ready", phase_start)
+            self.watchdog.attach(self.browser.alive)
+            self.restart_timings = timings
+            self.metrics.inc("whatsapp_browser_restarts_total")
+            for phase, seconds in timings.items():
+                self.metrics.observe("whatsapp_browser_restart_phase_seconds", seconds, phase=phase)
+            print("WhatsApp Web загружен успешно! " +
+                  ", ".join(f"{name} {seconds:.1f}с" for name, seconds in timings.items()))
+            self.operation_count = 0
+            self.recycle_policy.reset()
+            self.current_chat = None
+            self.side_chats = set()
+            self.side_chats_updated = 0.0
+            self._set_shard_state("ready")
+            self.retries.resume()
+            return True
                 
         except Exception as e:
             print(f"Ошибка инициализации браузера: {e}")
-            self.cleanup()
+            # Закрываем только браузер: очередь и фоновые потоки нужны для следующей попытки
+            self._close_browser()
             raise
 
-    def _kill_chrome_processes(self):
-        """Убивает зависшие процессы Chrome"""
+    def _close_browser(self):
+        """Закрывает браузер и добивает процессы своего Chrome"""
+        self.watchdog.detach()
+        if self.browser:
+            try:
+                self.browser.quit()
+            except Exception as e:
+                print(f"Ошибка при закрытии браузера: {e}")
+            self.browser = None
         try:
-            for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-                try:
-                    if proc.info['name'] and 'chrome' in proc.info['name'].lower():
-                        if proc.info['cmdline'] and any('user-data-dir' in arg for arg in proc.info['cmdline']):
-                            if any(self.profile_path in arg for arg in proc.info['cmdline']):
-                                print(f"Убиваем процесс Chrome: {proc.info['pid']}")
-                                proc.terminate()
-                                try:
-                                    proc.wait(timeout=5)
-                                except psutil.TimeoutExpired:
-                                    proc.kill()
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                    pass
+            self.chrome_tree.kill()
         except Exception as e:
-            print(f"Ошибка при завершении процессов Chrome: {e}")
+            print(f"Ошибка при остановке процессов Chrome: {e}")
+
+    def _on_browser_hang(self, reason):
+        """Вызывается из потока сторожа: убитый Chrome обрывает зависший вызов"""
+        self.metrics.inc("whatsapp_browser_hangs_total")
+        # Запуск мог зависнуть до attach в init_browser: корень берём у движка,
+        # процесс у него появляется сразу после старта
+        browser = self.browser
+        root_pid = browser.root_pid if browser is not None else None
+        if root_pid is not None and self.chrome_tree.root_pid != root_pid:
+            self.chrome_tree.attach(root_pid)
+        self.chrome_tree.kill(timeout=2)
+
+    def _recover_browser(self):
+        """Перезапуск после зависания или неудачного запуска, без паузы"""
+        if self.watchdog.tripped:
+            print(f"Перезапуск зависшего браузера ({self.watchdog.tripped})")
+        self.init_browser()
+
+    def _probe_browser(self):
+        """Браузер давно простаивал - проверяем, что страница отвечает, до захвата задач"""
+        if self.watchdog.idle_for() < self.probe_idle:
+            return True
+        try:
+            with self.watchdog.guard("probe", min(self.operation_timeout, 10)):
+                self.browser.execute_script("return document.readyState")
+        except Exception as e:
+            self.watchdog.trip(f"страница не отвечает: {e}")
+        return not self.watchdog.tripped
+
+    def _launch_browser(self):
+        self.browser = self._create_browser()
+        try:
+            self.browser.launch(self.profile_path)
+        except Exception as e:
+            if self.browser_engine != "selenium" or not is_version_mismatch(e):
+                raise
+            # Chrome обновился, а кэш указывает на старый chromedriver - ищем заново один раз
+            print(f"chromedriver не подходит к Chrome ({e}), определяем путь заново")
+            self.browser.quit()
+            self.chromedriver_path = None
+            self.chromedriver_path = resolve_chromedriver(self.chromedriver_cache, refresh=True)
+            self.browser = self._create_browser()
+            self.browser.launch(self.profile_path)
+
+    def _create_browser(self):
+        if self.browser_engine == "cdp":
+            from cdp_engine import CdpEngine
+            return CdpEngine()
+        if self.browser_engine != "selenium":
+            raise ValueError(f"Неизвестный браузерный движок: {self.browser_engine}")
+        if not self.chromedriver_path:
+            self.chromedriver_path = resolve_chromedriver(self.chromedriver_cache)
+        return SeleniumEngine(self.chromedriver_path, self.text_input_engine)
+
+    @staticmethod
+    def _finish_phase(timings, name, phase_start):
+        """Записывает длительность этапа запуска и возвращает начало следующего"""
+        now = time.monotonic()
+        timings[name] = now - phase_start
+        return now
 
     def scan_pending_tasks(self):
-        """Сканирует папку pending на наличие задач"""
-        pattern = os.path.join(self.pending_dir, "*.json")
-        task_files = glob.glob(pattern)
-        tasks = []
-        
-        for file_path in task_files:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    task = json.load(f)
-                task['_filepath'] = file_path
-                tasks.append(task)
-            except Exception as e:
-                print(f"Ошибка чтения файла {file_path}: {e}")
-                
-        return tasks
+        """Получает задачи, ожидающие отправки"""
+        # Фильтр по шарду - внутри скана, иначе чужие задачи съедают весь лимит
+        return self.queue.scan(self.shard.owns if self.shard else None)
 
     def group_tasks_by_chat(self, tasks):
         """Группирует задачи по чатам"""
@@ -177,140 +447,417 @@ class WhatsAppWorker:
         return dict(grouped)
 
     def process_grouped_tasks(self, grouped_tasks):
-        """Обрабатывает сгруппированные задачи"""
+        """Обрабатывает сгруппированные задачи, возвращает число запланированных"""
         # Проверяем, что мы всё ещё работаем
         if not self.running:
-            return
+            return 0
             
-        # Сортируем чаты по количеству задач (больше задач = выше приоритет)
-        sorted_chats = sorted(grouped_tasks.items(), key=lambda x: len(x[1]), reverse=True)
+        # План цикла: срочные задачи первыми, остальным чатам - по кванту
+        with self.tracer.span("schedule"):
+            plan = self.scheduler.plan(grouped_tasks)
         
-        for chat_name, tasks in sorted_chats:
+        for position, (chat_name, tasks) in enumerate(plan):
             if not self.running:
                 break
                 
+            # Пока шли предыдущие чаты, часть задач могла устареть
+            tasks = self._drop_expired(tasks)
+            if not tasks:
+                continue
+                
+            # Браузер завис - оставшиеся задачи ждут в pending до перезапуска
+            if not self._probe_browser():
+                break
+                
+            # Готовим картинки текущего и следующих чатов в фоне
+            self._prefetch_images(plan[position:position + 1 + self.prefetch_chats])
+            
             print(f"Обработка чата '{chat_name}' ({len(tasks)} задач)")
             
             # Открываем чат один раз
-            if self.open_chat(chat_name):
+            with self.metrics.time("whatsapp_stage_seconds", stage="chat_open"), \
+                    self.tracer.span("open_chat", chat=chat_name):
+                try:
+                    with self.watchdog.guard("open_chat", self.operation_timeout):
+                        chat_opened = self.open_chat(chat_name)
+                except EngineError as e:
+                    print(f"Ошибка открытия чата '{chat_name}': {e}")
+                    chat_opened = False
+            if self.watchdog.tripped:
+                break
+            if chat_opened:
                 # Обрабатываем все задачи этого чата
-                for task in tasks:
-                    if not self.running:
+                for batch in self._split_batches(tasks):
+                    if not self.running or self.watchdog.tripped:
                         break
-                    self.process_single_task(task)
-                    time.sleep(2)  # Пауза между сообщениями
+                    self._pace()
+                    if len(batch) > 1 and batch[0]['content_type'] == 'text':
+                        self.process_text_batch(batch)
+                    elif len(batch) > 1:
+                        self.process_album(batch)
+                    else:
+                        self.process_single_task(batch[0])
+                if self.watchdog.tripped:
+                    break
+                self._release_handles()
+            elif self.running:
+                # Иначе несуществующий чат искался бы заново каждый цикл
+                self._fail_chat(chat_name, tasks)
                     
-            # Проверяем, нужен ли перезапуск браузера
-            if self.operation_count > self.max_operations and self.running:
-                print("Перезапуск браузера...")
+            # Проверяем, не раздулся ли браузер
+            reason = self.recycle_policy.should_recycle(self.chrome_tree, self.operation_count)
+            if reason and self.running:
+                print(f"Перезапуск браузера: {reason}")
                 self.init_browser()
+        return sum(len(tasks) for _, tasks in plan)
+
+    def _fail_chat(self, chat_name, tasks):
+        """Чат не открылся - задачи уходят в повторы с задержкой, а после лимита попыток в dead"""
+        for task in tasks:
+            try:
+                if self.queue.claim(task):
+                    self._fail_task(task, f"Не удалось открыть чат '{chat_name}'")
+            except Exception as e:
+                print(f"Ошибка переноса задачи {task['id']} в failed: {e}")
+
+    def _release_handles(self):
+        """Ссылки на элементы этого чата больше не нужны"""
+        try:
+            self.browser.release_handles()
+        except Exception as e:
+            print(f"Ошибка освобождения элементов страницы: {e}")
+
+    def _prefetch_images(self, chats):
+        if not self.images:
+            return
+        for _, tasks in chats:
+            for task in tasks:
+                if task['content_type'] == 'image' and task.get('file_path'):
+                    self.images.prefetch(task['file_path'])
+
+    def _prepared_image(self, file_path):
+        """Путь к уменьшенной копии картинки или к исходному файлу"""
+        if not self.images:
+            return file_path
+        return self.images.get(file_path)
+
+    def _split_batches(self, tasks):
+        """Делит задачи чата на альбомы, склеиваемые тексты и одиночные задачи"""
+        batches = []
+        merged_chars = 0
+        for task in tasks:
+            previous = batches[-1][-1] if batches else None
+            if (self.album_mode and task['content_type'] == 'image' and previous
+                    and previous['content_type'] == 'image'
+                    and len(batches[-1]) < self.album_max_size):
+                batches[-1].append(task)
+            elif (self._mergeable(task) and previous and self._mergeable(previous)
+                    and merged_chars + 1 + self._message_length(task) <= self.merge_text_max_chars):
+                batches[-1].append(task)
+                merged_chars += 1 + self._message_length(task)
+            else:
+                batches.append([task])
+                merged_chars = self._message_length(task) if self._mergeable(task) else 0
+        return batches
+
+    @staticmethod
+    def _message_length(task):
+        """Длина текста; у файловой очереди тело до захвата не загружено, длина - из индекса"""
+        message = task.get('message')
+        if isinstance(message, str):
+            return len(message)
+        return task.get('_message_length')
+
+    def _mergeable(self, task):
+        length = self._message_length(task)
+        return (self.merge_text_max_chars > 0 and task['content_type'] == 'text'
+                and length is not None and length <= self.merge_text_max_chars)
+
+    def _pace(self):
+        """Выдерживает минимальный интервал между отправками"""
+        delay = self._last_send_at + self.min_message_interval - time.monotonic()
+        if delay > 0:
+            with self.tracer.span("pace", seconds=round(delay, 3)):
+                time.sleep(delay)
+        self._last_send_at = time.monotonic()
+
+    def _wait_chat_header(self, contact_name):
+        """Ждёт, пока в заголовке окажется нужный чат"""
+        if not self.browser.wait_for(HEADER_MATCHES_SCRIPT, contact_name, timeout=self.completion_timeout):
+            raise EngineError(f"в заголовке не появился чат '{contact_name}'")
+
+    def _last_outgoing_id(self):
+        last = self.browser.execute_script(LAST_OUTGOING_SCRIPT)
+        return last[0] if last else None
+
+    def _wait_outgoing_message(self, previous_id):
+        """Ждёт новый исходящий пузырь с часами или галочками"""
+        if self.browser.wait_for(OUTGOING_APPEARED_SCRIPT, previous_id, timeout=self.completion_timeout):
+            return True
+        print("Отправленное сообщение не появилось в чате")
+        return False
+
+    def _wait_attachment_preview(self):
+        """Ждёт, пока превью вложения загрузится"""
+        if not self.browser.wait_for(PREVIEW_READY_SCRIPT, timeout=self.completion_timeout):
+            print("Превью вложения не загрузилось, пробуем отправить")
 
     def open_chat(self, contact_name):
         """Открывает чат"""
         try:
-            if not self.driver:
+            if not self.browser:
                 return False
                 
+            # Чат уже открыт - сверяемся с заголовком и ничего не переключаем
+            if self.current_chat == contact_name:
+                if self.browser.execute_script(CHAT_HEADER_SCRIPT) == contact_name:
+                    return True
+                self.current_chat = None
+                
+            # Чат виден в боковой панели - кликаем без поиска
+            if self._open_from_side_panel(contact_name):
+                self.current_chat = contact_name
+                print(f"Чат '{contact_name}' открыт из списка")
+                return True
+                
             # Поиск чата
-            search_selectors = [
-                (By.CSS_SELECTOR, '[aria-label="Поиск контактов или групп"]'),
-                (By.CSS_SELECTOR, '[aria-label="Search contacts or groups"]'),
-                (By.XPATH, '//div[@contenteditable="true" and @data-tab="3"]'),
-            ]
-            
-            search_box = None
-            for by_type, selector in search_selectors:
-                try:
-                    search_box = WebDriverWait(self.driver, 5).until(
-                        EC.presence_of_element_located((by_type, selector))
-                    )
-                    break
-                except TimeoutException:
-                    continue
-                    
+            search_box = self.selectors.find(self.browser, "search_box", timeout=5)
             if not search_box:
                 print("Не удалось найти поле поиска")
                 return False
                 
-            search_box.clear()
-            search_box.send_keys(contact_name)
-            time.sleep(1)
+            self.browser.clear(search_box)
+            self.browser.type_text(search_box, contact_name)
             
-            # Открываем чат
-            contact = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, f'//span[@title="{contact_name}"]'))
-            )
-            contact.click()
-            time.sleep(1)
+            # Открываем чат, как только он появится в результатах поиска
+            contact = self.browser.wait_for(SEARCH_RESULT_SCRIPT, contact_name, timeout=10)
+            if contact is None:
+                raise EngineError(f"чат '{contact_name}' не найден в результатах поиска")
+            self.browser.click(contact)
+            self._wait_chat_header(contact_name)
+            self.current_chat = contact_name
             
             print(f"Чат '{contact_name}' открыт")
             return True
             
         except Exception as e:
+            self.current_chat = None
             print(f"Ошибка открытия чата '{contact_name}': {e}")
             return False
 
+    def _open_from_side_panel(self, contact_name):
+        """Открывает чат кликом в боковой панели, если он там виден"""
+        # Свежий индекс говорит, что чата в панели нет - сразу идём в поиск
+        index_fresh = time.monotonic() - self.side_chats_updated < self.side_index_ttl
+        if index_fresh and contact_name not in self.side_chats:
+            return False
+            
+        titles, row = self.browser.execute_script(SIDE_PANEL_SCRIPT, contact_name)
+        self.side_chats = set(titles)
+        self.side_chats_updated = time.monotonic()
+        if row is None:
+            return False
+            
+        try:
+            self.browser.click(row)
+            self._wait_chat_header(contact_name)
+            return True
+        except Exception as e:
+            print(f"Не удалось открыть '{contact_name}' из списка: {e}")
+            return False
+
     def process_single_task(self, task):
         """Обрабатывает одну задачу"""
+        claimed = False
         try:
-            # Перемещаем в processing
-            processing_path = os.path.join(self.processing_dir, os.path.basename(task['_filepath']))
-            os.rename(task['_filepath'], processing_path)
+            # Забираем задачу в processing
+            if not self.queue.claim(task):
+                print(f"Задача {task['id']} уже взята в обработку")
+                return
+            claimed = True
+            self._trace_queue_wait(task)
             
-            # Обрабатываем в зависимости от типа
-            if task['content_type'] == 'text':
-                success = self.send_message(task['message'])
-            elif task['content_type'] == 'image':
-                success = self.send_file(task['file_path'], task['message'])
-            else:
-                print(f"Неизвестный тип контента: {task['content_type']}")
-                success = False
-                
-            if success:
-                # Удаляем при успехе
-                os.remove(processing_path)
-                print(f"Задача {task['id']} выполнена успешно")
-                self.operation_count += 1
-            else:
-                # Перемещаем в failed
-                self.move_to_failed(processing_path, task, "Ошибка отправки")
+            with self.tracer.span("task", id=task['id'], content_type=task['content_type']):
+                success = self._send_task(task)
+            self._finish_task(task, success)
                 
         except Exception as e:
             print(f"Критическая ошибка обработки задачи {task['id']}: {e}")
+            if claimed:
+                try:
+                    self._fail_task(task, str(e))
+                except:
+                    pass
+
+    def _trace_queue_wait(self, task):
+        """Время от постановки задачи в очередь до захвата"""
+        if task.get('_enqueued_at'):
+            self.tracer.record("queue_wait", task['_enqueued_at'], time.time(),
+                               tid=QUEUE_TID, id=task['id'], target=task['target'])
+
+    def _send_task(self, task):
+        """Отправляет уже захваченную задачу в зависимости от типа"""
+        if task['content_type'] == 'text':
+            with self.metrics.time("whatsapp_stage_seconds", stage="text_send"), \
+                    self.watchdog.guard("send_message", self.operation_timeout):
+                return self.send_message(task['message'])
+        if task['content_type'] == 'image':
+            # Файл могли удалить после постановки: это постоянная ошибка, без повторов
+            if not task.get('file_path') or not os.path.isfile(task['file_path']):
+                raise FileNotFoundError(f"Файл не найден: {task.get('file_path')}")
+            file_path = self._prepared_image(task['file_path'])
+            with self.metrics.time("whatsapp_stage_seconds", stage="upload"), \
+                    self.watchdog.guard("send_file", self.operation_timeout):
+                return self.send_file(file_path, task['message'])
+        raise ValueError(f"Неизвестный тип контента: {task['content_type']}")
+
+    def _finish_task(self, task, success):
+        if success:
+            # Удаляем при успехе
+            self.queue.complete(task)
+            print(f"Задача {task['id']} выполнена успешно")
+            self.operation_count += 1
+            self.scheduler.record_send(task['target'])
+            self.metrics.inc("whatsapp_tasks_total", result="sent", content_type=task['content_type'])
+        else:
+            # Перемещаем в failed
+            self._fail_task(task, "Ошибка отправки")
+
+    def _fail_task(self, task, error_message):
+        if self.watchdog.tripped:
+            # Браузер завис посреди отправки - это не попытка, задача просто ждёт перезапуска
+            self._requeue_task(task)
+            return
+        self.metrics.inc("whatsapp_tasks_total", result="failed", content_type=task.get('content_type'))
+        self.queue.fail(task, error_message)
+        self.retries.schedule(task, error_message)
+
+    def _requeue_task(self, task):
+        try:
+            if self.queue.requeue(task):
+                print(f"Задача {task['id']} возвращена в pending")
+                self.metrics.inc("whatsapp_tasks_total", result="requeued",
+                                 content_type=task.get('content_type'))
+        except Exception as e:
+            # Не вернули сейчас - вернёт сборщик истёкших аренд
+            print(f"Ошибка возврата задачи {task['id']} в pending: {e}")
+
+    def _update_queue_gauges(self):
+        """Размеры pending/processing/failed, не чаще раза в несколько секунд"""
+        if not self.metrics.enabled:
+            return
+        now = time.monotonic()
+        if now - self._queue_gauges_at < self.queue_gauges_interval:
+            return
+        self._queue_gauges_at = now
+        for state, count in self.queue.counts().items():
+            self.metrics.set_gauge("whatsapp_queue_tasks", count, state=state)
+
+    def process_album(self, tasks):
+        """Отправляет несколько картинок в открытый чат одной загрузкой"""
+        batch = []
+        for task in tasks:
+            try:
+                if not self.queue.claim(task):
+                    print(f"Задача {task['id']} уже взята в обработку")
+                    continue
+            except Exception as e:
+                print(f"Ошибка захвата задачи {task['id']}: {e}")
+                continue
+                
+            self._trace_queue_wait(task)
+            
+            # Битые задачи отсеиваем до загрузки, чтобы не ронять весь альбом
+            file_path = task.get('file_path')
+            if not file_path or not os.path.isfile(file_path):
+                self._fail_task(task, f"Файл не найден: {file_path}")
+                continue
+            batch.append(task)
+            
+        if not batch:
+            return
+            
+        success = None
+        if len(batch) > 1:
             try:
-                self.move_to_failed(processing_path, task, str(e))
-            except:
-                pass
+                file_paths = [self._prepared_image(task['file_path']) for task in batch]
+                with self.metrics.time("whatsapp_stage_seconds", stage="upload_album"), \
+                        self.tracer.span("album", tasks=len(batch)), \
+                        self.watchdog.guard("send_album", self.operation_timeout):
+                    success = self.send_album(file_paths, [task.get('message') for task in batch])
+            except Exception as e:
+                print(f"Ошибка отправки альбома: {e}")
+                success = False
+                
+        if success is None:
+            # Альбом не собрался - отправляем картинки по одной
+            for number, task in enumerate(batch):
+                if number:
+                    self._pace()
+                try:
+                    self._finish_task(task, self._send_task(task))
+                except Exception as e:
+                    print(f"Критическая ошибка обработки задачи {task['id']}: {e}")
+                    self._fail_task(task, str(e))
+            return
+            
+        print(f"Альбом из {len(batch)} файлов {'отправлен' if success else 'не отправлен'}")
+        for task in batch:
+            self._finish_task(task, success)
+
+    def process_text_batch(self, tasks):
+        """Отправляет несколько коротких текстов в открытый чат одним сообщением"""
+        batch = []
+        for task in tasks:
+            try:
+                if not self.queue.claim(task):
+                    print(f"Задача {task['id']} уже взята в обработку")
+                    continue
+            except Exception as e:
+                print(f"Ошибка захвата задачи {task['id']}: {e}")
+                continue
+            self._trace_queue_wait(task)
+            batch.append(task)
+            
+        if not batch:
+            return
+            
+        # Строки идут в порядке постановки задач, каждая задача - отдельной строкой
+        message = "\n".join(task['message'] for task in batch)
+        try:
+            with self.metrics.time("whatsapp_stage_seconds", stage="text_send"), \
+                    self.tracer.span("merged_text", tasks=len(batch)), \
+                    self.watchdog.guard("send_message", self.operation_timeout):
+                success = self.send_message(message)
+        except Exception as e:
+            print(f"Ошибка отправки объединённого сообщения: {e}")
+            success = False
+            
+        if len(batch) > 1:
+            print(f"{len(batch)} сообщений объединены в одно: {'отправлено' if success else 'не отправлено'}")
+            if success:
+                self.metrics.inc("whatsapp_merged_tasks_total", len(batch))
+        for task in batch:
+            self._finish_task(task, success)
 
     def send_message(self, message):
         """Отправляет текстовое сообщение"""
         try:
-            if not self.driver:
+            if not self.browser:
                 return False
                 
-            message_selectors = [
-                (By.CSS_SELECTOR, 'div[aria-label="Введите сообщение"]'),
-                (By.CSS_SELECTOR, 'div[aria-label="Type a message"]'),
-                (By.XPATH, '//div[@contenteditable="true" and @data-tab="10"]'),
-            ]
-            
-            message_box = None
-            for by_type, selector in message_selectors:
-                try:
-                    message_box = WebDriverWait(self.driver, 5).until(
-                        EC.presence_of_element_located((by_type, selector))
-                    )
-                    break
-                except TimeoutException:
-                    continue
-                    
+            message_box = self.selectors.find(self.browser, "message_box", timeout=5)
             if not message_box:
                 print("Не удалось найти поле для сообщения")
                 return False
                 
-            message_box.send_keys(message)
-            message_box.send_keys(Keys.ENTER)
-            return True
+            # Последний пузырь запоминаем, пока печатается текст: до Enter новый не появится
+            previous_id, _ = self.browser.concurrently(
+                self._last_outgoing_id,
+                lambda: self.browser.type_text(message_box, message),
+            )
+            self.browser.press_key(message_box, "Enter")
+            return self._wait_outgoing_message(previous_id)
             
         except Exception as e:
             print(f"Ошибка отправки сообщения: {e}")
@@ -319,134 +866,138 @@ class WhatsAppWorker:
     def send_file(self, file_path, caption):
         """Отправляет файл"""
         try:
-            if not self.driver:
+            if not self.browser:
                 return False
                 
             # Нажимаем на кнопку "Прикрепить"
-            attach_selectors = [
-                (By.CSS_SELECTOR, 'button[title="Прикрепить"]'),
-                (By.CSS_SELECTOR, 'button[title="Attach"]'),
-                (By.CSS_SELECTOR, 'span[data-icon="clip"]'),
-            ]
-            
-            attach_btn = None
-            for by_type, selector in attach_selectors:
-                try:
-                    attach_btn = WebDriverWait(self.driver, 3).until(
-                        EC.element_to_be_clickable((by_type, selector))
-                    )
-                    break
-                except TimeoutException:
-                    continue
-                    
+            attach_btn = self.selectors.find(self.browser, "attach_button", timeout=3, clickable=True)
             if not attach_btn:
                 print("Не удалось найти кнопку прикрепления")
                 return False
                 
-            attach_btn.click()
+            self.browser.click(attach_btn)
             
             # Находим input для файлов
-            file_input = WebDriverWait(self.driver, 4).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, 'input[type="file"][accept*="image"]'))
-            )
+            file_input = self.selectors.find(self.browser, "file_input", timeout=4)
+            if not file_input:
+                print("Не удалось найти поле выбора файла")
+                return False
             
             absolute_file_path = os.path.abspath(file_path)
-            file_input.send_keys(absolute_file_path)
-            time.sleep(3)
+            previous_id, _ = self.browser.concurrently(
+                self._last_outgoing_id,
+                lambda: self.browser.upload(file_input, [absolute_file_path]),
+            )
+            self._wait_attachment_preview()
             
             # Добавляем подпись, если есть
             if caption:
-                caption_selectors = [
-                    (By.CSS_SELECTOR, 'div[aria-label="Введите сообщение"]'),
-                    (By.CSS_SELECTOR, 'div[aria-label="Type a message"]'),
-                ]
-                
-                caption_box = None
-                for by_type, selector in caption_selectors:
-                    try:
-                        caption_box = WebDriverWait(self.driver, 1).until(
-                            EC.presence_of_element_located((by_type, selector))
-                        )
-                        break
-                    except TimeoutException:
-                        continue
-                        
+                caption_box = self.selectors.find(self.browser, "caption_box", timeout=1)
                 if caption_box:
-                    caption_box.send_keys(caption)
+                    self.browser.type_text(caption_box, caption)
                     
             # Кликаем на кнопку отправки
-            send_selectors = [
-                'div[aria-label="Отправить"]',
-                'div[aria-label="Send"]',
-                'div[data-icon="wds-ic-send-filled"]',
-                '[data-icon="wds-ic-send-filled"]'
-            ]
-            
-            for selector in send_selectors:
-                try:
-                    send_btn = WebDriverWait(self.driver, 3).until(
-                        EC.element_to_be_clickable((By.CSS_SELECTOR, selector))
-                    )
-                    send_btn.click()
-                    return True
-                except TimeoutException:
-                    continue
-                    
-            print("Не удалось найти кнопку отправки")
-            return False
+            send_btn = self.selectors.find(self.browser, "send_button", timeout=3, clickable=True)
+            if not send_btn:
+                print("Не удалось найти кнопку отправки")
+                return False
+                
+            self.browser.click(send_btn)
+            return self._wait_outgoing_message(previous_id)
             
         except Exception as e:
             print(f"Ошибка отправки файла: {e}")
             return False
 
-    def move_to_failed(self, processing_path, task, error_message):
-        """Перемещает задачу в папку failed с логом ошибки"""
-        if 'attempts' not in task:
-            task['attempts'] = 0
-        task['attempts'] += 1
-        task['last_error'] = error_message
-        task['failed_time'] = time.time()
+    def send_album(self, file_paths, captions):
+        """Отправляет несколько файлов одним выбором. None - альбом не поддерживается"""
+        if not self.browser:
+            return False
+            
+        attach_btn = self.selectors.find(self.browser, "attach_button", timeout=3, clickable=True)
+        if not attach_btn:
+            print("Не удалось найти кнопку прикрепления")
+            return False
+            
+        self.browser.click(attach_btn)
         
-        failed_path = os.path.join(self.failed_dir, os.path.basename(processing_path))
+        file_input = self.selectors.find(self.browser, "file_input", timeout=4)
+        if not file_input:
+            print("Не удалось найти поле выбора файла")
+            return False
+            
+        if not self.browser.execute_script("return arguments[0].hasAttribute('multiple');", file_input):
+            print("Поле выбора файла не принимает несколько файлов")
+            self._close_overlay()
+            return None
+            
+        absolute_paths = [os.path.abspath(path) for path in file_paths]
+        previous_id, _ = self.browser.concurrently(
+            self._last_outgoing_id,
+            lambda: self.browser.upload(file_input, absolute_paths),
+        )
+        self._wait_attachment_preview()
         
-        try:
-            with open(failed_path, 'w', encoding='utf-8') as f:
-                json.dump(task, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            print(f"Ошибка записи в failed: {e}")
+        # Каждой картинке - своя подпись через карусель предпросмотра
+        thumbnails = self.browser.execute_script(ALBUM_THUMBNAILS_SCRIPT)
+        if len(thumbnails) != len(file_paths):
+            print(f"В предпросмотре {len(thumbnails)} файлов вместо {len(file_paths)}")
+            self._close_overlay()
+            return None
             
+        for thumbnail, caption in zip(thumbnails, captions):
+            if not caption:
+                continue
+            self.browser.click(thumbnail)
+            caption_box = self.selectors.find(self.browser, "caption_box", timeout=1)
+            if caption_box:
+                self.browser.type_text(caption_box, caption)
+                
+        send_btn = self.selectors.find(self.browser, "send_button", timeout=3, clickable=True)
+        if not send_btn:
+            print("Не удалось найти кнопку отправки")
+            return False
+            
+        self.browser.click(send_btn)
+        return self._wait_outgoing_message(previous_id)
+
+    def _close_overlay(self):
+        """Закрывает меню вложений или предпросмотр"""
         try:
-            os.remove(processing_path)
-        except Exception as e:
-            print(f"Ошибка удаления файла из processing: {e}")
+            self.browser.press_key(None, "Escape")
+        except Exception:
+            pass
 
     def cleanup(self):
         """Очистка ресурсов"""
+        # Вызывается из atexit и ещё раз из __del__: второй раз ничего не делаем,
+        # иначе при завершении интерпретатора падаем на уже выгруженных модулях
+        if self._cleaned_up:
+            return
+        self._cleaned_up = True
         print("Выполняется cleanup...")
         
-        if self.driver:
-            try:
-                self.driver.quit()
-                print("Драйвер закрыт")
-            except Exception as e:
-                print(f"Ошибка при закрытии драйвера: {e}")
-            finally:
-                self.driver = None
-                
-        if self.service:
-            try:
-                self.service.stop()
-                print("Сервис остановлен")
-            except Exception as e:
-                print(f"Ошибка при остановке сервиса: {e}")
-            finally:
-                self.service = None
-                
-        # Убиваем процессы Chrome
-        self._kill_chrome_processes()
+        if self.watcher:
+            self.watcher.close()
+            self.watcher = None
+            
+        if self.heartbeat:
+            self.heartbeat.close()
+            self.heartbeat = None
+            
+        if self.images:
+            self.images.close()
+            
+        self.tracer.close()
+        self.watchdog.close()
+        
+        # Закрываем браузер и убиваем процессы своего Chrome
+        self._close_browser()
         
         print("Cleanup завершён")
+        atexit.unregister(self.cleanup)
 
     def __del__(self):
         """Деструктор для гарантии cleanup"""
-        self.cleanup()
+        if not getattr(self, "_cleaned_up", True):
+            self.cleanup()
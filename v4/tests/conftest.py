@@ -0,0 +1,5 @@
+# Модули сервиса импортируются по плоским именам, как при запуске из v4/service
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "service"))
@@ -0,0 +1,18 @@
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from image_cache import ImagePreprocessor
+
+
+def test_transparent_png_is_flattened_on_white(tmp_path):
+    source = tmp_path / "logo.png"
+    Image.new("RGBA", (4, 4), (0, 0, 0, 0)).save(source)
+
+    images = ImagePreprocessor(cache_dir=str(tmp_path / "cache"))
+    prepared = images.get(str(source))
+
+    assert prepared != str(source)
+    with Image.open(prepared) as result:
+        assert result.mode == "RGB"
+        assert all(channel > 250 for channel in result.getpixel((0, 0)))
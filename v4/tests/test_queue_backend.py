@@ -0,0 +1,116 @@
+import os
+import time
+
+import pytest
+
+from producer import QueueFullError, TaskWriter, validate_task
+from queue_backend import create_backend
+from scheduler import ChatScheduler
+
+
+def _queue(tmp_path):
+    for state in ("pending", "processing", "failed", "dead"):
+        os.makedirs(tmp_path / "whatsapp" / state, exist_ok=True)
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize("kind", ["file", "sqlite"])
+def test_scan_window_is_fair_per_chat(tmp_path, kind):
+    queue_dir = _queue(tmp_path)
+    writer = TaskWriter(queue_dir, backend=kind, durable=False)
+    now = time.time()
+    writer.write([validate_task({"target": "Bulk", "message": "m", "enqueued_at": now + i})
+                  for i in range(600)])
+    writer.write([validate_task({"target": "Small", "message": "m", "enqueued_at": now + 1000})])
+    writer.close()
+
+    backend = create_backend(kind, queue_dir=queue_dir, import_pending=False)
+    tasks = backend.scan()
+    targets = [task["target"] for task in tasks]
+    assert "Small" in targets
+    assert targets.count("Bulk") == backend.scan_per_target
+
+    grouped = {}
+    for task in tasks:
+        grouped.setdefault(task["target"], []).append(task)
+    plan = dict(ChatScheduler(quantum=10).plan(grouped))
+    assert len(plan["Small"]) == 1
+    backend.close()
+
+
+def test_sqlite_scan_includes_negative_priority(tmp_path):
+    queue_dir = _queue(tmp_path)
+    writer = TaskWriter(queue_dir, backend="sqlite", durable=False)
+    writer.write([validate_task({"target": "A", "message": "m", "priority": -1})])
+    writer.close()
+    backend = create_backend("sqlite", queue_dir=queue_dir, import_pending=False)
+    assert len(backend.scan()) == 1
+    backend.close()
+
+
+@pytest.mark.parametrize("kind", ["file", "sqlite"])
+def test_scan_applies_shard_filter_before_limit(tmp_path, kind):
+    queue_dir = _queue(tmp_path)
+    writer = TaskWriter(queue_dir, backend=kind, durable=False)
+    now = time.time()
+    writer.write([validate_task({"target": f"Other{i % 7}", "message": "m", "enqueued_at": now + i})
+                  for i in range(300)])
+    writer.write([validate_task({"target": "Mine", "message": "m", "enqueued_at": now + 1000})])
+    writer.close()
+
+    backend = create_backend(kind, queue_dir=queue_dir, import_pending=False)
+    backend.scan_limit = 100
+    tasks = backend.scan(lambda target: target == "Mine")
+    assert [task["target"] for task in tasks] == ["Mine"]
+    backend.close()
+
+
+def test_hashed_index_sees_files_in_pending_root(tmp_path):
+    queue_dir = _queue(tmp_path)
+    writer = TaskWriter(queue_dir, durable=False)
+    writer.write([validate_task({"target": "A", "message": "m"})])
+    writer.close()
+
+    backend = create_backend("file", queue_dir=queue_dir, hashed_subdirs=True)
+    assert [task["target"] for task in backend.scan()] == ["A"]
+    assert backend.counts()["pending"] == 1
+
+
+@pytest.mark.parametrize("kind", ["file", "sqlite"])
+def test_drop_oldest_makes_room_in_several_chats(tmp_path, kind):
+    queue_dir = _queue(tmp_path)
+    writer = TaskWriter(queue_dir, backend=kind, durable=False, max_per_target=2,
+                        overflow="drop_oldest")
+    now = time.time()
+    writer.write([validate_task({"target": target, "message": "old", "id": f"{target}-old{i}",
+                                 "enqueued_at": now + i})
+                  for target in ("X", "Y") for i in range(2)])
+    writer.write([validate_task({"target": target, "message": "new", "id": f"{target}-new"})
+                  for target in ("X", "Y")])
+    writer.close()
+
+    backend = create_backend(kind, queue_dir=queue_dir, import_pending=False)
+    assert sorted(task["id"] for task in backend.scan()) == ["X-new", "X-old1", "Y-new", "Y-old1"]
+    assert backend.counts()["dead"] == 2
+    backend.close()
+
+
+def test_queue_client_fallback_uses_config(tmp_path, monkeypatch):
+    import runwork
+    from producer import QueueClient
+
+    queue_dir = _queue(tmp_path)
+    db_path = str(tmp_path / "queue.db")
+    config = type("config", (), {"QUEUE_BACKEND": "sqlite", "QUEUE_DB_PATH": db_path,
+                                 "QUEUE_MAX_PER_TARGET": 1, "INGEST_DURABLE": False})
+    monkeypatch.setattr(runwork, "config", config)
+
+    client = QueueClient(socket_path=str(tmp_path / "missing.sock"), queue_dir=queue_dir)
+    client.enqueue("Chat", "first")
+    with pytest.raises(QueueFullError):
+        client.enqueue("Chat", "second")
+    client.close()
+
+    backend = create_backend("sqlite", queue_dir=queue_dir, db_path=db_path, import_pending=False)
+    assert [task["message"] for task in backend.scan()] == ["first"]
+    backend.close()
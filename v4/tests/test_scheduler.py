@@ -0,0 +1,40 @@
+import time
+
+from scheduler import ChatScheduler
+
+
+def _task(target, enqueued_at, **fields):
+    return dict(fields, id=f"{target}-{enqueued_at}", target=target, content_type="text",
+                enqueued_at=enqueued_at)
+
+
+def test_plan_gives_each_chat_a_quantum():
+    scheduler = ChatScheduler(quantum=2, round_tasks=10)
+    grouped = {
+        "Bulk": [_task("Bulk", i) for i in range(20)],
+        "Small": [_task("Small", 100)],
+    }
+    plan = dict(scheduler.plan(grouped))
+    assert len(plan["Bulk"]) == 2
+    assert len(plan["Small"]) == 1
+
+
+def test_plan_urgent_first_and_rate_limit():
+    scheduler = ChatScheduler(quantum=5, rate_limits={"Limited": 1})
+    scheduler.record_send("Limited")
+    grouped = {
+        "Limited": [_task("Limited", 1)],
+        "Other": [_task("Other", 2), _task("Other", 3, priority=5)],
+    }
+    plan = scheduler.plan(grouped)
+    assert [chat for chat, _ in plan] == ["Other", "Other"]
+    assert plan[0][1][0]["priority"] == 5
+    assert 0 < scheduler.next_ready_in() <= 60
+
+
+def test_next_ready_in_ignores_drained_chats():
+    scheduler = ChatScheduler(rate_limits={"A": 1}, rate_period=0.05)
+    scheduler.record_send("A")
+    time.sleep(0.1)
+    assert scheduler.plan({}) == []
+    assert scheduler.next_ready_in() is None
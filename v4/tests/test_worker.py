@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from producer import TaskWriter, validate_task
+from whatswork import WhatsAppWorker
+
+
+@pytest.fixture
+def worker(tmp_path):
+    queue_dir = str(tmp_path / "queue")
+    for state in ("pending", "processing", "failed", "dead"):
+        os.makedirs(os.path.join(queue_dir, "whatsapp", state))
+    worker = WhatsAppWorker(queue_dir=queue_dir, profile_path=str(tmp_path / "profile"))
+    yield worker
+    worker.cleanup()
+
+
+def test_missing_image_goes_to_dead_without_retry(worker, tmp_path):
+    image = tmp_path / "photo.jpg"
+    image.write_bytes(b"jpeg")
+    writer = TaskWriter(worker.queue_dir, durable=False)
+    writer.write([validate_task({"target": "Chat", "file_path": str(image)})])
+    writer.close()
+    image.unlink()
+
+    task, = worker.scan_pending_tasks()
+    worker.process_single_task(task)
+
+    counts = worker.queue.counts()
+    assert counts["dead"] == 1
+    assert counts["failed"] == 0
+    assert len(worker.retries) == 0
+
+
+def test_cleanup_runs_once_and_survives_broken_pidfile(worker, capsys):
+    os.makedirs(worker.profile_path)
+    with open(worker.chrome_tree.pidfile, 'w') as f:
+        f.write('{"processes": [["x"]]}')
+
+    worker.cleanup()
+    worker.cleanup()
+    worker.__del__()
+
+    out = capsys.readouterr().out
+    assert out.count("Выполняется cleanup...") == 1
+    assert "Ошибка чтения" in out